@@ -0,0 +1,163 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from absl import app
+from absl import flags
+from absl import logging
+
+import time
+import numpy as np
+
+from bert import tokenization
+from readers import text_utils
+
+flags.DEFINE_string('bert_vocab_file',
+                    'data/bert/tf1.x/BERT-Base/vocab.txt',
+                    'Path to the Bert vocabulary file.')
+
+flags.DEFINE_boolean('do_lower_case', True,
+                     'To be passed to the bert tokenizer.')
+
+flags.DEFINE_integer('num_examples', 2000,
+                     'Number of synthetic annotations to process.')
+
+flags.DEFINE_integer('num_words', 5000,
+                     'Number of distinct words in the synthetic annotations.')
+
+FLAGS = flags.FLAGS
+
+NUM_CHOICES = 4
+MASKING_OFFSET = 10000
+
+
+def _legacy_fix_tokenization(tokenized_sent, obj_to_type, old_det_to_new_ind,
+                             bert_tokenizer, do_lower_case):
+  """The per-token `_fix_tokenization` of create_vcr_tfrecord.py."""
+  case_fn = lambda x: x.lower() if do_lower_case else x
+
+  new_tokenization_with_tags = []
+  for tok in tokenized_sent:
+    if isinstance(tok, list):
+      for idx in tok:
+        mask_flag = False
+        if idx >= MASKING_OFFSET:
+          mask_flag = True
+          idx -= MASKING_OFFSET
+        if old_det_to_new_ind is not None:
+          idx = old_det_to_new_ind[idx]
+
+        obj_type = obj_to_type[idx]
+        text_to_use = obj_type
+        if obj_type == 'person':
+          names = text_utils.GENDER_NEUTRAL_NAMES
+          text_to_use = names[idx % len(names)]
+        if mask_flag:
+          new_tokenization_with_tags.append(('[MASK]', idx))
+        else:
+          new_tokenization_with_tags.append((case_fn(text_to_use), idx))
+    else:
+      if tok == '[MASK]':
+        new_tokenization_with_tags.append((tok, -1))
+      else:
+        for sub_tok in bert_tokenizer.wordpiece_tokenizer.tokenize(
+            case_fn(tok)):
+          new_tokenization_with_tags.append((sub_tok, -1))
+
+  tokenized_sent, tags = zip(*new_tokenization_with_tags)
+  return list(tokenized_sent), list(tags)
+
+
+def _legacy_normalize_boxes(boxes, image_width, image_height):
+  boxes = np.array(boxes, dtype=np.float64)
+  xmin, ymin, xmax, ymax, score = [boxes[:, i] for i in range(5)]
+  xmin /= image_width
+  ymin /= image_height
+  xmax /= image_width
+  ymax /= image_height
+  return (xmin.tolist(), ymin.tolist(), xmax.tolist(), ymax.tolist(),
+          score.tolist())
+
+
+def _create_synthetic_annotations(vocab, num_examples, num_words):
+  """Creates annotations resembling VCR, with repeated words and objects."""
+  rng = np.random.RandomState(0)
+  words = [x for x in vocab if x.isalpha()]
+  words = [
+      words[i].capitalize() + words[j]
+      for i, j in rng.randint(len(words), size=(num_words, 2))
+  ]
+  types = ['person', 'person', 'person', 'dog', 'car', 'chair', 'cup']
+
+  def _sentence(num_objects):
+    sentence = [words[i] for i in rng.randint(num_words, size=12)]
+    for _ in range(rng.randint(1, 4)):
+      sentence.insert(rng.randint(len(sentence)),
+                      rng.randint(num_objects, size=rng.randint(1, 3)).tolist())
+    return sentence
+
+  annots = []
+  for _ in range(num_examples):
+    num_objects = rng.randint(2, 12)
+    obj_to_type = ['[unused400]'] + [
+        types[i] for i in rng.randint(len(types), size=num_objects)
+    ]
+    boxes = rng.rand(1 + num_objects, 5) * 500
+    annots.append({
+        'obj_to_type': np.array(obj_to_type),
+        'old_det_to_new_ind': np.arange(num_objects) + 1,
+        'boxes': boxes,
+        'sentences': [
+            _sentence(num_objects) for _ in range(1 + 2 * NUM_CHOICES)
+        ]
+    })
+  return annots
+
+
+def main(_):
+  logging.set_verbosity(logging.INFO)
+
+  bert_tokenizer = tokenization.FullTokenizer(vocab_file=FLAGS.bert_vocab_file,
+                                              do_lower_case=FLAGS.do_lower_case)
+  annots = _create_synthetic_annotations(list(bert_tokenizer.vocab.keys()),
+                                         FLAGS.num_examples, FLAGS.num_words)
+
+  # Before: per-sentence, per-token loops.
+  start_time = time.time()
+  legacy_results = []
+  for annot in annots:
+    legacy_results.append([
+        _legacy_fix_tokenization(x, annot['obj_to_type'],
+                                 annot['old_det_to_new_ind'], bert_tokenizer,
+                                 FLAGS.do_lower_case)
+        for x in annot['sentences']
+    ])
+    _legacy_normalize_boxes(annot['boxes'], 500, 500)
+  legacy_elapsed = time.time() - start_time
+
+  # After: cached wordpieces and batched tag substitution.
+  wordpiece_cache = text_utils.WordpieceCache(bert_tokenizer)
+  start_time = time.time()
+  results = []
+  for annot in annots:
+    results.append(
+        text_utils.fix_tokenizations(annot['sentences'],
+                                     annot['obj_to_type'],
+                                     annot['old_det_to_new_ind'],
+                                     FLAGS.do_lower_case,
+                                     wordpiece_cache=wordpiece_cache,
+                                     masking_offset=MASKING_OFFSET))
+    text_utils.normalize_boxes(annot['boxes'], 500, 500)
+  elapsed = time.time() - start_time
+
+  for legacy_result, result in zip(legacy_results, results):
+    assert legacy_result == result
+
+  logging.info('Before: %.2lf examples/sec.', len(annots) / legacy_elapsed)
+  logging.info('After: %.2lf examples/sec.', len(annots) / elapsed)
+  logging.info('Wordpiece cache hits %i, misses %i.', wordpiece_cache.num_hits,
+               wordpiece_cache.num_misses)
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -11,12 +11,19 @@ from absl import logging
 
 import hashlib
 import io
+import shutil
+import tempfile
 import zipfile
 import numpy as np
 import PIL.Image
 import tensorflow as tf
 
 from bert import tokenization
+from readers import annotation_reader
+from readers import jpeg_utils
+from readers import parallel
+from readers import resumable_writer
+from readers import text_utils
 
 flags.DEFINE_string('bert_vocab_file',
                     'data/bert/tf1.x/cased_L-12_H-768_A-12/vocab.txt',
@@ -45,73 +52,45 @@ flags.DEFINE_string('image_zip_file', 'data/vcr1images.zip',
 flags.DEFINE_boolean('only_use_relevant_dets', False,
                      'If true, only use relevant detections.')
 
-FLAGS = flags.FLAGS
+flags.DEFINE_boolean(
+    'merge_text_variants', False,
+    'If true, write one record per image holding both the original and the '
+    'augmented text, to be read by VCRReader with `num_text_variants` set to '
+    '2. Otherwise, write a record for each of them.')
 
-# GENDER_NEUTRAL_NAMES = [
-#     'Casey', 'Riley', 'Jessie', 'Jackie', 'Avery', 'Jaime', 'Peyton', 'Kerry',
-#     'Jody', 'Kendall', 'Peyton', 'Skyler', 'Frankie', 'Pat', 'Quinn'
-# ]
-NUM_CHOICES = 4
-GENDER_NEUTRAL_NAMES = [
-    'Casey', 'Riley', 'Jessie', 'Jackie', 'Avery', 'Jaime', 'Peyton', 'Kerry',
-    'Kendall', 'Frankie', 'Pat', 'Quinn'
-]
+flags.DEFINE_integer('desired_size', 400,
+                     'Maximum size of the shorter side of the images.')
 
-_NUM_PARTITIONS = 100
+flags.DEFINE_integer('jpeg_quality', 75, 'Quality of the re-encoded jpeg.')
 
+flags.DEFINE_integer(
+    'num_resize_workers', 0, 'Number of processes resizing the images in the '
+    'single `shard_id` mode, 0 to resize in the writer process.')
 
-def get_partition_id(annot_id, num_partitions=_NUM_PARTITIONS):
-  split, number = annot_id.split('-')
-  return int(number) % num_partitions
+flags.DEFINE_boolean(
+    'encode_token_ids', False, 'If true, write the tokens as int64 ids of the '
+    '`bert_vocab_file`, along with the hash of the vocabulary.')
 
+flags.DEFINE_integer('out_of_vocabulary_token_id', 100,
+                     'ID of the OOV tokens, used with `encode_token_ids`.')
 
-def _load_annotations(filename):
-  """Loads annotations from file.
+flags.DEFINE_integer(
+    'num_workers', 0, 'If positive, write all the `num_shards` shards using '
+    'this many worker processes, and ignore `shard_id`.')
 
-  Args:
-    filename: Path to the jsonl annotations file.
+FLAGS = flags.FLAGS
 
-  Returns:
-    A list of python dictionary, each is parsed from a json object.
-  """
-  with tf.io.gfile.GFile(filename, 'r') as f:
-    return [json.loads(x.strip('\n')) for x in f]
+NUM_CHOICES = 4
 
+_NUM_PARTITIONS = 100
 
-def _fix_tokenization(tokenized_sent, obj_to_type, old_det_to_new_ind,
-                      bert_tokenizer, do_lower_case):
-  """Converts tokenized annotations into tokenized sentence.
+# Number of images to read before resizing them together.
+_RESIZE_BATCH_SIZE = 64
 
-  Args:
-    tokenized_sent: Tokenized sentence with detections collapsed to a list.
-    obj_to_type: [person, person, pottedplant] indexed by the labels.
-    old_det_to_new_ind: A mapping from the old indices to the new indices.
 
-  Returns:
-    tokenized_sent: A list of string tokens.
-  """
-  case_fn = lambda x: x.lower() if do_lower_case else x
-
-  new_tokenization_with_tags = []
-  for tok in tokenized_sent:
-    if isinstance(tok, list):
-      for idx in tok:
-        if old_det_to_new_ind is not None:
-          idx = old_det_to_new_ind[idx]
-
-        obj_type = obj_to_type[idx]
-        text_to_use = GENDER_NEUTRAL_NAMES[
-            idx %
-            len(GENDER_NEUTRAL_NAMES)] if obj_type == 'person' else obj_type
-        new_tokenization_with_tags.append((case_fn(text_to_use), idx))
-    else:
-      # new_tokenization_with_tags.append((case_fn(tok), -1))
-      # yek@: disable wordpiece tokenizer
-      for sub_tok in bert_tokenizer.wordpiece_tokenizer.tokenize(case_fn(tok)):
-        new_tokenization_with_tags.append((sub_tok, -1))
-
-  tokenized_sent, tags = zip(*new_tokenization_with_tags)
-  return list(tokenized_sent), list(tags)
+def get_partition_id(annot_id, num_partitions=_NUM_PARTITIONS):
+  split, number = annot_id.split('-')
+  return int(number) % num_partitions
 
 
 def get_detections_to_use(obj_to_type, tokens_mixed_with_tags):
@@ -145,16 +124,27 @@ def get_detections_to_use(obj_to_type, tokens_mixed_with_tags):
   return detections_to_use, old_det_to_new_ind
 
 
-def _create_tf_example(encoded_jpeg, annot, meta, bert_tokenizer, do_lower_case,
-                       only_use_relevant_dets):
-  """Creates an example from the annotation.
+def _create_tf_example(encoded_jpeg,
+                       annots,
+                       meta,
+                       wordpiece_cache,
+                       do_lower_case,
+                       only_use_relevant_dets,
+                       vocab=None):
+  """Creates an example from the text variants of an annotation.
+
+  The image and the detections are stored once. The first variant uses the
+  regular text features, the others are scoped by `text_variant_%i/`.
 
   Args:
     encoded_jpeg: A python string, the encoded jpeg data.
-    annot: A python dictionary parsed from the json object.
+    annots: A list of python dictionaries parsed from the json objects, the
+      text variants of the same annotation.
     meta: A python dictionary containing object information.
-    bert_tokenizer: A tokenization.FullTokenizer object.
+    wordpiece_cache: A text_utils.WordpieceCache object.
     do_lower_case: If true, convert text to lower case.
+    only_use_relevant_dets: If true, only use relevant detections.
+    vocab: A text_utils.Vocab object. If not None, write the tokens as ids.
 
   Returns:
     tf_example: A tf.train.Example proto.
@@ -180,24 +170,35 @@ def _create_tf_example(encoded_jpeg, annot, meta, bert_tokenizer, do_lower_case,
   def _float_feature_list(value):
     return tf.train.Feature(float_list=tf.train.FloatList(value=value))
 
+  # Tokens are written either as strings or as ids of the vocabulary.
+  token_suffix, _tokens_feature = '', _bytes_feature_list
+  if vocab is not None:
+    token_suffix = '_id'
+    _tokens_feature = lambda x: _int64_feature_list(
+        vocab.convert_tokens_to_ids(x))
+
   # Encode objects and boxes.
+  annot = annots[0]
   image_height, image_width = meta['height'], meta['width']
   assert (meta['names'] == annot['objects']
          ), 'Meta data does not match the annotation.'
 
-  obj_to_type = annot['objects']
-  question = annot['question']
-  answer_choices = annot['answer_choices']
-  rationale_choices = annot['rationale_choices']
-  assert NUM_CHOICES == len(answer_choices) == len(rationale_choices)
+  sentences = []
+  for annot_oneof in annots:
+    for key in ['annot_id', 'answer_label', 'rationale_label', 'objects']:
+      assert annot_oneof[key] == annot[key], 'Variants do not match.'
+    sentences.append(annot_oneof['question'])
+    sentences.extend(annot_oneof['answer_choices'])
+    sentences.extend(annot_oneof['rationale_choices'])
 
-  obj_to_type = np.array(obj_to_type)
+  obj_to_type = np.array(annot['objects'])
   boxes = np.array(meta['boxes'])
 
+  # Detections are shared, so the relevant ones are those of all the variants.
   old_det_to_new_ind = None
   if only_use_relevant_dets:
     detections_to_use, old_det_to_new_ind = get_detections_to_use(
-        obj_to_type, [question] + answer_choices + rationale_choices)
+        obj_to_type, sentences)
     old_det_to_new_ind = [-1 if x < 0 else x + 1 for x in old_det_to_new_ind]
 
     # Gather elements using the new indices.
@@ -210,11 +211,8 @@ def _create_tf_example(encoded_jpeg, annot, meta, bert_tokenizer, do_lower_case,
   obj_to_type = np.concatenate([['[unused400]'], obj_to_type], 0)
   boxes = np.concatenate([[[0, 0, image_width, image_height, 1]], boxes], 0)
 
-  xmin, ymin, xmax, ymax, score = [boxes[:, i] for i in range(5)]
-  xmin /= image_width
-  ymin /= image_height
-  xmax /= image_width
-  ymax /= image_height
+  xmin, ymin, xmax, ymax, score = text_utils.normalize_boxes(
+      boxes, image_width, image_height)
 
   feature = {}
   for key, value in annot.items():
@@ -222,90 +220,78 @@ def _create_tf_example(encoded_jpeg, annot, meta, bert_tokenizer, do_lower_case,
       feature[key] = _int64_feature(value)
     elif isinstance(value, str):
       feature[key] = _bytes_feature(value)
-  feature['image/object/bbox/xmin'] = _float_feature_list(xmin.tolist())
-  feature['image/object/bbox/ymin'] = _float_feature_list(ymin.tolist())
-  feature['image/object/bbox/xmax'] = _float_feature_list(xmax.tolist())
-  feature['image/object/bbox/ymax'] = _float_feature_list(ymax.tolist())
-  feature['image/object/bbox/score'] = _float_feature_list(score.tolist())
-  feature['image/object/bbox/label'] = _bytes_feature_list(obj_to_type.tolist())
+  feature['image/object/bbox/xmin'] = _float_feature_list(xmin)
+  feature['image/object/bbox/ymin'] = _float_feature_list(ymin)
+  feature['image/object/bbox/xmax'] = _float_feature_list(xmax)
+  feature['image/object/bbox/ymax'] = _float_feature_list(ymax)
+  feature['image/object/bbox/score'] = _float_feature_list(score)
+  feature['image/object/bbox/label' + token_suffix] = _tokens_feature(
+      obj_to_type.tolist())
+  if vocab is not None:
+    feature['vocab_hash'] = _bytes_feature(vocab.hash)
 
   feature['image/format'] = _bytes_feature('jpeg')
   feature['image/encoded'] = tf.train.Feature(bytes_list=tf.train.BytesList(
       value=[encoded_jpeg]))
 
-  # Encode question.
-  question_tokens, question_tags = _fix_tokenization(question, obj_to_type,
-                                                     old_det_to_new_ind,
-                                                     bert_tokenizer,
-                                                     do_lower_case)
-  feature['question'] = _bytes_feature_list(question_tokens)
-  feature['question_tag'] = _int64_feature_list(question_tags)
-
-  # Encode answer choices.
-  for idx, tokenized_sent in enumerate(answer_choices):
-    tokens, tags = _fix_tokenization(tokenized_sent, obj_to_type,
-                                     old_det_to_new_ind, bert_tokenizer,
-                                     do_lower_case)
-    feature['answer_choice_%i' % (idx + 1)] = _bytes_feature_list(tokens)
-    feature['answer_choice_tag_%i' % (idx + 1)] = _int64_feature_list(tags)
-
-  # Encode ratinale choices.
-  for idx, tokenized_sent in enumerate(rationale_choices):
-    tokens, tags = _fix_tokenization(tokenized_sent, obj_to_type,
-                                     old_det_to_new_ind, bert_tokenizer,
-                                     do_lower_case)
-    feature['rationale_choice_%i' % (idx + 1)] = _bytes_feature_list(tokens)
-    feature['rationale_choice_tag_%i' % (idx + 1)] = _int64_feature_list(tags)
+  feature['num_text_variants'] = _int64_feature(len(annots))
+
+  for variant_id, annot_oneof in enumerate(annots):
+    scope = '' if variant_id == 0 else 'text_variant_%i/' % variant_id
+    answer_choices = annot_oneof['answer_choices']
+    rationale_choices = annot_oneof['rationale_choices']
+    assert NUM_CHOICES == len(answer_choices) == len(rationale_choices)
+
+    # Encode question, answer choices and rationale choices.
+    fixed_sentences = text_utils.fix_tokenizations(
+        [annot_oneof['question']] + answer_choices + rationale_choices,
+        obj_to_type,
+        old_det_to_new_ind,
+        do_lower_case,
+        wordpiece_cache=wordpiece_cache)
+
+    question_tokens, question_tags = fixed_sentences[0]
+    feature[scope + 'question' + token_suffix] = _tokens_feature(
+        question_tokens)
+    feature[scope + 'question_tag'] = _int64_feature_list(question_tags)
+
+    for idx in range(NUM_CHOICES):
+      tokens, tags = fixed_sentences[1 + idx]
+      feature[scope + 'answer_choice%s_%i' %
+              (token_suffix, idx + 1)] = _tokens_feature(tokens)
+      feature[scope + 'answer_choice_tag_%i' %
+              (idx + 1)] = _int64_feature_list(tags)
+
+      tokens, tags = fixed_sentences[1 + NUM_CHOICES + idx]
+      feature[scope + 'rationale_choice%s_%i' %
+              (token_suffix, idx + 1)] = _tokens_feature(tokens)
+      feature[scope + 'rationale_choice_tag_%i' %
+              (idx + 1)] = _int64_feature_list(tags)
 
   tf_example = tf.train.Example(features=tf.train.Features(feature=feature))
   return tf_example
 
 
-def resize_jpeg(encoded_jpeg, desired_size=400):
-  # Encode jpeg data, resize image if specified.
-  image = PIL.Image.open(io.BytesIO(encoded_jpeg))
-  assert image.format == 'JPEG'
-
-  min_size = min(image.width, image.height)
-  scale = 1.0 * desired_size / min_size
-  if scale < 1.0:
-    new_height, new_width = (int(image.height * scale),
-                             int(image.width * scale))
-    image = image.resize((new_width, new_height))
-  with io.BytesIO() as f:
-    image.save(f, format="JPEG")
-    encoded_jpeg = f.getvalue()
-
-  return encoded_jpeg
-
-
-def main(_):
-  logging.set_verbosity(logging.INFO)
-
-  # Create Bert model.
-  bert_tokenizer = tokenization.FullTokenizer(vocab_file=FLAGS.bert_vocab_file,
-                                              do_lower_case=FLAGS.do_lower_case)
-
-  # Load annotations.
-  annots = _load_annotations(FLAGS.annotations_jsonl_file)
-  annots_aug = _load_annotations(FLAGS.annotations_jsonl_file_aug)
-  logging.info('Loaded %i annotations.', len(annots))
-
-  shard_id, num_shards = FLAGS.shard_id, FLAGS.num_shards
-  assert 0 <= shard_id < num_shards
+def _read_examples(image_zip, annot_pairs, shard_id, timer):
+  """Reads the meta data and the jpeg data of the annotations.
 
-  writer = tf.io.TFRecordWriter(FLAGS.output_tfrecord_path + '-%05d-of-%05d' %
-                                (shard_id, num_shards))
-
-  with zipfile.ZipFile(FLAGS.image_zip_file) as image_zip:
-    for idx, (annot, annot_aug) in enumerate(zip(annots, annots_aug)):
-      if (idx + 1) % 1000 == 0:
-        logging.info('On example %i/%i.', idx + 1, len(annots))
-
-      annot_id = int(annot['annot_id'].split('-')[-1])
-      if annot_id % num_shards != shard_id:
-        continue
+  Args:
+    image_zip: A zipfile.ZipFile object of the images.
+    annot_pairs: An iterable of (annot, annot_aug) tuples.
+    shard_id: Shard id, for logging.
+    timer: A parallel.StageTimer object.
 
+  Yields:
+    A tuple of (annot, annot_aug, meta, encoded_jpeg).
+  """
+  for idx, (annot, annot_aug) in enumerate(annot_pairs):
+    if (idx + 1) % 1000 == 0:
+      logging.info('Shard %i: on example %i.', shard_id, idx + 1)
+    # Annotations are processed whether they are written or skipped.
+    parallel.report_progress()
+    assert annot['annot_id'] == annot_aug['annot_id']
+
+    with timer.time('read'):
       # Read meta data.
       meta_fn = os.path.join('vcr1images', annot['metadata_fn'])
       try:
@@ -323,18 +309,169 @@ def main(_):
       except Exception as ex:
         logging.warn('Skip %s.', img_fn)
         continue
+    yield annot, annot_aug, meta, encoded_jpeg
+
 
-      # Create TF example.
-      encoded_jpeg = resize_jpeg(encoded_jpeg)
-      assert annot['annot_id'] == annot_aug['annot_id']
+def _batch(iterable, batch_size):
+  batch = []
+  for elem in iterable:
+    batch.append(elem)
+    if len(batch) == batch_size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
 
-      for annot_oneof in [annot, annot_aug]:
-        tf_example = _create_tf_example(encoded_jpeg, annot_oneof, meta,
-                                        bert_tokenizer, FLAGS.do_lower_case,
-                                        FLAGS.only_use_relevant_dets)
-        writer.write(tf_example.SerializeToString())
+
+def _create_shard(shard_id,
+                  num_shards,
+                  bert_tokenizer,
+                  vocab,
+                  shard_files=None,
+                  shard_size=None):
+  """Writes the tf examples of a shard.
+
+  Args:
+    shard_id: Shard id.
+    num_shards: Total number of shards.
+    bert_tokenizer: A tokenization.FullTokenizer object.
+    vocab: A text_utils.Vocab object, or None to write the tokens as strings.
+    shard_files: A tuple of the paths to the annotations and the augmented
+      annotations of the shard, see `annotation_reader.split_annotations`. If
+      None, the shard is read from `annotations_jsonl_file` and
+      `annotations_jsonl_file_aug`.
+    shard_size: Number of annotations of the shard, reported as processed if
+      the shard is complete.
+
+  Returns:
+    Number of tf examples written.
+  """
+  output_path = FLAGS.output_tfrecord_path + '-%05d-of-%05d' % (shard_id,
+                                                                 num_shards)
+  if resumable_writer.is_complete(output_path):
+    logging.info('Shard %i: %s is complete, skip.', shard_id, output_path)
+    if shard_size is not None:
+      parallel.report_progress(shard_size)
+    return 0
+
+  # Resume from the annotations committed by a previous run, if any.
+  writer = resumable_writer.ResumableTFRecordWriter(output_path)
+  if len(writer):
+    logging.info('Shard %i: resume after %i annotations.', shard_id,
+                 len(writer))
+    parallel.report_progress(len(writer))
+  timer = parallel.StageTimer()
+  wordpiece_cache = text_utils.WordpieceCache(bert_tokenizer)
+
+  num_written = 0
+  if shard_files is not None:
+    annots, annots_aug = [
+        annotation_reader.read_annotations(x, skip_annot_ids=writer)
+        for x in shard_files
+    ]
+  else:
+    annots, annots_aug = [
+        annotation_reader.read_annotations(x,
+                                           num_shards,
+                                           shard_id,
+                                           skip_annot_ids=writer)
+        for x in [
+            FLAGS.annotations_jsonl_file, FLAGS.annotations_jsonl_file_aug
+        ]
+    ]
+  with zipfile.ZipFile(FLAGS.image_zip_file) as image_zip, \
+      jpeg_utils.JpegResizer(FLAGS.desired_size, FLAGS.jpeg_quality,
+                             FLAGS.num_resize_workers) as resizer:
+    examples = _read_examples(image_zip, zip(annots, annots_aug), shard_id,
+                              timer)
+    for batch in _batch(examples, _RESIZE_BATCH_SIZE):
+      with timer.time('resize'):
+        encoded_jpegs = resizer.resize([x[-1] for x in batch])
+
+      for (annot, annot_aug, meta, _), encoded_jpeg in zip(batch,
+                                                           encoded_jpegs):
+        # Create TF examples, the image is resized once for both variants.
+        if FLAGS.merge_text_variants:
+          variants_list = [[annot, annot_aug]]
+        else:
+          variants_list = [[annot], [annot_aug]]
+
+        serialized_examples = []
+        for variants in variants_list:
+          with timer.time('create_tf_example'):
+            tf_example = _create_tf_example(encoded_jpeg, variants, meta,
+                                            wordpiece_cache,
+                                            FLAGS.do_lower_case,
+                                            FLAGS.only_use_relevant_dets,
+                                            vocab)
+          serialized_examples.append(tf_example.SerializeToString())
+
+        # Variants of an annotation are committed together.
+        with timer.time('write'):
+          writer.add(annot['annot_id'], serialized_examples)
+        num_written += len(serialized_examples)
 
   writer.close()
+  timer.log(prefix='Shard %i: ' % shard_id)
+  logging.info('Shard %i: wordpiece cache hits %i, misses %i.', shard_id,
+               wordpiece_cache.num_hits, wordpiece_cache.num_misses)
+  return num_written
+
+
+def main(_):
+  logging.set_verbosity(logging.INFO)
+
+  # The resumable shards are written in place, on the local file system only.
+  resumable_writer.check_local_path(FLAGS.output_tfrecord_path)
+
+  # Create Bert model.
+  bert_tokenizer = tokenization.FullTokenizer(vocab_file=FLAGS.bert_vocab_file,
+                                              do_lower_case=FLAGS.do_lower_case)
+
+  # Workers of the pool are not allowed to have children.
+  if FLAGS.num_workers > 0 and FLAGS.num_resize_workers > 0:
+    raise ValueError('`num_resize_workers` is not supported with `num_workers`'
+                     ', whose workers already resize in parallel.')
+
+  vocab = None
+  if FLAGS.encode_token_ids:
+    vocab = text_utils.Vocab(FLAGS.bert_vocab_file,
+                             FLAGS.out_of_vocabulary_token_id)
+
+  num_shards = FLAGS.num_shards
+
+  if FLAGS.num_workers > 0:
+    # The jsonl files are read once and split into one file per shard, so
+    # that each worker only reads its own annotations. Both files are split
+    # the same way, hence the variants of a shard stay aligned.
+    temp_dir = tempfile.mkdtemp()
+    try:
+      shard_files, shard_sizes = annotation_reader.split_annotations(
+          FLAGS.annotations_jsonl_file, os.path.join(temp_dir, 'annots'),
+          num_shards)
+      shard_files_aug, _ = annotation_reader.split_annotations(
+          FLAGS.annotations_jsonl_file_aug,
+          os.path.join(temp_dir, 'annots_aug'), num_shards)
+      logging.info('Split %i annotations into %i shards.', sum(shard_sizes),
+                   num_shards)
+
+      def _create_shard_fn(shard_id):
+        return _create_shard(
+            shard_id, num_shards, bert_tokenizer, vocab,
+            (shard_files[shard_id], shard_files_aug[shard_id]),
+            shard_sizes[shard_id])
+
+      parallel.run_in_pool(_create_shard_fn,
+                           num_shards,
+                           FLAGS.num_workers,
+                           num_examples=sum(shard_sizes))
+    finally:
+      shutil.rmtree(temp_dir)
+  else:
+    # The single shard streams its own annotations from the jsonl files.
+    shard_id = FLAGS.shard_id
+    assert 0 <= shard_id < num_shards
+    _create_shard(shard_id, num_shards, bert_tokenizer, vocab)
 
   logging.info('Done')
 
@@ -0,0 +1,93 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+import create_augmented_vcr_tfrecord
+
+
+def _create_annot(question):
+  return {
+      'annot_id': 'val-1',
+      'img_fn': 'movie/1.jpg',
+      'answer_label': 2,
+      'rationale_label': 0,
+      'objects': ['person', 'dog'],
+      'question': question,
+      'answer_choices': [['Answer', str(i)] for i in range(4)],
+      'rationale_choices': [['Rationale', str(i)] for i in range(4)],
+  }
+
+
+_META = {
+    'names': ['person', 'dog'],
+    'height': 100,
+    'width': 200,
+    'boxes': [[0, 0, 100, 50, 0.9], [100, 50, 200, 100, 0.8]],
+}
+
+
+class CreateAugmentedVCRTFRecordTest(tf.test.TestCase):
+
+  def _create_tf_example(self, annots):
+    return create_augmented_vcr_tfrecord._create_tf_example(
+        b'jpeg',
+        annots,
+        _META,
+        wordpiece_cache=None,
+        do_lower_case=False,
+        only_use_relevant_dets=True)
+
+  def test_text_variants(self):
+    tf_example = self._create_tf_example([
+        _create_annot(['Why', 'is', [0], 'here', '?']),
+        _create_annot(['Why', 'is', [1], 'there', '?']),
+    ])
+    feature = tf_example.features.feature
+
+    # The image and the detections relevant to any variant are stored once.
+    self.assertAllEqual(feature['num_text_variants'].int64_list.value, [2])
+    self.assertAllEqual(feature['image/encoded'].bytes_list.value, [b'jpeg'])
+    self.assertAllEqual(feature['image/object/bbox/label'].bytes_list.value,
+                        [b'[unused400]', b'person', b'dog'])
+
+    # The first variant uses the regular text features.
+    self.assertAllEqual(feature['question'].bytes_list.value[-2:],
+                        [b'here', b'?'])
+    self.assertAllEqual(feature['question_tag'].int64_list.value,
+                        [-1, -1, 1, -1, -1])
+    self.assertAllEqual(feature['text_variant_1/question'].bytes_list.value,
+                        [b'Why', b'is', b'dog', b'there', b'?'])
+    self.assertAllEqual(feature['text_variant_1/question_tag'].int64_list.value,
+                        [-1, -1, 2, -1, -1])
+    self.assertAllEqual(
+        feature['text_variant_1/answer_choice_3'].bytes_list.value,
+        [b'Answer', b'2'])
+
+    # Each text feature has a scoped copy, and only the text features do.
+    text_keys = set(['question', 'question_tag'])
+    for idx in range(1, 5):
+      text_keys.update([
+          'answer_choice_%i' % idx,
+          'answer_choice_tag_%i' % idx,
+          'rationale_choice_%i' % idx,
+          'rationale_choice_tag_%i' % idx,
+      ])
+    scoped_keys = [x for x in feature if x.startswith('text_variant_')]
+    self.assertCountEqual(scoped_keys,
+                          ['text_variant_1/' + x for x in text_keys])
+
+  def test_single_variant(self):
+    tf_example = self._create_tf_example(
+        [_create_annot(['Why', 'is', [0], 'here', '?'])])
+    feature = tf_example.features.feature
+
+    self.assertAllEqual(feature['num_text_variants'].int64_list.value, [1])
+    self.assertAllEqual(feature['image/object/bbox/label'].bytes_list.value,
+                        [b'[unused400]', b'person'])
+    self.assertEmpty([x for x in feature if x.startswith('text_variant_')])
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -9,8 +9,12 @@ from absl import app
 from absl import flags
 from absl import logging
 
+import collections
 import hashlib
 import io
+import queue
+import threading
+import time
 import zipfile
 import numpy as np
 import PIL.Image
@@ -21,6 +25,10 @@ from bert import tokenization
 from google.protobuf import text_format
 from protos import fast_rcnn_pb2
 from modeling.models import fast_rcnn
+from readers import annotation_reader
+from readers import feature_index
+from readers import feature_store
+from readers import resumable_writer
 
 flags.DEFINE_string('fast_rcnn_config',
                     'configs/fast_rcnn/inception_resnet_v2_oid.pbtxt',
@@ -43,47 +51,269 @@ flags.DEFINE_string('output_frcnn_feature_dir',
                     'output/fast_rcnn/inception_resnet_v2_oid',
                     'Path to the directory saving features.')
 
+flags.DEFINE_string(
+    'output_feature_store_dir', None, 'If specified, append features to the '
+    'memory-mapped feature store instead of writing per-annotation npy files.')
+
+flags.DEFINE_enum('feature_store_dtype', 'float32', ['float32', 'float16'],
+                  'Data type of the features in the feature store.')
+
+flags.DEFINE_boolean(
+    'key_by_image', False, 'If true, extract features once per unique image '
+    'and boxes, and write an index mapping annot_id to the image record.')
+
+flags.DEFINE_integer(
+    'batch_size', 1, 'Number of images processed by one FastRCNN call. Only '
+    'images of the same size are batched together, images of sparse sizes are '
+    'processed one at a time.')
+
+flags.DEFINE_integer(
+    'prefetch_batches', 2,
+    'Number of batches decoded ahead by the background thread.')
+
+flags.DEFINE_integer('log_every_n_batches', 100,
+                     'Frequency of logging the extraction throughput.')
+
 FLAGS = flags.FLAGS
 
-_NUM_PARTITIONS = 100
+_NUM_PARTITIONS = feature_index.NUM_PARTITIONS
+
+# Maximum number of decoded images waiting in the size buckets, in the unit of
+# batches. The fullest bucket is flushed early when the limit is exceeded.
+_MAX_PENDING_BATCHES = 4
+
+# Minimum fraction of real images in a flushed partial batch. Less filled
+# buckets are processed as batches of one instead of repeating their images.
+_MIN_BATCH_FILL = 0.5
+
+
+def _read_meta(image_zip, annot):
+  """Reads the meta data of an annotation.
+
+  Args:
+    image_zip: A zipfile.ZipFile instance of the VCR images.
+    annot: A python dictionary parsed from the json object.
+
+  Returns:
+    A python dictionary containing object information, or None if missing.
+  """
+  meta_fn = os.path.join('vcr1images', annot['metadata_fn'])
+  try:
+    with image_zip.open(meta_fn, 'r') as f:
+      return json.load(f)
+  except Exception as ex:
+    logging.warn('Skip %s.', meta_fn)
+    return None
 
 
-def get_partition_id(annot_id, num_partitions=_NUM_PARTITIONS):
-  split, number = annot_id.split('-')
-  return int(number) % num_partitions
+def _read_image_and_proposals(image_zip, annot, meta):
+  """Reads the image and the normalized proposals of an annotation.
 
+  Args:
+    image_zip: A zipfile.ZipFile instance of the VCR images.
+    annot: A python dictionary parsed from the json object.
+    meta: A python dictionary containing object information.
 
-def _load_annotations(filename):
-  """Loads annotations from file.
+  Returns:
+    image: A [height, width, 3] uint8 numpy array.
+    proposals: A [1 + num_boxes, 4] float numpy array, in the format of
+      [ymin, xmin, ymax, xmax]. The first box denotes the full image.
+    Returns None if the image is missing.
+  """
+  # Read image data.
+  img_fn = os.path.join('vcr1images', annot['img_fn'])
+  try:
+    with image_zip.open(img_fn, 'r') as f:
+      encoded_jpg = f.read()
+  except Exception as ex:
+    logging.warn('Skip %s.', img_fn)
+    return None
+
+  # Decode image.
+  image = PIL.Image.open(io.BytesIO(encoded_jpg))
+  assert image.format == 'JPEG'
+
+  image = np.array(image)
+  boxes_and_scores = np.array(meta['boxes'])
+  xmin, ymin, xmax, ymax, score = [boxes_and_scores[:, i] for i in range(5)]
+  xmin /= meta['width']
+  ymin /= meta['height']
+  xmax /= meta['width']
+  ymax /= meta['height']
+  boxes = np.stack([ymin, xmin, ymax, xmax], -1)
+  boxes = np.concatenate([[[0, 0, 1, 1]], boxes], 0)
+  return image, boxes.astype(np.float32)
+
+
+def _save_feature(feature_dir, key, features):
+  """Saves the features of a key to a npy file, via a temporary file."""
+  output_file = feature_index.get_feature_path(feature_dir, key)
+  with open(output_file + '.tmp', 'wb') as f:
+    np.save(f, features)
+  os.rename(output_file + '.tmp', output_file)
+
+
+def _pack_batch(examples, batch_size):
+  """Packs examples of the same image size into a batch.
+
+  The batch is filled up to `batch_size` by repeating the last example, since
+  FastRCNN requires a static batch dimension. Proposals are padded with zeros.
 
   Args:
-    filename: Path to the jsonl annotations file.
+    examples: A list of (key, image, proposals) tuples.
+    batch_size: Batch size of the FastRCNN graph.
 
   Returns:
-    A list of python dictionary, each is parsed from a json object.
+    keys: A list of feature keys, one per real example.
+    images: A [batch_size, height, width, 3] uint8 numpy array.
+    proposals: A [batch_size, max_num_proposals, 4] float numpy array.
+    num_proposals: A list of proposal counts, one per real example.
+  """
+  keys = [x[0] for x in examples]
+  num_proposals = [len(x[2]) for x in examples]
+
+  examples = examples + [examples[-1]] * (batch_size - len(examples))
+  images = np.stack([x[1] for x in examples], 0)
+  proposals = np.zeros([batch_size, max(num_proposals), 4], dtype=np.float32)
+  for i, (_, _, example_proposals) in enumerate(examples):
+    proposals[i, :len(example_proposals)] = example_proposals
+  return keys, images, proposals, num_proposals
+
+
+def _flush_bucket(bucket, batch_size):
+  """Packs the examples of a partial bucket.
+
+  Args:
+    bucket: A list of less than `batch_size` (key, image, proposals) tuples of
+      the same image size.
+    batch_size: Batch size of the FastRCNN graph.
+
+  Yields:
+    A single batch of `batch_size` if the bucket is filled at least to
+    `_MIN_BATCH_FILL`, otherwise one batch of one per example.
+  """
+  if len(bucket) >= _MIN_BATCH_FILL * batch_size:
+    yield _pack_batch(bucket, batch_size)
+  else:
+    for example in bucket:
+      yield _pack_batch([example], 1)
+
+
+def _generate_batches(image_zip, examples, batch_size):
+  """Decodes images and groups them into batches.
+
+  Images are only batched with images of the identical size, hence no pixel is
+  padded and the features are bit-identical to those of the per-image path.
+  Partial buckets are flushed by `_flush_bucket`, so the batches are either of
+  `batch_size` or of one.
+
+  Args:
+    image_zip: A zipfile.ZipFile instance of the VCR images.
+    examples: An iterable of (key, annot, meta) tuples.
+    batch_size: Batch size of the FastRCNN graph.
+
+  Yields:
+    Batches returned by `_pack_batch`.
+  """
+  buckets = collections.OrderedDict()
+  num_pending = 0
+  for key, annot, meta in examples:
+    image_and_proposals = _read_image_and_proposals(image_zip, annot, meta)
+    if image_and_proposals is None:
+      continue
+    image, proposals = image_and_proposals
+
+    bucket = buckets.setdefault(image.shape, [])
+    bucket.append((key, image, proposals))
+    num_pending += 1
+
+    if len(bucket) == batch_size:
+      num_pending -= batch_size
+      yield _pack_batch(buckets.pop(image.shape), batch_size)
+
+    elif num_pending > _MAX_PENDING_BATCHES * batch_size:
+      fullest = max(buckets, key=lambda x: len(buckets[x]))
+      num_pending -= len(buckets[fullest])
+      for batch in _flush_bucket(buckets.pop(fullest), batch_size):
+        yield batch
+
+  for bucket in buckets.values():
+    for batch in _flush_bucket(bucket, batch_size):
+      yield batch
+
+
+def _prefetch(generator, buffer_size):
+  """Runs the generator on a background thread.
+
+  Args:
+    generator: A python generator.
+    buffer_size: Maximum number of elements produced ahead.
+
+  Yields:
+    Elements produced by the generator.
   """
-  with tf.io.gfile.GFile(filename, 'r') as f:
-    return [json.loads(x.strip('\n')) for x in f]
+  buffer = queue.Queue(maxsize=buffer_size)
+  end_of_generator = object()
+  errors = []
+
+  def _worker():
+    try:
+      for elem in generator:
+        buffer.put(elem)
+    except Exception as ex:
+      errors.append(ex)
+    finally:
+      buffer.put(end_of_generator)
+
+  thread = threading.Thread(target=_worker)
+  thread.daemon = True
+  thread.start()
+
+  while True:
+    elem = buffer.get()
+    if elem is end_of_generator:
+      break
+    yield elem
+
+  thread.join()
+  if errors:
+    raise errors[0]
 
 
 def main(_):
   logging.set_verbosity(logging.DEBUG)
 
-  for i in range(_NUM_PARTITIONS):
-    tf.io.gfile.makedirs(
-        os.path.join(FLAGS.output_frcnn_feature_dir, '%02d' % i))
+  output_dir = FLAGS.output_feature_store_dir
+  if output_dir is None:
+    output_dir = FLAGS.output_frcnn_feature_dir
+    for i in range(_NUM_PARTITIONS):
+      tf.io.gfile.makedirs(os.path.join(output_dir, '%02d' % i))
 
   # Load pre-trained faster-RCNN model and use it as a fast-RCNN model.
   with tf.io.gfile.GFile(FLAGS.fast_rcnn_config, 'r') as fp:
     fast_rcnn_config = text_format.Merge(fp.read(), fast_rcnn_pb2.FastRCNN())
 
-  image_placeholder = tf.placeholder(shape=[None, None, 3], dtype=tf.uint8)
-  proposals_placeholder = tf.placeholder(shape=[None, 4], dtype=tf.float32)
-  frcnn_features, init_fn = fast_rcnn.FastRCNN(
-      inputs=tf.expand_dims(image_placeholder, 0),
-      proposals=tf.expand_dims(proposals_placeholder, 0),
-      options=fast_rcnn_config,
-      is_training=False)
+  batch_size = FLAGS.batch_size
+  assert batch_size >= 1
+
+  # FastRCNN requires a static batch dimension. The batches of one, see
+  # `_flush_bucket`, run a second graph sharing the variables.
+  graphs = {}
+  for graph_batch_size in sorted({batch_size, 1}, reverse=True):
+    with tf.variable_scope(tf.get_variable_scope(), reuse=bool(graphs)):
+      image_placeholder = tf.placeholder(
+          shape=[graph_batch_size, None, None, 3], dtype=tf.uint8)
+      proposals_placeholder = tf.placeholder(shape=[graph_batch_size, None, 4],
+                                             dtype=tf.float32)
+      frcnn_features, graph_init_fn = fast_rcnn.FastRCNN(
+          inputs=image_placeholder,
+          proposals=proposals_placeholder,
+          options=fast_rcnn_config,
+          is_training=False)
+    if not graphs:
+      init_fn = graph_init_fn
+    graphs[graph_batch_size] = (image_placeholder, proposals_placeholder,
+                                frcnn_features)
 
   config = tf.ConfigProto()
   config.gpu_options.allow_growth = True
@@ -95,73 +325,112 @@ def main(_):
 
   if FLAGS.image_max_size is not None:
     raise ValueError('Deprecated flag!')
-  
-  # Load annotations.
-  annots = _load_annotations(FLAGS.annotations_jsonl_file)
-  logging.info('Loaded %i annotations.', len(annots))
 
   shard_id, num_shards = FLAGS.shard_id, FLAGS.num_shards
   assert 0 <= shard_id < num_shards
 
-  with zipfile.ZipFile(FLAGS.image_zip_file) as image_zip:
+  store_writer = None
+  if FLAGS.output_feature_store_dir is not None:
+    store_writer = feature_store.FeatureStoreWriter(
+        FLAGS.output_feature_store_dir,
+        shard_id,
+        num_shards,
+        feature_dims=int(frcnn_features.shape[-1]),
+        dtype=FLAGS.feature_store_dtype)
+
+  # The manifest commits the npy files, so resuming does not stat them.
+  manifest = None
+  if store_writer is None:
+    manifest = resumable_writer.Manifest(
+        feature_index.get_manifest_path(output_dir, shard_id, num_shards))
+
+  def _is_extracted(key):
+    if store_writer is not None:
+      return key in store_writer
+    return key in manifest
+
+  def _examples_to_extract(image_zip, index_writer):
+    # All the annotations of an image are processed by the same shard if
+    # `key_by_image` is set.
+    annots = annotation_reader.read_annotations(
+        FLAGS.annotations_jsonl_file,
+        num_shards,
+        shard_id,
+        shard_by='img_fn' if FLAGS.key_by_image else 'annot_id')
+
+    extracted_keys = set()
     for idx, annot in enumerate(annots):
       if (idx + 1) % 1000 == 0:
-        logging.info('On example %i/%i.', idx + 1, len(annots))
-
-      annot_id = int(annot['annot_id'].split('-')[-1])
-      if annot_id % num_shards != shard_id:
-        continue
+        logging.info('On example %i.', idx + 1)
 
-      # Check npy file.
-      part_id = get_partition_id(annot['annot_id'])
-      output_file = os.path.join(FLAGS.output_frcnn_feature_dir,
-                                 '%02d' % part_id, annot['annot_id'] + '.npy')
-      if os.path.isfile(output_file):
-        logging.info('%s is there.', output_file)
+      meta = _read_meta(image_zip, annot)
+      if meta is None:
         continue
 
-      # Read meta data.
-      meta_fn = os.path.join('vcr1images', annot['metadata_fn'])
-      try:
-        with image_zip.open(meta_fn, 'r') as f:
-          meta = json.load(f)
-      except Exception as ex:
-        logging.warn('Skip %s.', meta_fn)
+      key = annot['annot_id']
+      if FLAGS.key_by_image:
+        key = feature_index.get_image_key(annot['img_fn'], meta['boxes'])
+        index_writer.write('%s\t%s\n' % (annot['annot_id'], key))
+        if key in extracted_keys:
+          continue
+        extracted_keys.add(key)
+
+      # Check existing features.
+      if _is_extracted(key):
+        logging.info('%s is there.', key)
         continue
+      yield key, annot, meta
 
-      # Read image data.
-      img_fn = os.path.join('vcr1images', annot['img_fn'])
-      try:
-        with image_zip.open(img_fn, 'r') as f:
-          encoded_jpg = f.read()
-      except Exception as ex:
-        logging.warn('Skip %s.', img_fn)
-        continue
+  index_writer = None
+  if FLAGS.key_by_image:
+    index_writer = tf.io.gfile.GFile(
+        feature_index.get_index_path(output_dir, shard_id, num_shards), 'w')
 
-      # Decode and resize image.
-      image = PIL.Image.open(io.BytesIO(encoded_jpg))
-      assert image.format == 'JPEG'
-
-      image = np.array(image)
-      boxes_and_scores = np.array(meta['boxes'])
-      xmin, ymin, xmax, ymax, score = [boxes_and_scores[:, i] for i in range(5)]
-      xmin /= meta['width']
-      ymin /= meta['height']
-      xmax /= meta['width']
-      ymax /= meta['height']
-      boxes = np.stack([ymin, xmin, ymax, xmax], -1)
-      boxes = np.concatenate([[[0, 0, 1, 1]], boxes], 0)
+  num_images, num_filler_images = 0, 0
+  start_time = time.time()
+  with zipfile.ZipFile(FLAGS.image_zip_file) as image_zip:
+    batches = _prefetch(_generate_batches(
+        image_zip, _examples_to_extract(image_zip, index_writer), batch_size),
+                        buffer_size=FLAGS.prefetch_batches)
+
+    for batch_id, (keys, images, proposals,
+                   num_proposals) in enumerate(batches):
+      (image_placeholder, proposals_placeholder,
+       frcnn_features) = graphs[len(images)]
       box_features = sess.run(frcnn_features,
                               feed_dict={
-                                  image_placeholder: image,
-                                  proposals_placeholder: boxes
+                                  image_placeholder: images,
+                                  proposals_placeholder: proposals
                               })
-      with open(output_file, 'wb') as f:
-        import pdb
-        pdb.set_trace()
-        np.save(f, box_features[0])
-
-  logging.info('Done')
+      for i, key in enumerate(keys):
+        if store_writer is not None:
+          store_writer.add(key, box_features[i, :num_proposals[i]])
+        else:
+          _save_feature(output_dir, key, box_features[i, :num_proposals[i]])
+      if manifest is not None:
+        manifest.add_all([(key, ()) for key in keys])
+
+      num_images += len(keys)
+      num_filler_images += len(images) - len(keys)
+      if (batch_id + 1) % FLAGS.log_every_n_batches == 0:
+        logging.info(
+            'Extracted %i images, %.2lf images/sec, %i filler images (%.1lf%% '
+            'of the FastRCNN inputs).', num_images,
+            num_images / (time.time() - start_time), num_filler_images,
+            100.0 * num_filler_images / (num_images + num_filler_images))
+
+  if index_writer is not None:
+    index_writer.close()
+  if store_writer is not None:
+    store_writer.close()
+  if manifest is not None:
+    manifest.close()
+
+  logging.info(
+      'Done, extracted %i images, %.2lf images/sec, %i filler images (%.1lf%% '
+      'of the FastRCNN inputs).', num_images,
+      num_images / max(time.time() - start_time, 1e-8), num_filler_images,
+      100.0 * num_filler_images / max(num_images + num_filler_images, 1))
 
 
 if __name__ == '__main__':
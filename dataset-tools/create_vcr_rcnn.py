@@ -21,6 +21,10 @@ from bert import tokenization
 from google.protobuf import text_format
 from protos import rcnn_pb2
 from modeling.models import rcnn
+from readers import annotation_reader
+from readers import feature_index
+from readers import feature_store
+from readers import resumable_writer
 
 flags.DEFINE_string('rcnn_config', 'configs/rcnn/resnet152.pbtxt',
                     'Path to the RCNN config file.')
@@ -39,35 +43,30 @@ flags.DEFINE_string('image_zip_file', 'data/vcr1images.zip',
 flags.DEFINE_string('output_rcnn_feature_dir', 'output/rcnn/resnet152',
                     'Path to the directory saving features.')
 
-FLAGS = flags.FLAGS
-
-_NUM_PARTITIONS = 100
-
-
-def get_partition_id(annot_id, num_partitions=_NUM_PARTITIONS):
-  split, number = annot_id.split('-')
-  return int(number) % num_partitions
+flags.DEFINE_string(
+    'output_feature_store_dir', None, 'If specified, append features to the '
+    'memory-mapped feature store instead of writing per-annotation npy files.')
 
+flags.DEFINE_enum('feature_store_dtype', 'float32', ['float32', 'float16'],
+                  'Data type of the features in the feature store.')
 
-def _load_annotations(filename):
-  """Loads annotations from file.
+flags.DEFINE_boolean(
+    'key_by_image', False, 'If true, extract features once per unique image '
+    'and boxes, and write an index mapping annot_id to the image record.')
 
-  Args:
-    filename: Path to the jsonl annotations file.
+FLAGS = flags.FLAGS
 
-  Returns:
-    A list of python dictionary, each is parsed from a json object.
-  """
-  with tf.io.gfile.GFile(filename, 'r') as f:
-    return [json.loads(x.strip('\n')) for x in f]
+_NUM_PARTITIONS = feature_index.NUM_PARTITIONS
 
 
 def main(_):
   logging.set_verbosity(logging.DEBUG)
 
-  for i in range(_NUM_PARTITIONS):
-    tf.io.gfile.makedirs(os.path.join(FLAGS.output_rcnn_feature_dir,
-                                      '%02d' % i))
+  output_dir = FLAGS.output_feature_store_dir
+  if output_dir is None:
+    output_dir = FLAGS.output_rcnn_feature_dir
+    for i in range(_NUM_PARTITIONS):
+      tf.io.gfile.makedirs(os.path.join(output_dir, '%02d' % i))
 
   with tf.io.gfile.GFile(FLAGS.rcnn_config, 'r') as fp:
     rcnn_config = text_format.Merge(fp.read(), rcnn_pb2.RCNN())
@@ -88,29 +87,42 @@ def main(_):
   for name in sess.run(tf.compat.v1.report_uninitialized_variables()):
     logging.warn('%s is uninitialized!', name)
 
-  # Load annotations.
-  annots = _load_annotations(FLAGS.annotations_jsonl_file)
-  logging.info('Loaded %i annotations.', len(annots))
-
   shard_id, num_shards = FLAGS.shard_id, FLAGS.num_shards
   assert 0 <= shard_id < num_shards
 
+  # All the annotations of an image are processed by the same shard if
+  # `key_by_image` is set.
+  annots = annotation_reader.read_annotations(
+      FLAGS.annotations_jsonl_file,
+      num_shards,
+      shard_id,
+      shard_by='img_fn' if FLAGS.key_by_image else 'annot_id')
+
+  store_writer = None
+  if FLAGS.output_feature_store_dir is not None:
+    store_writer = feature_store.FeatureStoreWriter(
+        FLAGS.output_feature_store_dir,
+        shard_id,
+        num_shards,
+        feature_dims=int(rcnn_features.shape[-1]),
+        dtype=FLAGS.feature_store_dtype)
+
+  # The manifest commits the npy files, so resuming does not stat them.
+  manifest = None
+  if store_writer is None:
+    manifest = resumable_writer.Manifest(
+        feature_index.get_manifest_path(output_dir, shard_id, num_shards))
+
+  index_writer = None
+  if FLAGS.key_by_image:
+    index_writer = tf.io.gfile.GFile(
+        feature_index.get_index_path(output_dir, shard_id, num_shards), 'w')
+  extracted_keys = set()
+
   with zipfile.ZipFile(FLAGS.image_zip_file) as image_zip:
     for idx, annot in enumerate(annots):
       if (idx + 1) % 100 == 0:
-        logging.info('On example %i/%i.', idx + 1, len(annots))
-
-      annot_id = int(annot['annot_id'].split('-')[-1])
-      if annot_id % num_shards != shard_id:
-        continue
-
-      # Check npy file.
-      part_id = get_partition_id(annot['annot_id'])
-      output_file = os.path.join(FLAGS.output_rcnn_feature_dir,
-                                 '%02d' % part_id, annot['annot_id'] + '.npy')
-      if os.path.isfile(output_file):
-        logging.info('%s is there.', output_file)
-        continue
+        logging.info('On example %i.', idx + 1)
 
       # Read meta data.
       meta_fn = os.path.join('vcr1images', annot['metadata_fn'])
@@ -121,6 +133,20 @@ def main(_):
         logging.warn('Skip %s.', meta_fn)
         continue
 
+      key = annot['annot_id']
+      if FLAGS.key_by_image:
+        key = feature_index.get_image_key(annot['img_fn'], meta['boxes'])
+        index_writer.write('%s\t%s\n' % (annot['annot_id'], key))
+        if key in extracted_keys:
+          continue
+        extracted_keys.add(key)
+
+      # Check existing features.
+      if ((store_writer is not None and key in store_writer) or
+          (manifest is not None and key in manifest)):
+        logging.info('%s is there.', key)
+        continue
+
       # Read image data.
       img_fn = os.path.join('vcr1images', annot['img_fn'])
       try:
@@ -148,8 +174,21 @@ def main(_):
                                   image_placeholder: image,
                                   proposals_placeholder: boxes
                               })
-      with open(output_file, 'wb') as f:
-        np.save(f, box_features[0])
+      if store_writer is not None:
+        store_writer.add(key, box_features[0])
+      else:
+        output_file = feature_index.get_feature_path(output_dir, key)
+        with open(output_file + '.tmp', 'wb') as f:
+          np.save(f, box_features[0])
+        os.rename(output_file + '.tmp', output_file)
+        manifest.add_all([(key, ())])
+
+  if index_writer is not None:
+    index_writer.close()
+  if store_writer is not None:
+    store_writer.close()
+  if manifest is not None:
+    manifest.close()
 
   logging.info('Done')
 
@@ -11,12 +11,20 @@ from absl import logging
 
 import hashlib
 import io
+import shutil
+import tempfile
 import zipfile
 import numpy as np
 import PIL.Image
 import tensorflow as tf
 
 from bert import tokenization
+from readers import annotation_reader
+from readers import feature_index
+from readers import feature_store
+from readers import parallel
+from readers import resumable_writer
+from readers import text_utils
 
 flags.DEFINE_string('bert_vocab_file',
                     'data/bert/tf1.x/cased_L-12_H-768_A-12/vocab.txt',
@@ -46,73 +54,29 @@ flags.DEFINE_string('frcnn_feature_dir',
                     'output/fast_rcnn/inception_resnet_v2_imagenet',
                     'Path to the directory saving FRCNN features.')
 
-FLAGS = flags.FLAGS
-
-# GENDER_NEUTRAL_NAMES = [
-#     'Casey', 'Riley', 'Jessie', 'Jackie', 'Avery', 'Jaime', 'Peyton', 'Kerry',
-#     'Jody', 'Kendall', 'Peyton', 'Skyler', 'Frankie', 'Pat', 'Quinn'
-# ]
-NUM_CHOICES = 4
-GENDER_NEUTRAL_NAMES = [
-    'Casey', 'Riley', 'Jessie', 'Jackie', 'Avery', 'Jaime', 'Peyton', 'Kerry',
-    'Kendall', 'Frankie', 'Pat', 'Quinn'
-]
-
-_NUM_PARTITIONS = 100
+flags.DEFINE_string(
+    'frcnn_feature_store_dir', None, 'If specified, read FRCNN features from '
+    'the memory-mapped feature store instead of `frcnn_feature_dir`.')
 
+flags.DEFINE_enum('frcnn_feature_encoding', 'float_list',
+                  ['float_list', 'float32', 'float16'],
+                  'Encoding of the FRCNN features, either a FloatList or the '
+                  'raw little-endian bytes of the given dtype.')
 
-def get_partition_id(annot_id, num_partitions=_NUM_PARTITIONS):
-  split, number = annot_id.split('-')
-  return int(number) % num_partitions
+flags.DEFINE_boolean(
+    'encode_token_ids', False, 'If true, write the tokens as int64 ids of the '
+    '`bert_vocab_file`, along with the hash of the vocabulary.')
 
+flags.DEFINE_integer('out_of_vocabulary_token_id', 100,
+                     'ID of the OOV tokens, used with `encode_token_ids`.')
 
-def _load_annotations(filename):
-  """Loads annotations from file.
+flags.DEFINE_integer(
+    'num_workers', 0, 'If positive, write all the `num_shards` shards using '
+    'this many worker processes, and ignore `shard_id`.')
 
-  Args:
-    filename: Path to the jsonl annotations file.
-
-  Returns:
-    A list of python dictionary, each is parsed from a json object.
-  """
-  with tf.io.gfile.GFile(filename, 'r') as f:
-    return [json.loads(x.strip('\n')) for x in f]
-
-
-def _fix_tokenization(tokenized_sent, obj_to_type, old_det_to_new_ind,
-                      bert_tokenizer, do_lower_case):
-  """Converts tokenized annotations into tokenized sentence.
-
-  Args:
-    tokenized_sent: Tokenized sentence with detections collapsed to a list.
-    obj_to_type: [person, person, pottedplant] indexed by the labels.
-    old_det_to_new_ind: A mapping from the old indices to the new indices.
+FLAGS = flags.FLAGS
 
-  Returns:
-    tokenized_sent: A list of string tokens.
-  """
-  case_fn = lambda x: x.lower() if do_lower_case else x
-
-  new_tokenization_with_tags = []
-  for tok in tokenized_sent:
-    if isinstance(tok, list):
-      for idx in tok:
-        if old_det_to_new_ind is not None:
-          idx = old_det_to_new_ind[idx]
-
-        obj_type = obj_to_type[idx]
-        text_to_use = GENDER_NEUTRAL_NAMES[
-            idx %
-            len(GENDER_NEUTRAL_NAMES)] if obj_type == 'person' else obj_type
-        new_tokenization_with_tags.append((case_fn(text_to_use), idx))
-    else:
-      new_tokenization_with_tags.append((case_fn(tok), -1))
-      # yek@: disable wordpiece tokenizer
-      # for sub_tok in bert_tokenizer.wordpiece_tokenizer.tokenize(case_fn(tok)):
-      #   new_tokenization_with_tags.append((sub_tok, -1))
-
-  tokenized_sent, tags = zip(*new_tokenization_with_tags)
-  return list(tokenized_sent), list(tags)
+NUM_CHOICES = 4
 
 
 def get_detections_to_use(obj_to_type, tokens_mixed_with_tags):
@@ -146,8 +110,14 @@ def get_detections_to_use(obj_to_type, tokens_mixed_with_tags):
   return detections_to_use, old_det_to_new_ind
 
 
-def _create_tf_example(annot, meta, bert_tokenizer, do_lower_case,
-                       image_and_rcnn_features, only_use_relevant_dets):
+def _create_tf_example(annot,
+                       meta,
+                       bert_tokenizer,
+                       do_lower_case,
+                       image_and_rcnn_features,
+                       only_use_relevant_dets,
+                       feature_encoding='float_list',
+                       vocab=None):
   """Creates an example from the annotation.
 
   Args:
@@ -156,6 +126,9 @@ def _create_tf_example(annot, meta, bert_tokenizer, do_lower_case,
     bert_tokenizer: A tokenization.FullTokenizer object.
     do_lower_case: If true, convert text to lower case.
     image_and_rcnn_features: A numpy array containing box features.
+    only_use_relevant_dets: If true, only use relevant detections.
+    feature_encoding: One of `float_list`, `float32` and `float16`.
+    vocab: A text_utils.Vocab object. If not None, write the tokens as ids.
 
   Returns:
     tf_example: A tf.train.Example proto.
@@ -181,6 +154,13 @@ def _create_tf_example(annot, meta, bert_tokenizer, do_lower_case,
   def _float_feature_list(value):
     return tf.train.Feature(float_list=tf.train.FloatList(value=value))
 
+  # Tokens are written either as strings or as ids of the vocabulary.
+  token_suffix, _tokens_feature = '', _bytes_feature_list
+  if vocab is not None:
+    token_suffix = '_id'
+    _tokens_feature = lambda x: _int64_feature_list(
+        vocab.convert_tokens_to_ids(x))
+
   # Encode objects and boxes.
   image_height, image_width = meta['height'], meta['width']
   assert (meta['names'] == annot['objects']
@@ -215,11 +195,8 @@ def _create_tf_example(annot, meta, bert_tokenizer, do_lower_case,
   rcnn_features = np.concatenate([image_and_rcnn_features[:1], rcnn_features],
                                  0)
 
-  xmin, ymin, xmax, ymax, score = [boxes[:, i] for i in range(5)]
-  xmin /= image_width
-  ymin /= image_height
-  xmax /= image_width
-  ymax /= image_height
+  xmin, ymin, xmax, ymax, score = text_utils.normalize_boxes(
+      boxes, image_width, image_height)
 
   feature = {}
   for key, value in annot.items():
@@ -227,68 +204,107 @@ def _create_tf_example(annot, meta, bert_tokenizer, do_lower_case,
       feature[key] = _int64_feature(value)
     elif isinstance(value, str):
       feature[key] = _bytes_feature(value)
-  feature['image/object/bbox/xmin'] = _float_feature_list(xmin.tolist())
-  feature['image/object/bbox/ymin'] = _float_feature_list(ymin.tolist())
-  feature['image/object/bbox/xmax'] = _float_feature_list(xmax.tolist())
-  feature['image/object/bbox/ymax'] = _float_feature_list(ymax.tolist())
-  feature['image/object/bbox/score'] = _float_feature_list(score.tolist())
-  feature['image/object/bbox/label'] = _bytes_feature_list(obj_to_type.tolist())
-  feature['image/object/bbox/feature'] = _float_feature_list(
-      rcnn_features.flatten().tolist())
-
-  # Encode question.
-  question_tokens, question_tags = _fix_tokenization(question, obj_to_type,
-                                                     old_det_to_new_ind,
-                                                     bert_tokenizer,
-                                                     do_lower_case)
-  feature['question'] = _bytes_feature_list(question_tokens)
+  feature['image/object/bbox/xmin'] = _float_feature_list(xmin)
+  feature['image/object/bbox/ymin'] = _float_feature_list(ymin)
+  feature['image/object/bbox/xmax'] = _float_feature_list(xmax)
+  feature['image/object/bbox/ymax'] = _float_feature_list(ymax)
+  feature['image/object/bbox/score'] = _float_feature_list(score)
+  feature['image/object/bbox/label' + token_suffix] = _tokens_feature(
+      obj_to_type.tolist())
+  if vocab is not None:
+    feature['vocab_hash'] = _bytes_feature(vocab.hash)
+  if feature_encoding == 'float_list':
+    feature['image/object/bbox/feature'] = _float_feature_list(
+        rcnn_features.flatten().tolist())
+  else:
+    feature['image/object/bbox/feature'] = tf.train.Feature(
+        bytes_list=tf.train.BytesList(value=[
+            rcnn_features.astype(np.dtype(feature_encoding).newbyteorder(
+                '<')).tobytes()
+        ]))
+
+  # Encode question, answer choices and rationale choices. The wordpiece
+  # tokenizer is disabled, tokens are kept as they are.
+  fixed_sentences = text_utils.fix_tokenizations(
+      [question] + answer_choices + rationale_choices, obj_to_type,
+      old_det_to_new_ind, do_lower_case)
+
+  question_tokens, question_tags = fixed_sentences[0]
+  feature['question' + token_suffix] = _tokens_feature(question_tokens)
   feature['question_tag'] = _int64_feature_list(question_tags)
 
-  # Encode answer choices.
-  for idx, tokenized_sent in enumerate(answer_choices):
-    tokens, tags = _fix_tokenization(tokenized_sent, obj_to_type,
-                                     old_det_to_new_ind, bert_tokenizer,
-                                     do_lower_case)
-    feature['answer_choice_%i' % (idx + 1)] = _bytes_feature_list(tokens)
+  for idx in range(NUM_CHOICES):
+    tokens, tags = fixed_sentences[1 + idx]
+    feature['answer_choice%s_%i' %
+            (token_suffix, idx + 1)] = _tokens_feature(tokens)
     feature['answer_choice_tag_%i' % (idx + 1)] = _int64_feature_list(tags)
 
-  # Encode ratinale choices.
-  for idx, tokenized_sent in enumerate(rationale_choices):
-    tokens, tags = _fix_tokenization(tokenized_sent, obj_to_type,
-                                     old_det_to_new_ind, bert_tokenizer,
-                                     do_lower_case)
-    feature['rationale_choice_%i' % (idx + 1)] = _bytes_feature_list(tokens)
+    tokens, tags = fixed_sentences[1 + NUM_CHOICES + idx]
+    feature['rationale_choice%s_%i' %
+            (token_suffix, idx + 1)] = _tokens_feature(tokens)
     feature['rationale_choice_tag_%i' % (idx + 1)] = _int64_feature_list(tags)
 
   tf_example = tf.train.Example(features=tf.train.Features(feature=feature))
   return tf_example
 
 
-def main(_):
-  logging.set_verbosity(logging.INFO)
-
-  # Create Bert model.
-  bert_tokenizer = tokenization.FullTokenizer(vocab_file=FLAGS.bert_vocab_file,
-                                              do_lower_case=FLAGS.do_lower_case)
-
-  # Load annotations.
-  annots = _load_annotations(FLAGS.annotations_jsonl_file)
-  logging.info('Loaded %i annotations.', len(annots))
-
-  shard_id, num_shards = FLAGS.shard_id, FLAGS.num_shards
-  assert 0 <= shard_id < num_shards
+def _create_shard(shard_id,
+                  num_shards,
+                  bert_tokenizer,
+                  store,
+                  annot_id_to_key,
+                  vocab,
+                  shard_file=None,
+                  shard_size=None):
+  """Writes the tf examples of a shard.
 
-  writer = tf.io.TFRecordWriter(FLAGS.output_tfrecord_path + '-%05d-of-%05d' %
-                                (shard_id, num_shards))
+  Args:
+    shard_id: Shard id.
+    num_shards: Total number of shards.
+    bert_tokenizer: A tokenization.FullTokenizer object.
+    store: A feature_store.FeatureStore object, or None to read npy files.
+    annot_id_to_key: A python dictionary mapping from annot_id to feature key,
+      only used when `store` is None.
+    vocab: A text_utils.Vocab object, or None to write the tokens as strings.
+    shard_file: Path to the annotations of the shard, see
+      `annotation_reader.split_annotations`. If None, the shard is read from
+      `annotations_jsonl_file`.
+    shard_size: Number of annotations of the shard, reported as processed if
+      the shard is complete.
 
+  Returns:
+    Number of tf examples written.
+  """
+  output_path = FLAGS.output_tfrecord_path + '-%05d-of-%05d' % (shard_id,
+                                                                 num_shards)
+  if resumable_writer.is_complete(output_path):
+    logging.info('Shard %i: %s is complete, skip.', shard_id, output_path)
+    if shard_size is not None:
+      parallel.report_progress(shard_size)
+    return 0
+
+  # Resume from the annotations committed by a previous run, if any.
+  writer = resumable_writer.ResumableTFRecordWriter(output_path)
+  if len(writer):
+    logging.info('Shard %i: resume after %i annotations.', shard_id,
+                 len(writer))
+    parallel.report_progress(len(writer))
+
+  num_written = 0
+  if shard_file is not None:
+    annots = annotation_reader.read_annotations(shard_file,
+                                                skip_annot_ids=writer)
+  else:
+    annots = annotation_reader.read_annotations(FLAGS.annotations_jsonl_file,
+                                                num_shards,
+                                                shard_id,
+                                                skip_annot_ids=writer)
   with zipfile.ZipFile(FLAGS.image_zip_file) as image_zip:
     for idx, annot in enumerate(annots):
       if (idx + 1) % 1000 == 0:
-        logging.info('On example %i/%i.', idx + 1, len(annots))
-
-      annot_id = int(annot['annot_id'].split('-')[-1])
-      if annot_id % num_shards != shard_id:
-        continue
+        logging.info('Shard %i: on example %i.', shard_id, idx + 1)
+      # Annotations are processed whether they are written or skipped.
+      parallel.report_progress()
 
       # Read meta data.
       meta_fn = os.path.join('vcr1images', annot['metadata_fn'])
@@ -300,26 +316,90 @@ def main(_):
         continue
 
       # Read RCNN feature.
-      part_id = get_partition_id(annot['annot_id'])
-      rcnn_fn = os.path.join(FLAGS.frcnn_feature_dir, '%02d' % part_id,
-                             annot['annot_id'] + '.npy')
-      if not os.path.isfile(rcnn_fn):
-        logging.warn('Skip %s.', rcnn_fn)
-        continue
-      try:
-        with open(rcnn_fn, 'rb') as f:
-          rcnn_features = np.load(f)
-      except Exception as ex:
-        logging.warn('Skip %s.', rcnn_fn)
-        raise ValueError('!!!!!!!!!!')
+      if store is not None:
+        if annot['annot_id'] not in store:
+          logging.warn('Skip %s.', annot['annot_id'])
+          continue
+        rcnn_features = np.asarray(store[annot['annot_id']], dtype=np.float32)
+      else:
+        key = annot_id_to_key.get(annot['annot_id'], annot['annot_id'])
+        rcnn_fn = feature_index.get_feature_path(FLAGS.frcnn_feature_dir, key)
+        if not os.path.isfile(rcnn_fn):
+          logging.warn('Skip %s.', rcnn_fn)
+          continue
+        try:
+          with open(rcnn_fn, 'rb') as f:
+            rcnn_features = np.load(f)
+        except Exception as ex:
+          logging.warn('Skip %s.', rcnn_fn)
+          raise ValueError('!!!!!!!!!!')
 
       # Create TF example.
       tf_example = _create_tf_example(annot, meta, bert_tokenizer,
                                       FLAGS.do_lower_case, rcnn_features,
-                                      FLAGS.only_use_relevant_dets)
-      writer.write(tf_example.SerializeToString())
+                                      FLAGS.only_use_relevant_dets,
+                                      FLAGS.frcnn_feature_encoding, vocab)
+      writer.add(annot['annot_id'], [tf_example.SerializeToString()])
+      num_written += 1
 
   writer.close()
+  return num_written
+
+
+def main(_):
+  logging.set_verbosity(logging.INFO)
+
+  # The resumable shards are written in place, on the local file system only.
+  resumable_writer.check_local_path(FLAGS.output_tfrecord_path)
+
+  # Create Bert model.
+  bert_tokenizer = tokenization.FullTokenizer(vocab_file=FLAGS.bert_vocab_file,
+                                              do_lower_case=FLAGS.do_lower_case)
+
+  vocab = None
+  if FLAGS.encode_token_ids:
+    vocab = text_utils.Vocab(FLAGS.bert_vocab_file,
+                             FLAGS.out_of_vocabulary_token_id)
+
+  num_shards = FLAGS.num_shards
+
+  # Features extracted with `key_by_image` are resolved through the index.
+  # Both are opened before forking, so the workers share the memory map.
+  store, annot_id_to_key = None, None
+  if FLAGS.frcnn_feature_store_dir is not None:
+    store = feature_store.FeatureStore(FLAGS.frcnn_feature_store_dir)
+    logging.info('Opened feature store with %i entries.', len(store))
+  else:
+    annot_id_to_key = feature_index.load_index(FLAGS.frcnn_feature_dir)
+    logging.info('Loaded %i index entries.', len(annot_id_to_key))
+
+  if FLAGS.num_workers > 0:
+    # The jsonl file is read once and split into one file per shard, so that
+    # each worker only reads its own annotations.
+    temp_dir = tempfile.mkdtemp()
+    try:
+      shard_files, shard_sizes = annotation_reader.split_annotations(
+          FLAGS.annotations_jsonl_file, temp_dir, num_shards)
+      logging.info('Split %i annotations into %i shards.', sum(shard_sizes),
+                   num_shards)
+
+      def _create_shard_fn(shard_id):
+        return _create_shard(shard_id, num_shards, bert_tokenizer, store,
+                             annot_id_to_key, vocab, shard_files[shard_id],
+                             shard_sizes[shard_id])
+
+      parallel.run_in_pool(_create_shard_fn,
+                           num_shards,
+                           FLAGS.num_workers,
+                           num_examples=sum(shard_sizes))
+    finally:
+      shutil.rmtree(temp_dir)
+  else:
+    # The single shard streams its own annotations from the jsonl file.
+    shard_id = FLAGS.shard_id
+    assert 0 <= shard_id < num_shards
+    _create_shard(shard_id, num_shards, bert_tokenizer, store,
+                  annot_id_to_key, vocab)
 
   logging.info('Done')
 
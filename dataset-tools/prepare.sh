@@ -7,6 +7,10 @@ set -x
 num_val_shards=5
 num_train_shards=10
 
+# Number of worker processes of the tfrecord writers, which load the
+# annotations once and write all the shards.
+num_workers=10
+
 ######################################################
 # FRCNN features
 ######################################################
@@ -114,27 +118,23 @@ num_train_shards=10
 ######################################################
 # Image record.
 ######################################################
-# for ((i=0;i<${num_val_shards};i+=1)); do
-#   python "dataset-tools/create_vcr_tfrecord.py" \
-#     --annotations_jsonl_file="data/vcr1annots/val.jsonl" \
-#     --num_shards="${num_val_shards}" \
-#     --bert_vocab_file="data/bert/tf1.x/uncased_L-4_H-512_A-8/vocab.txt" \
-#     --shard_id="$i" \
-#     --do_lower_case \
-#     --output_tfrecord_path="output/uncased/VCR-RAW/val.record" \
-#     > "log/val_${i}.log" 2>&1 &
-# done
+# python "dataset-tools/create_vcr_tfrecord.py" \
+#   --annotations_jsonl_file="data/vcr1annots/val.jsonl" \
+#   --num_shards="${num_val_shards}" \
+#   --num_workers="${num_workers}" \
+#   --bert_vocab_file="data/bert/tf1.x/uncased_L-4_H-512_A-8/vocab.txt" \
+#   --do_lower_case \
+#   --output_tfrecord_path="output/uncased/VCR-RAW/val.record" \
+#   > "log/val.log" 2>&1
 
-# for ((i=0;i<${num_train_shards};i+=1)); do
-#   python "dataset-tools/create_vcr_tfrecord.py" \
-#     --annotations_jsonl_file="data/vcr1annots/train.jsonl" \
-#     --num_shards="${num_train_shards}" \
-#     --bert_vocab_file="data/bert/tf1.x/uncased_L-4_H-512_A-8/vocab.txt" \
-#     --shard_id="$i" \
-#     --do_lower_case \
-#     --output_tfrecord_path="output/uncased/VCR-RAW/train.record" \
-#     > "log/train_${i}.log" 2>&1 &
-# done
+# python "dataset-tools/create_vcr_tfrecord.py" \
+#   --annotations_jsonl_file="data/vcr1annots/train.jsonl" \
+#   --num_shards="${num_train_shards}" \
+#   --num_workers="${num_workers}" \
+#   --bert_vocab_file="data/bert/tf1.x/uncased_L-4_H-512_A-8/vocab.txt" \
+#   --do_lower_case \
+#   --output_tfrecord_path="output/uncased/VCR-RAW/train.record" \
+#   > "log/train.log" 2>&1
 
 name="adv_yes_modify_positives"
 
@@ -149,14 +149,12 @@ name="adv_yes_modify_positives"
 #     > "log/val_${i}.log" 2>&1 &
 # done
 
-for ((i=0;i<${num_train_shards};i+=1)); do
-  python "dataset-tools/create_augmented_vcr_tfrecord.py" \
-    --annotations_jsonl_file="data/vcr1annots/train.jsonl" \
-    --annotations_jsonl_file_aug="data/modified_annots/train_${name}.jsonl" \
-    --num_shards="${num_train_shards}" \
-    --bert_vocab_file="data/bert/tf1.x/uncased_L-4_H-512_A-8/vocab.txt" \
-    --shard_id="$i" \
-    --do_lower_case \
-    --output_tfrecord_path="output/uncased/VCR-RAW/train_${name}.record" \
-    > "log/train_${i}.log" 2>&1 &
-done
+python "dataset-tools/create_augmented_vcr_tfrecord.py" \
+  --annotations_jsonl_file="data/vcr1annots/train.jsonl" \
+  --annotations_jsonl_file_aug="data/modified_annots/train_${name}.jsonl" \
+  --num_shards="${num_train_shards}" \
+  --num_workers="${num_workers}" \
+  --bert_vocab_file="data/bert/tf1.x/uncased_L-4_H-512_A-8/vocab.txt" \
+  --do_lower_case \
+  --output_tfrecord_path="output/uncased/VCR-RAW/train_${name}.record" \
+  > "log/train.log" 2>&1
@@ -0,0 +1,156 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from absl import app
+from absl import flags
+from absl import logging
+
+import time
+import numpy as np
+import tensorflow as tf
+
+from modeling.models import bert_modeling
+
+flags.DEFINE_string('bert_config_file',
+                    'data/bert/tf1.x/BERT-Base/bert_config.json',
+                    'Path to the bert config file.')
+
+flags.DEFINE_string(
+    'init_checkpoint', None, 'Path to the BERT checkpoint shared by both '
+    'models. If None, compare the randomly initialized models.')
+
+flags.DEFINE_integer('batch_size', 8, 'Number of examples per batch.')
+
+flags.DEFINE_integer('num_choices', 4, 'Number of choices per example.')
+
+flags.DEFINE_integer('question_length', 20, 'Number of question tokens.')
+
+flags.DEFINE_integer('choice_length', 12, 'Number of choice tokens.')
+
+flags.DEFINE_integer('num_detections', 10, 'Number of detection tokens.')
+
+flags.DEFINE_integer('num_iterations', 20, 'Number of batches to time.')
+
+flags.DEFINE_integer('num_warmup_iterations', 3,
+                     'Number of batches to skip before timing.')
+
+FLAGS = flags.FLAGS
+
+
+def _time_fetches(sess, fetches, num_iterations, num_warmup_iterations):
+  """Returns the seconds per run of `fetches`."""
+  for _ in range(num_warmup_iterations):
+    sess.run(fetches)
+
+  start = time.time()
+  for _ in range(num_iterations):
+    sess.run(fetches)
+  return (time.time() - start) / num_iterations
+
+
+def benchmark_prefix_cache(config, batch_size, num_choices, prefix_length,
+                           seq_length, num_iterations, num_warmup_iterations,
+                           init_checkpoint=None):
+  """Compares BertModel and PrefixCachedBertModel on the same weights.
+
+  BertModel encodes `first_token prefix other_tokens` once per choice, while
+  PrefixCachedBertModel encodes the prefix once per example. Both share the
+  variables of the `bert` scope and the token positions. They differ in that
+  the prefix tokens of PrefixCachedBertModel do not attend to the choice.
+
+  Args:
+    config: A BertConfig instance.
+    batch_size: Number of examples.
+    num_choices: Number of choices per example.
+    prefix_length: Number of tokens shared by the choices of an example.
+    seq_length: Number of tokens of a choice, including the [CLS] token.
+    num_iterations: Number of batches to time.
+    num_warmup_iterations: Number of batches to skip before timing.
+    init_checkpoint: Path to a BERT checkpoint. If None, use the random
+      initialization.
+
+  Returns:
+    bert_seconds: Seconds per batch of BertModel.
+    cached_seconds: Seconds per batch of PrefixCachedBertModel.
+    max_abs_diff: Maximum absolute difference of the pooled outputs.
+    agreement: Fraction of the examples on which the two models pick the same
+      choice, scoring the pooled outputs with a random linear layer.
+  """
+  rng = np.random.RandomState(0)
+  with tf.Graph().as_default():
+    prefix_ids = rng.randint(config.vocab_size,
+                             size=[batch_size, prefix_length])
+    input_ids = rng.randint(config.vocab_size,
+                            size=[batch_size * num_choices, seq_length])
+    full_input_ids = np.concatenate([
+        input_ids[:, :1],
+        np.repeat(prefix_ids, num_choices, axis=0), input_ids[:, 1:]
+    ], -1)
+
+    bert_model = bert_modeling.BertModel(config,
+                                         is_training=False,
+                                         input_ids=tf.constant(
+                                             full_input_ids, tf.int32),
+                                         scope='bert')
+    with tf.compat.v1.variable_scope(tf.compat.v1.get_variable_scope(),
+                                     reuse=True):
+      cached_model = bert_modeling.PrefixCachedBertModel(
+          config,
+          is_training=False,
+          prefix_ids=tf.constant(prefix_ids, tf.int32),
+          input_ids=tf.constant(input_ids, tf.int32),
+          scope='bert')
+    if init_checkpoint:
+      tf.compat.v1.train.init_from_checkpoint(init_checkpoint,
+                                              {'bert/': 'bert/'})
+
+    bert_output = bert_model.get_pooled_output()
+    cached_output = cached_model.get_pooled_output()
+
+    session_config = tf.compat.v1.ConfigProto(device_count={'GPU': 0})
+    with tf.compat.v1.Session(config=session_config) as sess:
+      sess.run(tf.compat.v1.global_variables_initializer())
+      bert_seconds = _time_fetches(sess, bert_output, num_iterations,
+                                   num_warmup_iterations)
+      cached_seconds = _time_fetches(sess, cached_output, num_iterations,
+                                     num_warmup_iterations)
+      bert_values, cached_values = sess.run([bert_output, cached_output])
+
+  max_abs_diff = np.abs(bert_values - cached_values).max()
+  weights = rng.normal(size=[bert_values.shape[-1]])
+  bert_scores = bert_values.dot(weights).reshape([batch_size, num_choices])
+  cached_scores = cached_values.dot(weights).reshape([batch_size, num_choices])
+  agreement = (bert_scores.argmax(-1) == cached_scores.argmax(-1)).mean()
+  return bert_seconds, cached_seconds, max_abs_diff, agreement
+
+
+def main(_):
+  logging.set_verbosity(logging.INFO)
+
+  config = bert_modeling.BertConfig.from_json_file(FLAGS.bert_config_file)
+
+  # The prefix is `question [SEP] detections [SEP]`, the choice sequence is
+  # `[CLS] choice [SEP]`.
+  prefix_length = FLAGS.question_length + FLAGS.num_detections + 2
+  seq_length = FLAGS.choice_length + 2
+
+  (bert_seconds, cached_seconds, max_abs_diff,
+   agreement) = benchmark_prefix_cache(config, FLAGS.batch_size,
+                                       FLAGS.num_choices, prefix_length,
+                                       seq_length, FLAGS.num_iterations,
+                                       FLAGS.num_warmup_iterations,
+                                       FLAGS.init_checkpoint)
+  logging.info('BertModel: %.2lf ms/example.',
+               1e3 * bert_seconds / FLAGS.batch_size)
+  logging.info('PrefixCachedBertModel: %.2lf ms/example.',
+               1e3 * cached_seconds / FLAGS.batch_size)
+  logging.info('Speedup: %.2lfx.', bert_seconds / cached_seconds)
+  logging.info(
+      'Max absolute difference of the pooled outputs: %.4lf, '
+      'same predicted choice on %.1lf%% of the examples.', max_abs_diff,
+      100.0 * agreement)
+
+
+if __name__ == '__main__':
+  app.run(main)
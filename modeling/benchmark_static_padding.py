@@ -0,0 +1,144 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from absl import app
+from absl import flags
+from absl import logging
+
+import time
+import numpy as np
+import tensorflow as tf
+
+from modeling.models import bert_modeling
+
+flags.DEFINE_string(
+    'bert_config_file', None, 'Path to the bert config file. If None, use a '
+    'small BERT that trains at a reasonable pace on CPU.')
+
+flags.DEFINE_integer('batch_size', 16, 'Number of sequences per batch.')
+
+flags.DEFINE_integer('min_seq_len', 24, 'Minimum length of the sequences.')
+
+flags.DEFINE_integer('max_seq_len', 96,
+                     'Maximum length of the sequences, the static padding.')
+
+flags.DEFINE_integer('num_iterations', 50, 'Number of steps to time.')
+
+flags.DEFINE_integer('num_warmup_iterations', 10,
+                     'Number of steps to skip before timing.')
+
+flags.DEFINE_bool(
+    'use_xla_jit', False, 'If true, compile the graph with the XLA JIT, as '
+    'TrainConfig.use_xla_jit. On CPU, it also requires '
+    'TF_XLA_FLAGS=--tf_xla_cpu_global_jit.')
+
+flags.DEFINE_bool('use_gpu', False, 'If true, allow running on the GPU.')
+
+FLAGS = flags.FLAGS
+
+
+def _create_batches(rng, vocab_size, num_batches, static_padding):
+  """Creates batches of sequences of random lengths.
+
+  Args:
+    rng: A numpy RandomState.
+    vocab_size: Size of the vocabulary.
+    num_batches: Number of batches.
+    static_padding: If true, pad to `max_seq_len`, otherwise to the longest
+      sequence of each batch.
+
+  Returns:
+    A list of (input_ids, input_mask) numpy arrays.
+  """
+  batches = []
+  for _ in range(num_batches):
+    lengths = rng.randint(FLAGS.min_seq_len, FLAGS.max_seq_len + 1,
+                          size=FLAGS.batch_size)
+    padded_len = FLAGS.max_seq_len if static_padding else lengths.max()
+    input_mask = (np.arange(padded_len)[np.newaxis, :] <
+                  lengths[:, np.newaxis]).astype(np.int32)
+    input_ids = rng.randint(1, vocab_size, size=input_mask.shape) * input_mask
+    batches.append((input_ids, input_mask))
+  return batches
+
+
+def benchmark_training(config, static_padding, num_iterations,
+                       num_warmup_iterations):
+  """Times the training steps of BertModel.
+
+  Args:
+    config: A BertConfig instance.
+    static_padding: If true, pad the batches to a fixed shape.
+    num_iterations: Number of steps to time.
+    num_warmup_iterations: Number of steps to skip before timing.
+
+  Returns:
+    steps_per_sec: Steady-state training steps per second.
+    padding_ratio: Fraction of the padding tokens in the batches.
+  """
+  rng = np.random.RandomState(0)
+  batches = _create_batches(rng, config.vocab_size,
+                            num_warmup_iterations + num_iterations,
+                            static_padding)
+  padding_ratio = 1.0 - (np.sum([x[1].sum() for x in batches]) /
+                         np.sum([x[1].size for x in batches]))
+
+  with tf.Graph().as_default():
+    seq_len = FLAGS.max_seq_len if static_padding else None
+    input_ids = tf.compat.v1.placeholder(tf.int32, [FLAGS.batch_size, seq_len])
+    input_mask = tf.compat.v1.placeholder(tf.int32,
+                                          [FLAGS.batch_size, seq_len])
+    model = bert_modeling.BertModel(config,
+                                    is_training=True,
+                                    input_ids=input_ids,
+                                    input_mask=input_mask)
+    logits = tf.compat.v1.layers.dense(model.get_pooled_output(), 4)
+    loss = tf.reduce_mean(
+        tf.nn.sparse_softmax_cross_entropy_with_logits(
+            labels=tf.zeros([FLAGS.batch_size], tf.int32), logits=logits))
+    train_op = tf.compat.v1.train.AdamOptimizer(1e-5).minimize(loss)
+
+    session_config = tf.compat.v1.ConfigProto()
+    if not FLAGS.use_gpu:
+      session_config.device_count['GPU'] = 0
+    if FLAGS.use_xla_jit:
+      session_config.graph_options.optimizer_options.global_jit_level = (
+          tf.compat.v1.OptimizerOptions.ON_1)
+
+    with tf.compat.v1.Session(config=session_config) as sess:
+      sess.run(tf.compat.v1.global_variables_initializer())
+      for step, (ids, mask) in enumerate(batches):
+        if step == num_warmup_iterations:
+          start = time.time()
+        sess.run(train_op, feed_dict={input_ids: ids, input_mask: mask})
+      steps_per_sec = num_iterations / (time.time() - start)
+  return steps_per_sec, padding_ratio
+
+
+def main(_):
+  logging.set_verbosity(logging.INFO)
+
+  if FLAGS.bert_config_file:
+    config = bert_modeling.BertConfig.from_json_file(FLAGS.bert_config_file)
+  else:
+    config = bert_modeling.BertConfig(vocab_size=30522,
+                                      hidden_size=256,
+                                      num_hidden_layers=4,
+                                      num_attention_heads=4,
+                                      intermediate_size=1024,
+                                      max_position_embeddings=512)
+
+  results = []
+  for name, static_padding in [('dynamic', False), ('static', True)]:
+    steps_per_sec, padding_ratio = benchmark_training(
+        config, static_padding, FLAGS.num_iterations,
+        FLAGS.num_warmup_iterations)
+    results.append(steps_per_sec)
+    logging.info('%s padding: %.2lf steps/sec, %.1lf%% padding tokens.', name,
+                 steps_per_sec, 100.0 * padding_ratio)
+  logging.info('Static/dynamic: %.2lfx.', results[1] / results[0])
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -7,11 +7,14 @@ from absl import flags
 from absl import logging
 
 import os
+import subprocess
+import sys
 import numpy as np
 import tensorflow as tf
 from google.protobuf import text_format
 from protos import pipeline_pb2
 from modeling import trainer
+from readers import sharding
 
 flags.DEFINE_string('model_dir', None,
                     'Path to the directory which holds model checkpoints.')
@@ -23,6 +26,14 @@ flags.DEFINE_bool('rationale', False, 'If true, evaluate rationale results.')
 flags.DEFINE_string('input_pattern', None,
                     'If specified, replace the input files.')
 
+flags.DEFINE_integer(
+    'num_workers', 1, 'Number of local processes to evaluate with, each of '
+    'them predicts a shard of the examples.')
+
+flags.DEFINE_integer(
+    'worker_id', None, 'Index of the worker process, set by the process '
+    'launching the workers.')
+
 FLAGS = flags.FLAGS
 
 
@@ -39,24 +50,56 @@ def _load_pipeline_proto(filename):
     return text_format.Merge(fp.read(), pipeline_pb2.Pipeline())
 
 
-def main(_):
-  logging.set_verbosity(logging.DEBUG)
+def _get_worker_filename(eval_name, worker_id, num_workers):
+  """Returns the path of the results of a worker process."""
+  return os.path.join(
+      FLAGS.model_dir,
+      '%s.worker-%i-of-%i.npy' % (eval_name or 'eval', worker_id, num_workers))
 
-  for gpu in tf.config.experimental.list_physical_devices('GPU'):
-    tf.config.experimental.set_memory_growth(gpu, True)
-  pipeline_proto = _load_pipeline_proto(FLAGS.pipeline_proto)
 
-  eval_name = None
-  if FLAGS.input_pattern is not None:
-    eval_name = os.path.basename(FLAGS.input_pattern).split('.')[0]
-    del pipeline_proto.eval_reader.vcr_reader.input_pattern[:]
-    pipeline_proto.eval_reader.vcr_reader.input_pattern.append(
-        FLAGS.input_pattern)
+def _save_results(filename, annot_ids, labels, predictions):
+  """Saves the evaluation results to a npy file."""
+  with tf.io.gfile.GFile(filename, 'wb') as f:
+    np.save(f, annot_ids)
+    np.save(f, labels)
+    np.save(f, predictions)
+  logging.info('Results are written to %s.', filename)
+
+
+def _load_results(filename):
+  """Loads the evaluation results written by `_save_results`."""
+  with tf.io.gfile.GFile(filename, 'rb') as f:
+    return tuple(np.load(f, allow_pickle=True) for _ in range(3))
 
-  label_key = 'answer_label'
-  if FLAGS.rationale:
-    label_key = 'rationale_label'
 
+def _merge_results(results):
+  """Merges the results of the worker processes by annot_id.
+
+  Args:
+    results: A list of (annot_ids, labels, predictions) tuples.
+
+  Returns:
+    A (annot_ids, labels, predictions) tuple sorted by annot_id, each example
+    occurs once.
+  """
+  annot_ids, labels, predictions = [
+      np.concatenate(x, 0) for x in zip(*results)
+  ]
+  annot_ids, indices = np.unique(annot_ids, return_index=True)
+  return annot_ids, labels[indices], predictions[indices]
+
+
+def _predict(pipeline_proto, label_key):
+  """Predicts the evaluation examples.
+
+  Args:
+    pipeline_proto: An instance of pipeline_pb2.Pipeline.
+    label_key: Name of the label field.
+
+  Returns:
+    A (annot_ids, labels, predictions) tuple, without the examples padding the
+    last batch.
+  """
   count = 0
   annot_ids, labels, predictions = [], [], []
   for example_id, example in enumerate(
@@ -71,16 +114,94 @@ def main(_):
   labels = np.concatenate(labels, 0)
   predictions = np.concatenate(predictions, 0)
 
+  # Remove the copies padding the last batch, see sharding.pad_last_batch.
+  kept = annot_ids != sharding.PADDING_ANNOT_ID.encode('utf8')
+  logging.info('Predicted %i examples, %i padding examples removed.',
+               kept.sum(), len(kept) - kept.sum())
+  return annot_ids[kept], labels[kept], predictions[kept]
+
+
+def _run_workers(eval_name, num_workers):
+  """Evaluates in `num_workers` local processes and merges their results.
+
+  Each worker reads a shard of the examples, in the deterministic order, and
+  writes its results to a npy file. The GPUs are assigned round-robin.
+
+  Args:
+    eval_name: Name of the evaluation, None to use the default.
+    num_workers: Number of worker processes.
+
+  Returns:
+    A (annot_ids, labels, predictions) tuple.
+  """
+  gpus = tf.config.experimental.list_physical_devices('GPU')
+
+  processes = []
+  for worker_id in range(num_workers):
+    env = dict(os.environ)
+    if gpus:
+      env['CUDA_VISIBLE_DEVICES'] = str(worker_id % len(gpus))
+    command = [sys.executable, '-m', 'modeling.evaluate'] + sys.argv[1:] + [
+        '--worker_id=%i' % worker_id
+    ]
+    processes.append(subprocess.Popen(command, env=env))
+
+  for worker_id, process in enumerate(processes):
+    if process.wait() != 0:
+      raise ValueError('Worker %i failed with exit code %i.' %
+                       (worker_id, process.returncode))
+
+  return _merge_results([
+      _load_results(_get_worker_filename(eval_name, worker_id, num_workers))
+      for worker_id in range(num_workers)
+  ])
+
+
+def main(_):
+  logging.set_verbosity(logging.DEBUG)
+
+  for gpu in tf.config.experimental.list_physical_devices('GPU'):
+    tf.config.experimental.set_memory_growth(gpu, True)
+  pipeline_proto = _load_pipeline_proto(FLAGS.pipeline_proto)
+
+  eval_reader = pipeline_proto.eval_reader
+  reader_options = getattr(eval_reader, eval_reader.WhichOneof('reader_oneof'))
+
+  # Every example is evaluated whatever the number of workers, instead of
+  # dropping the last partial batch of each worker.
+  reader_options.pad_last_batch = True
+
+  eval_name = None
+  if FLAGS.input_pattern is not None:
+    eval_name = os.path.basename(FLAGS.input_pattern).split('.')[0]
+    del reader_options.input_pattern[:]
+    reader_options.input_pattern.append(FLAGS.input_pattern)
+
+  label_key = 'answer_label'
+  if FLAGS.rationale:
+    label_key = 'rationale_label'
+
+  if FLAGS.worker_id is not None:
+    reader_options.sharding.num_shards = FLAGS.num_workers
+    reader_options.sharding.shard_id = FLAGS.worker_id
+    reader_options.deterministic = True
+    _save_results(
+        _get_worker_filename(eval_name, FLAGS.worker_id, FLAGS.num_workers),
+        *_predict(pipeline_proto, label_key))
+    return
+
+  if FLAGS.num_workers > 1:
+    annot_ids, labels, predictions = _run_workers(eval_name, FLAGS.num_workers)
+  else:
+    annot_ids, labels, predictions = _predict(pipeline_proto, label_key)
+
   if eval_name is not None:
-    eval_npy = os.path.join(FLAGS.model_dir, '%s.npy' % eval_name)
-    with open(eval_npy, 'wb') as f:
-      np.save(f, annot_ids)
-      np.save(f, labels)
-      np.save(f, predictions)
-    logging.info('Results are written to %s.', eval_npy)
+    _save_results(os.path.join(FLAGS.model_dir, '%s.npy' % eval_name),
+                  annot_ids, labels, predictions)
 
   accuracy = (labels == predictions.argmax(-1)).astype(np.float32).mean()
-  logging.info('Evaluated %i examples, accuracy=%.3lf.', count, accuracy)
+  logging.info('Evaluated %i examples, accuracy=%.3lf.', len(annot_ids),
+               accuracy)
 
 
 if __name__ == '__main__':
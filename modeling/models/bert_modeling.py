@@ -278,6 +278,228 @@ class BertModel(object):
     return self.embedding_table
 
 
+class PrefixCachedBertModel(object):
+  """BERT model encoding the prefix shared by several sequences once.
+
+  The model reads `batch_size` prefixes and `batch_size * num_sequences`
+  sequences, the sequences [i * num_sequences, (i + 1) * num_sequences) sharing
+  the i-th prefix. Each sequence and its prefix form one BERT input, the order
+  of the tokens being given by the position ids. Unlike `BertModel`, the prefix
+  tokens do not attend to the sequence tokens. Hence the prefix is encoded once
+  instead of once per sequence, and the sequences reuse its keys and values at
+  every layer (see `prefix_cached_transformer_model`).
+
+  The variables are those of `BertModel`. Since the pooler reads the first
+  token of the sequence, the [CLS] token has to be the first sequence token.
+  """
+
+  def __init__(self,
+               config,
+               is_training,
+               prefix_ids,
+               input_ids,
+               prefix_mask=None,
+               input_mask=None,
+               prefix_token_type_ids=None,
+               token_type_ids=None,
+               prefix_tag_features=None,
+               token_tag_features=None,
+               prefix_position_ids=None,
+               position_ids=None,
+               use_one_hot_embeddings=False,
+               attention_entropy_regularizer=0.0,
+               scope=None):
+    """Constructor for PrefixCachedBertModel.
+
+    Args:
+      config: `BertConfig` instance.
+      is_training: bool. true for training model, false for eval model. Controls
+        whether dropout will be applied.
+      prefix_ids: int32 Tensor of shape [batch_size, prefix_length].
+      input_ids: int32 Tensor of shape [batch_size * num_sequences,
+        seq_length].
+      prefix_mask: (optional) int32 Tensor of shape [batch_size,
+        prefix_length].
+      input_mask: (optional) int32 Tensor of shape [batch_size * num_sequences,
+        seq_length].
+      prefix_token_type_ids: (optional) int32 Tensor of shape [batch_size,
+        prefix_length].
+      token_type_ids: (optional) int32 Tensor of shape [batch_size *
+        num_sequences, seq_length].
+      prefix_tag_features: (optional) float Tensor of shape [batch_size,
+        prefix_length, hidden_size], added to the prefix embeddings.
+      token_tag_features: (optional) float Tensor of shape [batch_size *
+        num_sequences, seq_length, hidden_size], added to the embeddings.
+      prefix_position_ids: (optional) int32 Tensor of shape [batch_size,
+        prefix_length]. Defaults to [1, ..., prefix_length].
+      position_ids: (optional) int32 Tensor of shape [batch_size *
+        num_sequences, seq_length]. Defaults to [0, prefix_length + 1, ...,
+        prefix_length + seq_length - 1], i.e., the first token is followed by
+        the prefix and the other tokens.
+      use_one_hot_embeddings: (optional) bool. Whether to use one-hot word
+        embeddings or tf.embedding_lookup() for the word embeddings.
+      attention_entropy_regularizer: (optional) float. Weight of the loss
+        maximizing the entropy of the attention probabilities.
+      scope: (optional) variable scope. Defaults to "bert".
+
+    Raises:
+      ValueError: The config is invalid or one of the input tensor shapes
+        is invalid.
+    """
+    config = copy.deepcopy(config)
+    if not is_training:
+      config.hidden_dropout_prob = 0.0
+      config.attention_probs_dropout_prob = 0.0
+
+    prefix_shape = get_shape_list(prefix_ids, expected_rank=2)
+    batch_size = prefix_shape[0]
+    prefix_length = prefix_shape[1]
+
+    input_shape = get_shape_list(input_ids, expected_rank=2)
+    input_batch_size = input_shape[0]
+    seq_length = input_shape[1]
+
+    if prefix_mask is None:
+      prefix_mask = tf.ones(shape=[batch_size, prefix_length], dtype=tf.int32)
+    if input_mask is None:
+      input_mask = tf.ones(shape=[input_batch_size, seq_length],
+                           dtype=tf.int32)
+
+    if prefix_token_type_ids is None:
+      prefix_token_type_ids = tf.zeros(shape=[batch_size, prefix_length],
+                                       dtype=tf.int32)
+    if token_type_ids is None:
+      token_type_ids = tf.zeros(shape=[input_batch_size, seq_length],
+                                dtype=tf.int32)
+
+    if prefix_position_ids is None:
+      prefix_position_ids = tf.tile(
+          tf.expand_dims(tf.range(1, prefix_length + 1), 0), [batch_size, 1])
+    if position_ids is None:
+      position_ids = tf.concat(
+          [[0], tf.range(prefix_length + 1, prefix_length + seq_length)], 0)
+      position_ids = tf.tile(tf.expand_dims(position_ids, 0),
+                             [input_batch_size, 1])
+
+    if prefix_tag_features is None and token_tag_features is not None:
+      prefix_tag_features = tf.zeros(
+          shape=[batch_size, prefix_length, config.hidden_size])
+    if token_tag_features is None and prefix_tag_features is not None:
+      token_tag_features = tf.zeros(
+          shape=[input_batch_size, seq_length, config.hidden_size])
+
+    # The embeddings of the prefixes and the sequences are computed together,
+    # as a single sequence of `num_prefix_tokens + num_input_tokens` tokens.
+    num_prefix_tokens = batch_size * prefix_length
+    num_input_tokens = input_batch_size * seq_length
+
+    def _concat_tokens(prefix_tensor, input_tensor):
+      """Concatenates the tokens, returns [1, num_tokens, ...]."""
+      trailing_dims = get_shape_list(prefix_tensor)[2:]
+      output = tf.concat([
+          tf.reshape(prefix_tensor, [num_prefix_tokens] + trailing_dims),
+          tf.reshape(input_tensor, [num_input_tokens] + trailing_dims)
+      ], 0)
+      return tf.expand_dims(output, 0)
+
+    with tf.variable_scope(scope, default_name="bert"):
+
+      with tf.variable_scope("embeddings"):
+        # Perform embedding lookup on the word ids.
+        (embedding_output, self.embedding_table) = embedding_lookup(
+            input_ids=_concat_tokens(prefix_ids, input_ids),
+            vocab_size=config.vocab_size,
+            embedding_size=config.hidden_size,
+            initializer_range=config.initializer_range,
+            word_embedding_name="word_embeddings",
+            use_one_hot_embeddings=use_one_hot_embeddings)
+
+        # Add positional embeddings and token type embeddings, then layer
+        # normalize and perform dropout.
+        embedding_output = embedding_postprocessor(
+            input_tensor=embedding_output,
+            use_token_type=True,
+            token_type_ids=_concat_tokens(prefix_token_type_ids,
+                                          token_type_ids),
+            token_type_vocab_size=config.type_vocab_size,
+            token_type_embedding_name="token_type_embeddings",
+            token_tag_features=(None if token_tag_features is None else
+                                _concat_tokens(prefix_tag_features,
+                                               token_tag_features)),
+            position_ids=_concat_tokens(prefix_position_ids, position_ids),
+            use_position_embeddings=True,
+            position_embedding_name="position_embeddings",
+            initializer_range=config.initializer_range,
+            max_position_embeddings=config.max_position_embeddings,
+            dropout_prob=config.hidden_dropout_prob)
+
+        (self.prefix_embedding_output, self.embedding_output) = tf.split(
+            embedding_output[0], [num_prefix_tokens, num_input_tokens])
+        self.prefix_embedding_output = tf.reshape(
+            self.prefix_embedding_output,
+            [batch_size, prefix_length, config.hidden_size])
+        self.embedding_output = tf.reshape(
+            self.embedding_output,
+            [input_batch_size, seq_length, config.hidden_size])
+
+      with tf.variable_scope("encoder"):
+        (self.all_prefix_encoder_layers,
+         self.all_encoder_layers) = prefix_cached_transformer_model(
+             prefix_tensor=self.prefix_embedding_output,
+             input_tensor=self.embedding_output,
+             prefix_mask=prefix_mask,
+             input_mask=input_mask,
+             hidden_size=config.hidden_size,
+             num_hidden_layers=config.num_hidden_layers,
+             num_attention_heads=config.num_attention_heads,
+             intermediate_size=config.intermediate_size,
+             intermediate_act_fn=get_activation(config.hidden_act),
+             hidden_dropout_prob=config.hidden_dropout_prob,
+             attention_probs_dropout_prob=config.attention_probs_dropout_prob,
+             initializer_range=config.initializer_range,
+             attention_entropy_regularizer=attention_entropy_regularizer,
+             do_return_all_layers=True)
+
+      self.prefix_output = self.all_prefix_encoder_layers[-1]
+      self.sequence_output = self.all_encoder_layers[-1]
+      with tf.variable_scope("pooler"):
+        first_token_tensor = tf.squeeze(self.sequence_output[:, 0:1, :], axis=1)
+        self.pooled_output = tf.layers.dense(
+            first_token_tensor,
+            config.hidden_size,
+            activation=tf.tanh,
+            kernel_initializer=create_initializer(config.initializer_range))
+
+  def get_pooled_output(self):
+    return self.pooled_output
+
+  def get_sequence_output(self):
+    """Gets final hidden layer of the sequences.
+
+    Returns:
+      float Tensor of shape [batch_size * num_sequences, seq_length,
+      hidden_size].
+    """
+    return self.sequence_output
+
+  def get_prefix_output(self):
+    """Gets final hidden layer of the prefixes.
+
+    Returns:
+      float Tensor of shape [batch_size, prefix_length, hidden_size].
+    """
+    return self.prefix_output
+
+  def get_all_encoder_layers(self):
+    return self.all_encoder_layers
+
+  def get_embedding_output(self):
+    return self.embedding_output
+
+  def get_embedding_table(self):
+    return self.embedding_table
+
+
 def gelu(x):
   """Gaussian Error Linear Unit.
 
@@ -454,6 +676,7 @@ def embedding_postprocessor(input_tensor,
                             use_position_embeddings=True,
                             position_embedding_name="position_embeddings",
                             token_tag_features=None,
+                            position_ids=None,
                             initializer_range=0.02,
                             max_position_embeddings=512,
                             dropout_prob=0.1):
@@ -472,6 +695,10 @@ def embedding_postprocessor(input_tensor,
       position of each token in the sequence.
     position_embedding_name: string. The name of the embedding table variable
       for positional embeddings.
+    token_tag_features: (optional) float Tensor of shape [batch_size,
+      seq_length, embedding_size], added to the embeddings.
+    position_ids: (optional) int32 Tensor of shape [batch_size, seq_length].
+      The positions of the tokens, [0, 1, ..., seq_length-1] if not specified.
     initializer_range: float. Range of the weight initialization.
     max_position_embeddings: int. Maximum sequence length that might ever be
       used with this model. This can be longer than the sequence length of
@@ -508,7 +735,17 @@ def embedding_postprocessor(input_tensor,
                                        [batch_size, seq_length, width])
     output += token_type_embeddings
 
-  if use_position_embeddings:
+  if use_position_embeddings and position_ids is not None:
+    assert_op = tf.assert_less(tf.reduce_max(position_ids),
+                               max_position_embeddings)
+    with tf.control_dependencies([assert_op]):
+      full_position_embeddings = tf.get_variable(
+          name=position_embedding_name,
+          shape=[max_position_embeddings, width],
+          initializer=create_initializer(initializer_range))
+      output += tf.gather(full_position_embeddings, position_ids)
+
+  elif use_position_embeddings:
     assert_op = tf.assert_less_equal(seq_length, max_position_embeddings)
     with tf.control_dependencies([assert_op]):
       full_position_embeddings = tf.get_variable(
@@ -580,9 +817,63 @@ def create_attention_mask_from_input_mask(from_tensor, to_mask):
   return mask
 
 
+def create_attention_adder(attention_mask):
+  """Converts a 3D attention mask to the adder of the attention scores.
+
+  Args:
+    attention_mask: int32 or float Tensor of shape [batch_size,
+      from_seq_length, to_seq_length], with 1 for positions that can be
+      attended to and 0 for the others.
+
+  Returns:
+    float Tensor of shape [batch_size, 1, from_seq_length, to_seq_length],
+    0.0 for positions that can be attended to and -10000.0 for the others.
+  """
+  # `attention_mask` = [B, 1, F, T]
+  attention_mask = tf.expand_dims(attention_mask, axis=[1])
+  return (1.0 - tf.cast(attention_mask, tf.float32)) * -10000.0
+
+
+def fused_qkv_projection(input_tensor, hidden_size, initializer_range=0.02):
+  """Projects the input to the queries, keys and values with one matmul.
+
+  The variables are those of three `tf.layers.dense` named "query", "key"
+  and "value", so that the BERT checkpoints are still compatible. They are
+  concatenated to a single [width, 3 * hidden_size] projection.
+
+  Args:
+    input_tensor: float Tensor of shape [batch_size * seq_length, width].
+    hidden_size: int. Width of each projection, i.e., `num_attention_heads *
+      size_per_head`.
+    initializer_range: float. Range of the weight initializer.
+
+  Returns:
+    A (query, key, value) tuple of float Tensors of shape [batch_size *
+    seq_length, hidden_size].
+  """
+  width = get_shape_list(input_tensor, expected_rank=2)[1]
+
+  kernels, biases = [], []
+  for name in ["query", "key", "value"]:
+    with tf.variable_scope(name):
+      kernels.append(
+          tf.get_variable("kernel",
+                          shape=[width, hidden_size],
+                          initializer=create_initializer(initializer_range)))
+      biases.append(
+          tf.get_variable("bias",
+                          shape=[hidden_size],
+                          initializer=tf.zeros_initializer()))
+
+  output = tf.nn.bias_add(tf.matmul(input_tensor, tf.concat(kernels, 1)),
+                          tf.concat(biases, 0))
+  return tf.split(output, 3, axis=-1)
+
+
 def attention_layer(from_tensor,
                     to_tensor,
                     attention_mask=None,
+                    attention_adder=None,
                     num_attention_heads=1,
                     size_per_head=512,
                     query_act=None,
@@ -623,6 +914,9 @@ def attention_layer(from_tensor,
       from_seq_length, to_seq_length]. The values should be 1 or 0. The
       attention scores will effectively be set to -infinity for any positions in
       the mask that are 0, and will be unchanged for positions that are 1.
+    attention_adder: (optional) float Tensor of shape [batch_size, 1,
+      from_seq_length, to_seq_length], precomputed from the attention mask by
+      `create_attention_adder`. Used instead of `attention_mask` if specified.
     num_attention_heads: int. Number of attention heads.
     size_per_head: int. Size of each attention head.
     query_act: (optional) Activation function for the query transform.
@@ -652,14 +946,6 @@ def attention_layer(from_tensor,
     ValueError: Any of the arguments or tensor shapes are invalid.
   """
 
-  def transpose_for_scores(input_tensor, batch_size, num_attention_heads,
-                           seq_length, width):
-    output_tensor = tf.reshape(
-        input_tensor, [batch_size, seq_length, num_attention_heads, width])
-
-    output_tensor = tf.transpose(output_tensor, [0, 2, 1, 3])
-    return output_tensor
-
   from_shape = get_shape_list(from_tensor, expected_rank=[2, 3])
   to_shape = get_shape_list(to_tensor, expected_rank=[2, 3])
 
@@ -688,29 +974,117 @@ def attention_layer(from_tensor,
   from_tensor_2d = reshape_to_matrix(from_tensor)
   to_tensor_2d = reshape_to_matrix(to_tensor)
 
-  # `query_layer` = [B*F, N*H]
-  query_layer = tf.layers.dense(
-      from_tensor_2d,
-      num_attention_heads * size_per_head,
-      activation=query_act,
-      name="query",
-      kernel_initializer=create_initializer(initializer_range))
-
-  # `key_layer` = [B*T, N*H]
-  key_layer = tf.layers.dense(
-      to_tensor_2d,
-      num_attention_heads * size_per_head,
-      activation=key_act,
-      name="key",
-      kernel_initializer=create_initializer(initializer_range))
-
-  # `value_layer` = [B*T, N*H]
-  value_layer = tf.layers.dense(
-      to_tensor_2d,
-      num_attention_heads * size_per_head,
-      activation=value_act,
-      name="value",
-      kernel_initializer=create_initializer(initializer_range))
+  if from_tensor is to_tensor:
+    # `query_layer`, `key_layer`, `value_layer` = [B*F, N*H]
+    (query_layer, key_layer, value_layer) = fused_qkv_projection(
+        from_tensor_2d,
+        num_attention_heads * size_per_head,
+        initializer_range=initializer_range)
+    if query_act is not None:
+      query_layer = query_act(query_layer)
+    if key_act is not None:
+      key_layer = key_act(key_layer)
+    if value_act is not None:
+      value_layer = value_act(value_layer)
+
+  else:
+    # `query_layer` = [B*F, N*H]
+    query_layer = tf.layers.dense(
+        from_tensor_2d,
+        num_attention_heads * size_per_head,
+        activation=query_act,
+        name="query",
+        kernel_initializer=create_initializer(initializer_range))
+
+    # `key_layer` = [B*T, N*H]
+    key_layer = tf.layers.dense(
+        to_tensor_2d,
+        num_attention_heads * size_per_head,
+        activation=key_act,
+        name="key",
+        kernel_initializer=create_initializer(initializer_range))
+
+    # `value_layer` = [B*T, N*H]
+    value_layer = tf.layers.dense(
+        to_tensor_2d,
+        num_attention_heads * size_per_head,
+        activation=value_act,
+        name="value",
+        kernel_initializer=create_initializer(initializer_range))
+
+  return scaled_dot_product_attention(
+      query_layer,
+      key_layer,
+      value_layer,
+      attention_mask=attention_mask,
+      attention_adder=attention_adder,
+      num_attention_heads=num_attention_heads,
+      size_per_head=size_per_head,
+      attention_probs_dropout_prob=attention_probs_dropout_prob,
+      do_return_2d_tensor=do_return_2d_tensor,
+      batch_size=batch_size,
+      from_seq_length=from_seq_length,
+      to_seq_length=to_seq_length,
+      attention_entropy_regularizer=attention_entropy_regularizer)
+
+
+def transpose_for_scores(input_tensor, batch_size, num_attention_heads,
+                         seq_length, width):
+  """Reshapes a [B*S, N*H] tensor to [B, N, S, H]."""
+  output_tensor = tf.reshape(
+      input_tensor, [batch_size, seq_length, num_attention_heads, width])
+
+  output_tensor = tf.transpose(output_tensor, [0, 2, 1, 3])
+  return output_tensor
+
+
+def scaled_dot_product_attention(query_layer,
+                                 key_layer,
+                                 value_layer,
+                                 attention_mask=None,
+                                 attention_adder=None,
+                                 num_attention_heads=1,
+                                 size_per_head=512,
+                                 attention_probs_dropout_prob=0.0,
+                                 do_return_2d_tensor=False,
+                                 batch_size=None,
+                                 from_seq_length=None,
+                                 to_seq_length=None,
+                                 attention_entropy_regularizer=0.0):
+  """Attends from the projected queries to the projected keys and values.
+
+  Args:
+    query_layer: float Tensor of shape [batch_size * from_seq_length,
+      num_attention_heads * size_per_head].
+    key_layer: float Tensor of shape [batch_size * to_seq_length,
+      num_attention_heads * size_per_head].
+    value_layer: float Tensor of shape [batch_size * to_seq_length,
+      num_attention_heads * size_per_head].
+    attention_mask: (optional) int32 Tensor of shape [batch_size,
+      from_seq_length, to_seq_length]. The values should be 1 or 0.
+    attention_adder: (optional) float Tensor of shape [batch_size, 1,
+      from_seq_length, to_seq_length], see `create_attention_adder`. Used
+      instead of `attention_mask` if specified.
+    num_attention_heads: int. Number of attention heads.
+    size_per_head: int. Size of each attention head.
+    attention_probs_dropout_prob: (optional) float. Dropout probability of the
+      attention probabilities.
+    do_return_2d_tensor: bool. See `attention_layer`.
+    batch_size: Batch size of the 3D version of the queries and keys.
+    from_seq_length: Seq length of the 3D version of the queries.
+    to_seq_length: Seq length of the 3D version of the keys and values.
+    attention_entropy_regularizer: float. Weight of the loss maximizing the
+      entropy of the attention probabilities.
+
+  Returns:
+    float Tensor of shape [batch_size, from_seq_length,
+      num_attention_heads * size_per_head]. (If `do_return_2d_tensor` is
+      true, this will be of shape [batch_size * from_seq_length,
+      num_attention_heads * size_per_head]).
+  """
+  # The scale is applied to the [B*F, N*H] queries rather than to the
+  # [B, N, F, T] scores.
+  query_layer = tf.multiply(query_layer, 1.0 / math.sqrt(float(size_per_head)))
 
   # `query_layer` = [B, N, F, H]
   query_layer = transpose_for_scores(query_layer, batch_size,
@@ -725,31 +1099,22 @@ def attention_layer(from_tensor,
   # attention scores.
   # `attention_scores` = [B, N, F, T]
   attention_scores = tf.matmul(query_layer, key_layer, transpose_b=True)
-  attention_scores = tf.multiply(attention_scores,
-                                 1.0 / math.sqrt(float(size_per_head)))
-
-  if attention_mask is not None:
-    # `attention_mask` = [B, 1, F, T]
-    attention_mask = tf.expand_dims(attention_mask, axis=[1])
 
-    # Since attention_mask is 1.0 for positions we want to attend and 0.0 for
-    # masked positions, this operation will create a tensor which is 0.0 for
-    # positions we want to attend and -10000.0 for masked positions.
-    adder = (1.0 - tf.cast(attention_mask, tf.float32)) * -10000.0
+  if attention_adder is None and attention_mask is not None:
+    attention_adder = create_attention_adder(attention_mask)
 
+  if attention_adder is not None:
     # Since we are adding it to the raw scores before the softmax, this is
     # effectively the same as removing these entirely.
-    attention_scores += adder
+    attention_scores += attention_adder
 
   # Normalize the attention scores to probabilities.
   # `attention_probs` = [B, N, F, T]
-  attention_probs = tf.nn.softmax(attention_scores)
-
-  # tf.summary.histogram('bert_attn/scores', attention_scores)
-  # tf.summary.histogram('bert_attn/probs', attention_probs)
-
   if attention_entropy_regularizer > 0.0:
+    # The log-probabilities are shared by the probabilities and the entropy.
     attention_log_probs = tf.nn.log_softmax(attention_scores)
+    attention_probs = tf.exp(attention_log_probs)
+
     per_attention_entropy_losses = - \
         tf.reduce_sum(attention_probs * attention_log_probs, axis=-1)
     per_attention_entropy_loss = tf.reduce_mean(per_attention_entropy_losses)
@@ -757,6 +1122,8 @@ def attention_layer(from_tensor,
     loss = attention_entropy_regularizer * per_attention_entropy_loss
     tf.compat.v1.summary.scalar('metrics/attention_regularization_loss', loss)
     tf.losses.add_loss(-loss)  # Maximize the entropy.
+  else:
+    attention_probs = tf.nn.softmax(attention_scores)
 
   # This is actually dropping out entire tokens to attend to, which might
   # seem a bit unusual, but is taken from the original Transformer paper.
@@ -862,6 +1229,11 @@ def transformer_model(input_tensor,
   # help the optimizer.
   prev_output = reshape_to_matrix(input_tensor)
 
+  # The adder of the attention scores is shared by all the layers.
+  attention_adder = None
+  if attention_mask is not None:
+    attention_adder = create_attention_adder(attention_mask)
+
   all_layer_outputs = []
   for layer_idx in range(num_hidden_layers):
     with tf.variable_scope("layer_%d" % layer_idx):
@@ -873,7 +1245,7 @@ def transformer_model(input_tensor,
           attention_head = attention_layer(
               from_tensor=layer_input,
               to_tensor=layer_input,
-              attention_mask=attention_mask,
+              attention_adder=attention_adder,
               num_attention_heads=num_attention_heads,
               size_per_head=attention_head_size,
               attention_probs_dropout_prob=attention_probs_dropout_prob,
@@ -933,6 +1305,217 @@ def transformer_model(input_tensor,
     return final_output
 
 
+def prefix_cached_transformer_model(prefix_tensor,
+                                    input_tensor,
+                                    prefix_mask=None,
+                                    input_mask=None,
+                                    hidden_size=768,
+                                    num_hidden_layers=12,
+                                    num_attention_heads=12,
+                                    intermediate_size=3072,
+                                    intermediate_act_fn=gelu,
+                                    hidden_dropout_prob=0.1,
+                                    attention_probs_dropout_prob=0.1,
+                                    initializer_range=0.02,
+                                    attention_entropy_regularizer=0.0,
+                                    do_return_all_layers=False):
+  """Transformer encoding a prefix shared by several sequences once.
+
+  The i-th prefix is shared by the sequences [i * num_sequences, (i + 1) *
+  num_sequences) of `input_tensor`. The prefix tokens attend to the prefix and
+  the sequence tokens attend to both the prefix and the sequence. This is
+  `transformer_model` applied to the concatenation of each sequence and its
+  prefix, with the prefix tokens not attending to the sequence tokens; the
+  variables are the same. Yet the prefix hidden states do not depend on the
+  sequence: they are computed once per prefix and the sequences reuse their
+  keys and values at every layer.
+
+  Args:
+    prefix_tensor: float Tensor of shape [batch_size, prefix_length,
+      hidden_size].
+    input_tensor: float Tensor of shape [batch_size * num_sequences,
+      seq_length, hidden_size].
+    prefix_mask: (optional) int32 Tensor of shape [batch_size, prefix_length],
+      with 1 for the prefix tokens that can be attended to and 0 for the
+      others.
+    input_mask: (optional) int32 Tensor of shape [batch_size * num_sequences,
+      seq_length], with 1 for the tokens that can be attended to and 0 for the
+      others.
+    hidden_size: int. Hidden size of the Transformer.
+    num_hidden_layers: int. Number of layers (blocks) in the Transformer.
+    num_attention_heads: int. Number of attention heads in the Transformer.
+    intermediate_size: int. The size of the "intermediate" (a.k.a., feed
+      forward) layer.
+    intermediate_act_fn: function. The non-linear activation function to apply
+      to the output of the intermediate/feed-forward layer.
+    hidden_dropout_prob: float. Dropout probability for the hidden layers.
+    attention_probs_dropout_prob: float. Dropout probability of the attention
+      probabilities.
+    initializer_range: float. Range of the initializer (stddev of truncated
+      normal).
+    attention_entropy_regularizer: float. Weight of the loss maximizing the
+      entropy of the attention probabilities.
+    do_return_all_layers: Whether to also return all layers or just the final
+      layer.
+
+  Returns:
+    A (prefix_output, sequence_output) tuple of float Tensors of shape
+    [batch_size, prefix_length, hidden_size] and [batch_size * num_sequences,
+    seq_length, hidden_size], the final hidden layer of the Transformer. If
+    `do_return_all_layers`, a tuple of lists of the hidden layers.
+
+  Raises:
+    ValueError: A Tensor shape or parameter is invalid.
+  """
+  if hidden_size % num_attention_heads != 0:
+    raise ValueError(
+        "The hidden size (%d) is not a multiple of the number of attention "
+        "heads (%d)" % (hidden_size, num_attention_heads))
+
+  attention_head_size = int(hidden_size / num_attention_heads)
+  prefix_shape = get_shape_list(prefix_tensor, expected_rank=3)
+  batch_size = prefix_shape[0]
+  prefix_length = prefix_shape[1]
+
+  input_shape = get_shape_list(input_tensor, expected_rank=3)
+  input_batch_size = input_shape[0]
+  seq_length = input_shape[1]
+  num_sequences = input_batch_size // batch_size
+
+  for width in [prefix_shape[2], input_shape[2]]:
+    if width != hidden_size:
+      raise ValueError(
+          "The width of the input tensor (%d) != hidden size (%d)" %
+          (width, hidden_size))
+
+  if prefix_mask is None:
+    prefix_mask = tf.ones(shape=[batch_size, prefix_length], dtype=tf.int32)
+  if input_mask is None:
+    input_mask = tf.ones(shape=[input_batch_size, seq_length], dtype=tf.int32)
+
+  def _concat_with_prefix(prefix_rows, input_rows):
+    """Prepends the prefix rows to the sequence rows, returns [B*C, P+S, W]."""
+    prefix_rows = tf.reshape(prefix_rows, prefix_shape[:2] + [-1])
+    prefix_rows = tf.tile(tf.expand_dims(prefix_rows, 1),
+                          [1, num_sequences, 1, 1])
+    prefix_rows = tf.reshape(prefix_rows, [input_batch_size, prefix_length, -1])
+    input_rows = tf.reshape(input_rows, input_shape[:2] + [-1])
+    return tf.concat([prefix_rows, input_rows], 1)
+
+  # `prefix_attention_adder` = [B, 1, P, P].
+  prefix_attention_adder = create_attention_adder(
+      create_attention_mask_from_input_mask(prefix_tensor, prefix_mask))
+
+  # `input_attention_adder` = [B*C, 1, S, P+S].
+  to_mask = _concat_with_prefix(tf.cast(prefix_mask, tf.int32),
+                                tf.cast(input_mask, tf.int32))
+  input_attention_adder = create_attention_adder(
+      create_attention_mask_from_input_mask(input_tensor,
+                                            tf.squeeze(to_mask, -1)))
+
+  # The prefix rows are followed by the sequence rows, so that every dense layer
+  # is applied once to both of them.
+  num_prefix_rows = batch_size * prefix_length
+  num_input_rows = input_batch_size * seq_length
+  prev_output = tf.concat(
+      [reshape_to_matrix(prefix_tensor),
+       reshape_to_matrix(input_tensor)], 0)
+
+  all_layer_outputs = []
+  for layer_idx in range(num_hidden_layers):
+    with tf.variable_scope("layer_%d" % layer_idx):
+      layer_input = prev_output
+
+      with tf.variable_scope("attention"):
+        with tf.variable_scope("self"):
+          prefix_layers, input_layers = {}, {}
+          for name, layer in zip(["query", "key", "value"],
+                                 fused_qkv_projection(
+                                     layer_input,
+                                     hidden_size,
+                                     initializer_range=initializer_range)):
+            prefix_layers[name], input_layers[name] = tf.split(
+                layer, [num_prefix_rows, num_input_rows])
+
+          prefix_attention_head = scaled_dot_product_attention(
+              prefix_layers["query"],
+              prefix_layers["key"],
+              prefix_layers["value"],
+              attention_adder=prefix_attention_adder,
+              num_attention_heads=num_attention_heads,
+              size_per_head=attention_head_size,
+              attention_probs_dropout_prob=attention_probs_dropout_prob,
+              do_return_2d_tensor=True,
+              batch_size=batch_size,
+              from_seq_length=prefix_length,
+              to_seq_length=prefix_length,
+              attention_entropy_regularizer=attention_entropy_regularizer)
+
+          # The sequences attend to the keys and values of their prefix.
+          key_layer = _concat_with_prefix(prefix_layers["key"],
+                                          input_layers["key"])
+          value_layer = _concat_with_prefix(prefix_layers["value"],
+                                            input_layers["value"])
+          input_attention_head = scaled_dot_product_attention(
+              input_layers["query"],
+              reshape_to_matrix(key_layer),
+              reshape_to_matrix(value_layer),
+              attention_adder=input_attention_adder,
+              num_attention_heads=num_attention_heads,
+              size_per_head=attention_head_size,
+              attention_probs_dropout_prob=attention_probs_dropout_prob,
+              do_return_2d_tensor=True,
+              batch_size=input_batch_size,
+              from_seq_length=seq_length,
+              to_seq_length=prefix_length + seq_length,
+              attention_entropy_regularizer=attention_entropy_regularizer)
+
+          attention_output = tf.concat(
+              [prefix_attention_head, input_attention_head], 0)
+
+        # Run a linear projection of `hidden_size` then add a residual
+        # with `layer_input`.
+        with tf.variable_scope("output"):
+          attention_output = tf.layers.dense(
+              attention_output,
+              hidden_size,
+              kernel_initializer=create_initializer(initializer_range))
+          attention_output = dropout(attention_output, hidden_dropout_prob)
+          attention_output = layer_norm(attention_output + layer_input)
+
+      # The activation is only applied to the "intermediate" hidden layer.
+      with tf.variable_scope("intermediate"):
+        intermediate_output = tf.layers.dense(
+            attention_output,
+            intermediate_size,
+            activation=intermediate_act_fn,
+            kernel_initializer=create_initializer(initializer_range))
+
+      # Down-project back to `hidden_size` then add the residual.
+      with tf.variable_scope("output"):
+        layer_output = tf.layers.dense(
+            intermediate_output,
+            hidden_size,
+            kernel_initializer=create_initializer(initializer_range))
+        layer_output = dropout(layer_output, hidden_dropout_prob)
+        layer_output = layer_norm(layer_output + attention_output)
+        prev_output = layer_output
+        all_layer_outputs.append(layer_output)
+
+  def _split_output(layer_output):
+    prefix_output, input_output = tf.split(layer_output,
+                                           [num_prefix_rows, num_input_rows])
+    return (reshape_from_matrix(prefix_output, prefix_shape),
+            reshape_from_matrix(input_output, input_shape))
+
+  if do_return_all_layers:
+    final_outputs = [_split_output(x) for x in all_layer_outputs]
+    return ([prefix_output for prefix_output, _ in final_outputs],
+            [input_output for _, input_output in final_outputs])
+  else:
+    return _split_output(prev_output)
+
+
 def get_shape_list(tensor, expected_rank=None, name=None):
   """Returns a list of the shape of tensor, preferring static dimensions.
 
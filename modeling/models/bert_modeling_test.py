@@ -0,0 +1,145 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+from modeling.models import bert_modeling
+
+
+def _tile_prefix(prefix_tensor, num_sequences):
+  shape = prefix_tensor.shape.as_list()
+  prefix_tensor = tf.tile(tf.expand_dims(prefix_tensor, 1),
+                          [1, num_sequences] + [1] * (len(shape) - 1))
+  return tf.reshape(prefix_tensor, [shape[0] * num_sequences] + shape[1:])
+
+
+class AttentionLayerTest(tf.test.TestCase):
+
+  def test_fused_self_attention(self):
+    from_tensor = tf.random.normal([6, 8])
+    attention_mask = tf.constant([
+        [[1, 1, 0], [1, 1, 0], [1, 1, 0]],
+        [[1, 1, 1], [1, 1, 1], [1, 1, 1]],
+    ])
+    with tf.compat.v1.variable_scope('self'):
+      output = bert_modeling.attention_layer(from_tensor,
+                                             from_tensor,
+                                             attention_mask,
+                                             num_attention_heads=2,
+                                             size_per_head=4,
+                                             do_return_2d_tensor=True,
+                                             batch_size=2,
+                                             from_seq_length=3,
+                                             to_seq_length=3)
+
+    # The variables of the separate projections, for checkpoint compatibility.
+    variables = {x.op.name: x for x in tf.compat.v1.global_variables()}
+    self.assertCountEqual(variables, [
+        'self/%s/%s' % (name, suffix)
+        for name in ['query', 'key', 'value']
+        for suffix in ['kernel', 'bias']
+    ])
+
+    with self.test_session() as sess:
+      sess.run(tf.compat.v1.global_variables_initializer())
+      from_value, mask_value, output, variables = sess.run(
+          [from_tensor, attention_mask, output, variables])
+
+    def _project(name):
+      output = np.matmul(from_value, variables['self/%s/kernel' % name])
+      output += variables['self/%s/bias' % name]
+      return output.reshape([2, 3, 2, 4]).transpose([0, 2, 1, 3])
+
+    scores = np.matmul(_project('query'),
+                       _project('key').transpose([0, 1, 3, 2])) / 2.0
+    scores += (1.0 - mask_value[:, np.newaxis]) * -10000.0
+    probs = np.exp(scores - scores.max(-1, keepdims=True))
+    probs /= probs.sum(-1, keepdims=True)
+    expected_output = np.matmul(probs, _project('value'))
+    self.assertAllClose(output,
+                        expected_output.transpose([0, 2, 1, 3]).reshape([6, 8]),
+                        atol=1e-5)
+
+
+class PrefixCachedBertModelTest(tf.test.TestCase):
+
+  def test_prefix_cached_transformer_model(self):
+    prefix_tensor = tf.random.normal([2, 4, 8])
+    input_tensor = tf.random.normal([6, 5, 8])
+    prefix_mask = tf.constant([[1, 1, 1, 0], [1, 1, 0, 0]], tf.float32)
+    input_mask = tf.sequence_mask([5, 4, 3, 2, 5, 1], 5, dtype=tf.float32)
+    kwargs = {
+        'hidden_size': 8,
+        'num_hidden_layers': 2,
+        'num_attention_heads': 2,
+        'intermediate_size': 16,
+        'hidden_dropout_prob': 0.0,
+        'attention_probs_dropout_prob': 0.0,
+    }
+    with tf.compat.v1.variable_scope('encoder'):
+      prefix_output, sequence_output = (
+          bert_modeling.prefix_cached_transformer_model(prefix_tensor,
+                                                        input_tensor,
+                                                        prefix_mask,
+                                                        input_mask, **kwargs))
+    num_variables = len(tf.compat.v1.global_variables())
+
+    # The same Transformer on the concatenated prefix and sequence, the prefix
+    # tokens not attending to the sequence tokens.
+    tiled_prefix_mask = _tile_prefix(prefix_mask, 3)
+    to_mask = tf.concat([tiled_prefix_mask, input_mask], 1)
+    attention_mask = tf.concat([
+        tf.concat([
+            tf.tile(tf.expand_dims(tiled_prefix_mask, 1), [1, 4, 1]),
+            tf.zeros([6, 4, 5])
+        ], 2),
+        tf.tile(tf.expand_dims(to_mask, 1), [1, 5, 1])
+    ], 1)
+    with tf.compat.v1.variable_scope('encoder', reuse=True):
+      output = bert_modeling.transformer_model(
+          tf.concat([_tile_prefix(prefix_tensor, 3), input_tensor], 1),
+          attention_mask, **kwargs)
+    self.assertEqual(len(tf.compat.v1.global_variables()), num_variables)
+
+    with self.test_session() as sess:
+      sess.run(tf.compat.v1.global_variables_initializer())
+      prefix_output, sequence_output, output = sess.run(
+          [prefix_output, sequence_output, output])
+    self.assertAllClose(np.repeat(prefix_output, 3, axis=0),
+                        output[:, :4],
+                        atol=1e-5)
+    self.assertAllClose(sequence_output, output[:, 4:], atol=1e-5)
+
+  def test_prefix_cached_bert_model_variables(self):
+    config = bert_modeling.BertConfig(vocab_size=30,
+                                      hidden_size=8,
+                                      num_hidden_layers=2,
+                                      num_attention_heads=2,
+                                      intermediate_size=16,
+                                      max_position_embeddings=32)
+    with tf.Graph().as_default():
+      bert_modeling.BertModel(config,
+                              is_training=False,
+                              input_ids=tf.zeros([6, 10], tf.int32))
+      expected_variables = [(x.op.name, x.shape.as_list())
+                            for x in tf.compat.v1.global_variables()]
+
+    with tf.Graph().as_default():
+      model = bert_modeling.PrefixCachedBertModel(
+          config,
+          is_training=False,
+          prefix_ids=tf.zeros([2, 4], tf.int32),
+          input_ids=tf.zeros([6, 5], tf.int32),
+          token_tag_features=tf.zeros([6, 5, 8]))
+      self.assertCountEqual([(x.op.name, x.shape.as_list())
+                             for x in tf.compat.v1.global_variables()],
+                            expected_variables)
+      self.assertAllEqual(model.get_prefix_output().shape, [2, 4, 8])
+      self.assertAllEqual(model.get_sequence_output().shape, [6, 5, 8])
+      self.assertAllEqual(model.get_pooled_output().shape, [6, 8])
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -117,6 +117,7 @@ def main(_):
     tf.config.experimental.set_memory_growth(gpu, True)
 
   pipeline_proto = _load_pipeline_proto(FLAGS.pipeline_proto)
+  trainer.check_prefix_cache(pipeline_proto, FLAGS.model_dir)
   vocab = _load_vocab_file(FLAGS.vocab_file)
 
   # Get `next_examples_ts' tensor.
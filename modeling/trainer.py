@@ -4,14 +4,19 @@ from __future__ import print_function
 
 from absl import logging
 
+import os
 import tensorflow as tf
+from google.protobuf import text_format
 
 from modeling.utils import optimization
 from modeling.utils import learning_rate_schedule
+from modeling.utils import sequence_ops
 from best_checkpoint_copier import BestCheckpointCopier
 
 from models import builder
 from readers import reader
+from readers import text_utils
+from readers.vcr_fields import InputFields
 from protos import pipeline_pb2
 
 
@@ -27,6 +32,148 @@ def _summarize_variables(var_list):
       tf.summary.scalar('summarize_vars/' + var.op.name, var_norm)
 
 
+def _summarize_padding_efficiency(features):
+  """Summarizes the ratio of the real tokens to the padded tokens.
+
+  Args:
+    features: A dict mapping from names to tensors, denoting the features.
+  """
+  sequences = [(name, features[name], features[length_name])
+               for name, length_name in [
+                   (InputFields.mixed_answer_choices,
+                    InputFields.mixed_answer_choices_len),
+                   (InputFields.mixed_rationale_choices,
+                    InputFields.mixed_rationale_choices_len),
+               ]
+               if name in features]
+
+  # The sequences of vcr_reader_v2 are nested dictionaries.
+  sequences.extend((name, value['tokens'], value['length'])
+                   for name, value in sorted(features.items())
+                   if isinstance(value, dict) and 'tokens' in value)
+
+  for name, tokens, lengths in sequences:
+    num_tokens = tf.cast(tf.reduce_sum(lengths), tf.float32)
+    num_padded_tokens = tf.cast(tf.size(tokens), tf.float32)
+    tf.compat.v1.summary.scalar('padding_efficiency/' + name,
+                                num_tokens / tf.maximum(num_padded_tokens, 1.0))
+
+
+def _summarize_image_padding(features):
+  """Summarizes the fraction of the padded pixels in the image batch.
+
+  Args:
+    features: A dict mapping from names to tensors, denoting the features.
+  """
+  # The image fields of vcr_reader and vcr_reader_v2.
+  for image_name, height_name, width_name in [
+      (InputFields.img_data, InputFields.img_height, InputFields.img_width),
+      ('img_data', 'img_height', 'img_width'),
+  ]:
+    if image_name in features:
+      num_pixels = tf.reduce_sum(
+          tf.cast(features[height_name] * features[width_name], tf.float32))
+      batch_shape = tf.shape(features[image_name])
+      num_padded_pixels = tf.cast(tf.reduce_prod(batch_shape[:3]), tf.float32)
+      tf.compat.v1.summary.scalar(
+          'padding_efficiency/padded_pixels_fraction',
+          1.0 - num_pixels / tf.maximum(num_padded_pixels, 1.0))
+
+
+def _summarize_truncation(features):
+  """Summarizes the truncation statistics of the static padding.
+
+  Args:
+    features: A dict mapping from names to tensors, denoting the features.
+
+  Returns:
+    A dict of the averaged statistics keyed by summary name, empty if the
+    reader does not use the static padding.
+  """
+  statistics = {}
+  for name in [
+      InputFields.num_truncated_tokens,
+      InputFields.num_truncated_detections,
+      InputFields.img_resized,
+  ]:
+    if name in features:
+      value = tf.reduce_mean(tf.cast(features[name], tf.float32))
+      tf.compat.v1.summary.scalar('static_padding/' + name, value)
+      statistics['static_padding/' + name] = value
+  return statistics
+
+
+def _maybe_enable_xla_jit(session_config, train_config):
+  """Turns on the XLA JIT compilation of the model graph if specified.
+
+  Args:
+    session_config: A tf.ConfigProto instance.
+    train_config: An instance of pipeline_pb2.TrainConfig.
+
+  Returns:
+    session_config: The same instance.
+  """
+  if train_config.use_xla_jit:
+    logging.info('Compile the model graph with the XLA JIT.')
+    session_config.graph_options.optimizer_options.global_jit_level = (
+        tf.compat.v1.OptimizerOptions.ON_1)
+  return session_config
+
+
+def _get_compact_inputs_sep_id(reader_proto):
+  """Gets the token id of `[SEP]` if the reader emits compact inputs.
+
+  Args:
+    reader_proto: An instance of reader_pb2.Reader.
+
+  Returns:
+    The token id, or None if the reader does not emit compact inputs.
+  """
+  options = getattr(reader_proto, reader_proto.WhichOneof('reader_oneof'))
+  if not getattr(options, 'compact_inputs', False):
+    return None
+  vocab = text_utils.Vocab(options.vocab_file,
+                           options.out_of_vocabulary_token_id)
+  return vocab.convert_tokens_to_ids(['[SEP]'])[0]
+
+
+def _uses_prefix_cache(model_proto):
+  """Returns true if the model encodes the shared prefix once per example."""
+  return any(
+      getattr(options, 'cache_shared_prefix', False)
+      for _, options in model_proto.ListFields())
+
+
+def check_prefix_cache(pipeline_proto, model_dir):
+  """Checks that `cache_shared_prefix` matches the trained model.
+
+  The prefix cache changes the attention of the model, so a checkpoint
+  trained without it does not give the same predictions. The training
+  pipeline is read from `model_dir`/pipeline.pbtxt, see trainer_main.py.
+
+  Args:
+    pipeline_proto: An instance of pipeline_pb2.Pipeline.
+    model_dir: Path to the directory saving checkpoint files.
+
+  Raises:
+    ValueError: If the model caches the prefix but the checkpoint was not
+      trained with the prefix cache.
+  """
+  if not _uses_prefix_cache(pipeline_proto.model):
+    return
+
+  filename = os.path.join(model_dir, 'pipeline.pbtxt')
+  if not tf.io.gfile.exists(filename):
+    raise ValueError('The model sets cache_shared_prefix, but the training '
+                     'pipeline %s is missing.' % filename)
+  with tf.io.gfile.GFile(filename, 'r') as fp:
+    train_pipeline_proto = text_format.Merge(fp.read(),
+                                             pipeline_pb2.Pipeline())
+  if not _uses_prefix_cache(train_pipeline_proto.model):
+    raise ValueError('The model sets cache_shared_prefix, but the checkpoint '
+                     'in %s was trained without it.' % model_dir)
+
+
 def _create_model_fn(pipeline_proto, is_chief=True):
   """Creates a callable that build the model.
 
@@ -56,6 +203,16 @@ def _create_model_fn(pipeline_proto, is_chief=True):
 
     model = builder.build(pipeline_proto.model, is_training)
 
+    # Assemble the tiled and mixed text fields of the compact inputs on device.
+    reader_proto = (pipeline_proto.train_reader
+                    if is_training else pipeline_proto.eval_reader)
+    sep_id = _get_compact_inputs_sep_id(reader_proto)
+    if sep_id is not None:
+      features = sequence_ops.expand_compact_inputs(features, sep_id)
+    _summarize_padding_efficiency(features)
+    _summarize_image_padding(features)
+    truncation_statistics = _summarize_truncation(features)
+
     # Predict resutls.
     predictions = model.predict(features)
 
@@ -148,13 +305,19 @@ def _create_model_fn(pipeline_proto, is_chief=True):
     summary_saver_hook = tf.estimator.SummarySaverHook(
         summary_op=tf.compat.v1.summary.merge_all(),
         save_steps=pipeline_proto.train_config.save_summary_steps)
+    training_hooks = [summary_saver_hook]
+    if truncation_statistics:
+      training_hooks.append(
+          tf.estimator.LoggingTensorHook(
+              truncation_statistics,
+              every_n_iter=pipeline_proto.train_config.log_step_count_steps))
 
     return tf.estimator.EstimatorSpec(mode=mode,
                                       predictions=predictions,
                                       loss=total_loss,
                                       train_op=train_op,
                                       eval_metric_ops=eval_metric_ops,
-                                      training_hooks=[summary_saver_hook],
+                                      training_hooks=training_hooks,
                                       scaffold=scaffold)
 
   return _model_fn
@@ -172,8 +335,10 @@ def train_and_evaluate(pipeline_proto, model_dir, use_mirrored_strategy=False):
 
   # Create train_spec.
   train_config = pipeline_proto.train_config
+  input_fields = builder.get_required_input_fields(pipeline_proto.model)
   train_input_fn = reader.get_input_fn(pipeline_proto.train_reader,
-                                       is_training=True)
+                                       is_training=True,
+                                       input_fields=input_fields)
   train_spec = tf.estimator.TrainSpec(input_fn=train_input_fn,
                                       max_steps=train_config.max_steps)
 
@@ -185,7 +350,8 @@ def train_and_evaluate(pipeline_proto, model_dir, use_mirrored_strategy=False):
 
   eval_config = pipeline_proto.eval_config
   eval_input_fn = reader.get_input_fn(pipeline_proto.eval_reader,
-                                      is_training=False)
+                                      is_training=False,
+                                      input_fields=input_fields)
   eval_spec = tf.estimator.EvalSpec(
       input_fn=eval_input_fn,
       steps=eval_config.steps,
@@ -199,10 +365,12 @@ def train_and_evaluate(pipeline_proto, model_dir, use_mirrored_strategy=False):
     strategy = tf.contrib.distribute.MirroredStrategy()
   run_config = tf.estimator.RunConfig(
       train_distribute=strategy,
-      session_config=tf.ConfigProto(allow_soft_placement=True,
-                                    gpu_options=tf.GPUOptions(
-                                        allow_growth=True,
-                                        per_process_gpu_memory_fraction=1.0)),
+      session_config=_maybe_enable_xla_jit(
+          tf.ConfigProto(allow_soft_placement=True,
+                         gpu_options=tf.GPUOptions(
+                             allow_growth=True,
+                             per_process_gpu_memory_fraction=1.0)),
+          train_config),
       save_summary_steps=train_config.save_summary_steps,
       save_checkpoints_steps=train_config.save_checkpoints_steps,
       keep_checkpoint_max=train_config.keep_checkpoint_max,
@@ -228,8 +396,10 @@ def train(pipeline_proto, model_dir, use_mirrored_strategy=False):
 
   # Create train_spec.
   train_config = pipeline_proto.train_config
+  input_fields = builder.get_required_input_fields(pipeline_proto.model)
   train_input_fn = reader.get_input_fn(pipeline_proto.train_reader,
-                                       is_training=True)
+                                       is_training=True,
+                                       input_fields=input_fields)
 
   # Create run_config.
   strategy = None
@@ -238,9 +408,10 @@ def train(pipeline_proto, model_dir, use_mirrored_strategy=False):
 
   run_config = tf.estimator.RunConfig(
       train_distribute=strategy,
-      session_config=tf.ConfigProto(
-          allow_soft_placement=True,
-          gpu_options=tf.GPUOptions(allow_growth=True)),
+      session_config=_maybe_enable_xla_jit(
+          tf.ConfigProto(allow_soft_placement=True,
+                         gpu_options=tf.GPUOptions(allow_growth=True)),
+          train_config),
       save_summary_steps=train_config.save_summary_steps,
       save_checkpoints_steps=train_config.save_checkpoints_steps,
       keep_checkpoint_max=train_config.keep_checkpoint_max,
@@ -271,9 +442,13 @@ def predict(pipeline_proto,
   """
   if not isinstance(pipeline_proto, pipeline_pb2.Pipeline):
     raise ValueError('pipeline_proto has to be an instance of Pipeline.')
+  if model_dir is not None:
+    check_prefix_cache(pipeline_proto, model_dir)
 
+  input_fields = builder.get_required_input_fields(pipeline_proto.model)
   predict_input_fn = reader.get_input_fn(pipeline_proto.eval_reader,
-                                         is_training=False)
+                                         is_training=False,
+                                         input_fields=input_fields)
 
   # Create estimator.
 
@@ -0,0 +1,37 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+
+def ground_detection_features(detection_features, tags):
+  """Grounds tag sequences using detection features.
+
+  Each tag is the index of the detection referred to by the token, the tokens
+  not referring to a detection (tag -1, or tag out of the detections) get
+  zero features. All the sequences are grounded with a single gather.
+
+  Args:
+    detection_features: A [batch, max_num_detections, feature_dims] float
+      tensor.
+    tags: A [batch, ..., max_seq_len] int tensor, e.g., [batch, NUM_CHOICES,
+      max_seq_len] for the choices.
+
+  Returns:
+    grounded_detection_features: A [batch, ..., max_seq_len, feature_dims]
+      float tensor.
+  """
+  tags = tf.cast(tags, tf.int32)
+  max_num_detections = tf.shape(detection_features)[1]
+
+  valid_tags = tf.logical_and(tf.greater_equal(tags, 0),
+                              tf.less(tags, max_num_detections))
+  tags = tf.where(valid_tags, tags, tf.zeros_like(tags))
+
+  grounded_detection_features = tf.gather(detection_features,
+                                          tags,
+                                          axis=1,
+                                          batch_dims=1)
+  return grounded_detection_features * tf.expand_dims(
+      tf.cast(valid_tags, grounded_detection_features.dtype), -1)
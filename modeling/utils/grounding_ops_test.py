@@ -0,0 +1,38 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+from modeling.utils import grounding_ops
+
+tf.compat.v1.enable_eager_execution()
+
+
+class GroundingOpsTest(tf.test.TestCase):
+
+  def test_ground_detection_features(self):
+    detection_features = tf.constant([
+        [[1, 1], [2, 2], [3, 3]],
+        [[4, 4], [5, 5], [6, 6]],
+    ], tf.float32)
+    tags = tf.constant([
+        [[0, -1, 2], [1, 1, -1]],
+        [[-1, -1, -1], [2, 0, 3]],
+    ])
+    self.assertAllClose(
+        grounding_ops.ground_detection_features(detection_features, tags), [
+            [[[1, 1], [0, 0], [3, 3]], [[2, 2], [2, 2], [0, 0]]],
+            [[[0, 0], [0, 0], [0, 0]], [[6, 6], [4, 4], [0, 0]]],
+        ])
+
+  def test_ground_detection_features_sequence(self):
+    detection_features = tf.constant([[[1, 2]], [[3, 4]]], tf.float32)
+    tags = tf.constant([[0, -1], [-1, 0]], tf.int64)
+    self.assertAllClose(
+        grounding_ops.ground_detection_features(detection_features, tags),
+        [[[1, 2], [0, 0]], [[0, 0], [3, 4]]])
+
+
+if __name__ == '__main__':
+  tf.test.main()
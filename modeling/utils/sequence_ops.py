@@ -0,0 +1,191 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+from readers.vcr_fields import InputFields
+from readers.vcr_fields import NUM_CHOICES
+from readers.vcr_fields import PAD_ID
+
+
+def concat_sequences(sequences, lengths, padding_value=0):
+  """Concatenates batches of padded sequences, dropping the inner padding.
+
+  Args:
+    sequences: A list of [batch, num_sequences, max_sequence_len_i] tensors.
+    lengths: A list of [batch, num_sequences] int tensors, the lengths of the
+      sequences.
+    padding_value: Value used to pad the concatenated sequences.
+
+  Returns:
+    concatenated: A [batch, num_sequences, max_concatenated_len] tensor.
+    concatenated_lengths: A [batch, num_sequences] int tensor.
+  """
+  if len(sequences) != len(lengths):
+    raise ValueError('The number of sequences and lengths do not match.')
+
+  # `offsets` are the positions of the sequences in the padded concatenation,
+  # and `starts` are the positions in the output.
+  max_lengths = [tf.shape(x)[-1] for x in sequences]
+  offsets = tf.math.cumsum(tf.stack(max_lengths), exclusive=True)
+  starts = tf.math.cumsum(tf.stack(lengths, -1), axis=-1, exclusive=True)
+  concatenated_lengths = tf.add_n(lengths)
+
+  max_concatenated_len = tf.reduce_max(concatenated_lengths)
+  positions = tf.range(max_concatenated_len)
+
+  # The sequence of each output position is the last one starting before it.
+  # `segment_ids` is [batch, num_sequences, max_concatenated_len].
+  segment_ids = tf.reduce_sum(
+      tf.cast(
+          tf.expand_dims(positions, -1) >= tf.expand_dims(starts[..., 1:], -2),
+          tf.int32), -1)
+  indices = (tf.gather(offsets, segment_ids) + positions -
+             tf.gather(starts, segment_ids, batch_dims=2))
+
+  # Positions beyond the concatenated lengths are padded below.
+  padded = tf.concat(sequences, -1)
+  indices = tf.clip_by_value(indices, 0, tf.shape(padded)[-1] - 1)
+  concatenated = tf.gather(padded, indices, batch_dims=2)
+  mask = tf.sequence_mask(concatenated_lengths, max_concatenated_len)
+  concatenated = tf.where(mask, concatenated,
+                          tf.fill(tf.shape(concatenated), padding_value))
+  return concatenated, concatenated_lengths
+
+
+def expand_compact_inputs(inputs, sep_id):
+  """Assembles the tiled and mixed text fields from the compact inputs.
+
+  In the compact mode, the reader emits the question once and no mixed
+  sequences. The ops of the fields that the model does not use are pruned from
+  the graph, hence only the used mixed sequences are computed. The rationale
+  fields and `answer_len` are assembled only if the reader emits the rationale
+  choices.
+
+  Args:
+    inputs: A dictionary of batched input tensors keyed by names, in which
+      `question`, `question_tag` and `question_len` are not tiled.
+    sep_id: Token id of `[SEP]`.
+
+  Returns:
+    A new dictionary with the fields of the regular mode.
+  """
+  inputs = dict(inputs)
+
+  def _tile(x):
+    multiples = [1, NUM_CHOICES] + [1] * (len(x.shape) - 1)
+    return tf.tile(tf.expand_dims(x, 1), multiples)
+
+  question = _tile(inputs[InputFields.question])
+  question_tag = _tile(inputs[InputFields.question_tag])
+  question_len = _tile(inputs[InputFields.question_len])
+
+  sep = tf.fill(tf.shape(question_len), sep_id)[..., tf.newaxis]
+  sep_tag = tf.fill(tf.shape(question_len), -1)[..., tf.newaxis]
+  sep_len = tf.ones_like(question_len)
+
+  (mixed_answer_choices, mixed_answer_choices_len) = concat_sequences(
+      [question, sep, inputs[InputFields.answer_choices]],
+      [question_len, sep_len, inputs[InputFields.answer_choices_len]], PAD_ID)
+  (mixed_answer_choices_tag, _) = concat_sequences(
+      [question_tag, sep_tag, inputs[InputFields.answer_choices_tag]],
+      [question_len, sep_len, inputs[InputFields.answer_choices_len]], -1)
+
+  inputs.update({
+      InputFields.question: question,
+      InputFields.question_tag: question_tag,
+      InputFields.question_len: question_len,
+      InputFields.mixed_answer_choices: mixed_answer_choices,
+      InputFields.mixed_answer_choices_tag: mixed_answer_choices_tag,
+      InputFields.mixed_answer_choices_len: mixed_answer_choices_len,
+  })
+
+  # The answer models do not decode the rationale choices, nor consume the
+  # groundtruth answer.
+  if InputFields.rationale_choices not in inputs:
+    return inputs
+
+  # The groundtruth answer is gathered from the answer choices.
+  answer_label = inputs[InputFields.answer_label]
+  answer = _tile(
+      tf.gather(inputs[InputFields.answer_choices], answer_label, batch_dims=1))
+  answer_tag = _tile(
+      tf.gather(inputs[InputFields.answer_choices_tag],
+                answer_label,
+                batch_dims=1))
+  answer_len = _tile(
+      tf.gather(inputs[InputFields.answer_choices_len],
+                answer_label,
+                batch_dims=1))
+
+  (mixed_rationale_choices, mixed_rationale_choices_len) = concat_sequences(
+      [question, sep, answer, sep, inputs[InputFields.rationale_choices]], [
+          question_len, sep_len, answer_len, sep_len,
+          inputs[InputFields.rationale_choices_len]
+      ], PAD_ID)
+  (mixed_rationale_choices_tag, _) = concat_sequences([
+      question_tag, sep_tag, answer_tag, sep_tag,
+      inputs[InputFields.rationale_choices_tag]
+  ], [
+      question_len, sep_len, answer_len, sep_len,
+      inputs[InputFields.rationale_choices_len]
+  ], -1)
+
+  inputs.update({
+      InputFields.answer_len: answer_len,
+      InputFields.mixed_rationale_choices: mixed_rationale_choices,
+      InputFields.mixed_rationale_choices_tag: mixed_rationale_choices_tag,
+      InputFields.mixed_rationale_choices_len: mixed_rationale_choices_len,
+  })
+  return inputs
+
+
+def _get_shape(tensor):
+  """Returns the static dimensions if known, the dynamic ones otherwise."""
+  dynamic_shape = tf.shape(tensor)
+  return [
+      dynamic_shape[i] if dim is None else dim
+      for i, dim in enumerate(tensor.shape.as_list())
+  ]
+
+
+def flatten_choices(tensor):
+  """Merges the choices into the batch, to score them in a single pass.
+
+  Args:
+    tensor: A [batch, NUM_CHOICES, ...] tensor.
+
+  Returns:
+    A [batch * NUM_CHOICES, ...] tensor, the choices of an example are adjacent.
+  """
+  shape = _get_shape(tensor)
+  return tf.reshape(tensor, [shape[0] * shape[1]] + shape[2:])
+
+
+def tile_choices(tensor):
+  """Repeats a per-example tensor for each choice, see `flatten_choices`.
+
+  Args:
+    tensor: A [batch, ...] tensor.
+
+  Returns:
+    A [batch * NUM_CHOICES, ...] tensor.
+  """
+  shape = _get_shape(tensor)
+  multiples = [1, NUM_CHOICES] + [1] * (len(shape) - 1)
+  tensor = tf.tile(tf.expand_dims(tensor, 1), multiples)
+  return tf.reshape(tensor, [shape[0] * NUM_CHOICES] + shape[1:])
+
+
+def unflatten_choices(tensor):
+  """Splits the choices out of the batch, the inverse of `flatten_choices`.
+
+  Args:
+    tensor: A [batch * NUM_CHOICES, ...] tensor.
+
+  Returns:
+    A [batch, NUM_CHOICES, ...] tensor.
+  """
+  shape = _get_shape(tensor)
+  return tf.reshape(tensor, [shape[0] // NUM_CHOICES, NUM_CHOICES] + shape[1:])
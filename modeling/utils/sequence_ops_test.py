@@ -0,0 +1,143 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tempfile
+import tensorflow as tf
+
+from modeling.utils import sequence_ops
+from protos import reader_pb2
+from readers import benchmark
+from readers import reader
+from readers.vcr_fields import IMAGE_FIELDS
+from readers.vcr_fields import InputFields
+
+tf.compat.v1.enable_eager_execution()
+
+
+class SequenceOpsTest(tf.test.TestCase):
+
+  def test_concat_sequences(self):
+    concatenated, lengths = sequence_ops.concat_sequences(
+        [
+            tf.constant([[[1, 2, 0], [3, 0, 0]], [[4, 5, 6], [0, 0, 0]]]),
+            tf.constant([[[7], [8]], [[9], [10]]]),
+            tf.constant([[[11, 12], [0, 0]], [[13, 0], [14, 15]]]),
+        ], [
+            tf.constant([[2, 1], [3, 0]]),
+            tf.constant([[1, 1], [1, 1]]),
+            tf.constant([[2, 0], [1, 2]]),
+        ],
+        padding_value=-1)
+    self.assertAllEqual(lengths, [[5, 2], [5, 3]])
+    self.assertAllEqual(concatenated, [[[1, 2, 7, 11, 12], [3, 8, -1, -1, -1]],
+                                       [[4, 5, 6, 9, 13], [10, 14, 15, -1, -1]]])
+
+  def test_expand_compact_inputs(self):
+    sep_id = 102
+    answer_choices = [[[21], [22, 23], [24], [25]]]
+    rationale_choices = [[[31], [32], [33, 34, 35], [36]]]
+
+    def _pad(choices):
+      max_len = max(len(x) for x in choices[0])
+      return tf.constant([[x + [0] * (max_len - len(x)) for x in choices[0]]])
+
+    def _len(choices):
+      return tf.constant([[len(x) for x in choices[0]]])
+
+    inputs = sequence_ops.expand_compact_inputs(
+        {
+            InputFields.question: tf.constant([[11, 12]]),
+            InputFields.question_tag: tf.constant([[-1, 1]]),
+            InputFields.question_len: tf.constant([2]),
+            InputFields.answer_label: tf.constant([1]),
+            InputFields.answer_choices: _pad(answer_choices),
+            InputFields.answer_choices_tag: -tf.ones_like(_pad(answer_choices)),
+            InputFields.answer_choices_len: _len(answer_choices),
+            InputFields.rationale_choices: _pad(rationale_choices),
+            InputFields.rationale_choices_tag: -tf.ones_like(
+                _pad(rationale_choices)),
+            InputFields.rationale_choices_len: _len(rationale_choices),
+        }, sep_id)
+
+    self.assertAllEqual(inputs[InputFields.question_len], [[2, 2, 2, 2]])
+    self.assertAllEqual(inputs[InputFields.answer_len], [[2, 2, 2, 2]])
+    self.assertAllEqual(inputs[InputFields.mixed_answer_choices],
+                        [[[11, 12, 102, 21, 0], [11, 12, 102, 22, 23],
+                          [11, 12, 102, 24, 0], [11, 12, 102, 25, 0]]])
+    self.assertAllEqual(inputs[InputFields.mixed_answer_choices_tag][0, 0],
+                        [-1, 1, -1, -1, -1])
+    self.assertAllEqual(inputs[InputFields.mixed_rationale_choices_len],
+                        [[7, 7, 9, 7]])
+    self.assertAllEqual(inputs[InputFields.mixed_rationale_choices][0, 2],
+                        [11, 12, 102, 22, 23, 102, 33, 34, 35])
+
+
+  def test_expand_compact_inputs_without_rationale(self):
+    inputs = sequence_ops.expand_compact_inputs(
+        {
+            InputFields.question: tf.constant([[11]]),
+            InputFields.question_tag: tf.constant([[-1]]),
+            InputFields.question_len: tf.constant([1]),
+            InputFields.answer_label: tf.constant([0]),
+            InputFields.answer_choices: tf.constant([[[21], [22], [23], [24]]]),
+            InputFields.answer_choices_tag: -tf.ones([1, 4, 1], tf.int32),
+            InputFields.answer_choices_len: tf.constant([[1, 1, 1, 1]]),
+        }, 102)
+
+    self.assertNotIn(InputFields.mixed_rationale_choices, inputs)
+    self.assertNotIn(InputFields.answer_len, inputs)
+    self.assertAllEqual(inputs[InputFields.mixed_answer_choices][0, 3],
+                        [11, 102, 24])
+
+  def test_expand_compact_inputs_of_answer_model(self):
+    # The fields of VBertFtFrcnn in the answer mode, without the rationale.
+    input_fields = [
+        InputFields.num_detections,
+        InputFields.detection_boxes,
+        InputFields.detection_classes,
+        InputFields.detection_scores,
+        InputFields.answer_label,
+        InputFields.mixed_answer_choices,
+        InputFields.mixed_answer_choices_tag,
+        InputFields.mixed_answer_choices_len,
+    ]
+
+    for reader_oneof, detection_fields in [
+        ('vcr_reader', list(IMAGE_FIELDS)),
+        ('vcr_text_frcnn_reader', [InputFields.detection_features]),
+    ]:
+      reader_proto = reader_pb2.Reader()
+      options = getattr(reader_proto, reader_oneof)
+      options.batch_size = 2
+      options.interleave_cycle_length = 1
+      options.compact_inputs = True
+      benchmark.create_synthetic_dataset(options, reader_oneof,
+                                         tempfile.mkdtemp(),
+                                         num_examples=4,
+                                         num_files=1)
+      dataset = reader.get_input_fn(reader_proto,
+                                    is_training=False,
+                                    input_fields=input_fields +
+                                    detection_fields)()
+      inputs = sequence_ops.expand_compact_inputs(next(iter(dataset)), 102)
+
+      self.assertNotIn(InputFields.rationale_choices, inputs)
+      self.assertNotIn(InputFields.mixed_rationale_choices, inputs)
+      self.assertAllEqual(inputs[InputFields.mixed_answer_choices_len].shape,
+                          [2, 4])
+
+  def test_flatten_choices(self):
+    choices = tf.reshape(tf.range(2 * 4 * 3), [2, 4, 3])
+    flattened = sequence_ops.flatten_choices(choices)
+    self.assertAllEqual(flattened.shape, [8, 3])
+    self.assertAllEqual(flattened[5], choices[1, 1])
+    self.assertAllEqual(sequence_ops.unflatten_choices(flattened), choices)
+
+  def test_tile_choices(self):
+    tiled = sequence_ops.tile_choices(tf.constant([[1, 2], [3, 4]]))
+    self.assertAllEqual(tiled, [[1, 2]] * 4 + [[3, 4]] * 4)
+
+
+if __name__ == '__main__':
+  tf.test.main()
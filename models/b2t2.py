@@ -10,6 +10,7 @@ import tensorflow as tf
 
 from protos import model_pb2
 from modeling.layers import token_to_id
+from modeling.utils import grounding_ops
 from modeling.utils import hyperparams
 from models.model_base import ModelBase
 
@@ -126,34 +127,6 @@ def _tile_objects(num_objects, object_ids, object_features):
   return object_masks, object_ids, object_features
 
 
-def _ground_tag_using_object_features(object_features, tags):
-  """Grounds tag sequence using object features.
-
-  Args:
-    object_features: A [batch, max_num_objects, feature_dims] float tensor.
-    tags: A [batch * NUM_CHOICES, max_seq_len] int tensor.
-  """
-  # Add ZEROs to the end.
-  batch_size, _, object_feature_dims = object_features.shape
-  object_features_padded = tf.concat(
-      [object_features,
-       tf.zeros([batch_size, 1, object_feature_dims])], 1)
-
-  # Tile object features.
-  object_features_padded_and_tiled = tf.reshape(
-      tf.gather(tf.expand_dims(object_features_padded, 1), [0] * NUM_CHOICES,
-                axis=1), [batch_size * NUM_CHOICES, -1, object_feature_dims])
-
-  # Gather tag embeddings.
-  feature_indices = tf.stack([
-      tf.tile(tf.expand_dims(tf.range(batch_size * NUM_CHOICES), axis=1),
-              [1, tf.shape(tags)[1]]), tags
-  ], -1)
-  grounded_object_features = tf.gather_nd(object_features_padded_and_tiled,
-                                          feature_indices)
-  return grounded_object_features
-
-
 class B2T2(ModelBase):
   """Wraps the BiLSTM layer to solve the VCR task."""
 
@@ -258,10 +231,11 @@ class B2T2(ModelBase):
                                      [batch_size * NUM_CHOICES, -1])
 
     # Create tag features sequence.
-    answer_choices_tag = tf.reshape(answer_choices_tag,
-                                    [batch_size * NUM_CHOICES, -1])
-    answer_choices_tag_embeddings = _ground_tag_using_object_features(
+    answer_choices_tag_embeddings = grounding_ops.ground_detection_features(
         object_features, answer_choices_tag)
+    answer_choices_tag_embeddings = tf.reshape(
+        answer_choices_tag_embeddings,
+        [batch_size * NUM_CHOICES, -1, object_features.shape[-1]])
 
     (tiled_object_masks, tiled_object_ids,
      tiled_object_features) = _tile_objects(num_objects,
@@ -40,3 +40,15 @@ def build(options, is_training):
       return MODELS[extension](model_proto, is_training)
 
   raise ValueError('Invalid model config!')
+
+
+def get_required_input_fields(options):
+  """Returns the input fields consumed by the model built from the options.
+
+  Args:
+    options: A model_pb2.Model instance.
+
+  Returns:
+    A list of input field names, or None if the model consumes all fields.
+  """
+  return build(options, is_training=False).get_required_input_fields()
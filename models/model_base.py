@@ -58,6 +58,17 @@ class ModelBase(abc.ABC):
     """
     pass
 
+  def get_required_input_fields(self):
+    """Returns the input fields consumed by the model.
+
+    The readers decode only these fields, e.g., the JPEG is not decoded for a
+    model that does not consume the image.
+
+    Returns:
+      A list of input field names, or None if the model consumes all fields.
+    """
+    return None
+
   def get_variables_to_train(self):
     """Returns model variables.
       
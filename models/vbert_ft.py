@@ -10,6 +10,7 @@ import tensorflow as tf
 
 from protos import model_pb2
 from modeling.models import fast_rcnn
+from modeling.utils import grounding_ops
 from modeling.utils import hyperparams
 from modeling.utils import visualization
 from modeling.utils import checkpoints
@@ -87,32 +88,6 @@ def preprocess_tags(tags, max_num_detections):
   return tf.where(tags >= max_num_detections, -ones, tags)
 
 
-def ground_detection_features(detection_features, tags):
-  """Grounds tag sequence using detection features.
-
-  Args:
-    detection_features: A [batch, max_num_detections, feature_dims] float tensor.
-    tags: A [batch, NUM_CHOICES, max_seq_len] int tensor.
-
-  Returns:
-    grounded_detection_features: A [batch, NUM_CHOICES, max_seq_len, 
-      feature_dims] float tensor.
-  """
-  # Add ZEROs to the end.
-  batch_size, _, dims = detection_features.shape
-  detection_features = tf.concat(
-      [detection_features, tf.zeros([batch_size, 1, dims])], 1)
-
-  tag_features = []
-  base_indices = tf.tile(tf.expand_dims(tf.range(batch_size), axis=1),
-                         [1, tf.shape(tags)[-1]])
-  for tag_tensor in tf.unstack(tags, axis=1):
-    indices = tf.stack([base_indices, tag_tensor], -1)
-    tag_features.append(tf.gather_nd(detection_features, indices))
-
-  return tf.stack(tag_features, axis=1)
-
-
 class VBertFt(ModelBase):
   """Finetune the VBert model to solve the VCR task."""
 
@@ -356,8 +331,8 @@ class VBertFt(ModelBase):
                         inputs[self._field_choices_len])
 
     choice_tag_ids = preprocess_tags(choice_tag_ids, max_num_detections)
-    choice_tag_features = ground_detection_features(detection_features,
-                                                    choice_tag_ids)
+    choice_tag_features = grounding_ops.ground_detection_features(
+        detection_features, choice_tag_ids)
 
     # Create BERT prediction.
     choice_ids_list = tf.unstack(choice_ids, axis=1)
@@ -487,6 +462,24 @@ class VBertFt(ModelBase):
       metric_dict.update({'metrics/detection_accuracy': accuracy_metric})
     return metric_dict
 
+  def get_required_input_fields(self):
+    """Returns the input fields consumed by the model.
+
+    Returns:
+      A list of InputFields names.
+    """
+    return [
+        InputFields.num_detections,
+        InputFields.detection_boxes,
+        InputFields.detection_classes,
+        InputFields.detection_scores,
+        InputFields.detection_features,
+        self._field_label,
+        self._field_choices,
+        self._field_choices_tag,
+        self._field_choices_len,
+    ]
+
   def get_variables_to_train(self):
     """Returns model variables.
       
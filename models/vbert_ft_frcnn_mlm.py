@@ -10,12 +10,15 @@ import tensorflow as tf
 
 from protos import model_pb2
 from modeling.models import fast_rcnn
+from modeling.utils import grounding_ops
 from modeling.utils import hyperparams
 from modeling.utils import visualization
 from modeling.utils import checkpoints
 from modeling.utils import masked_ops
+from modeling.utils import sequence_ops
 from models.model_base import ModelBase
 
+from readers.vcr_fields import IMAGE_FIELDS
 from readers.vcr_fields import InputFields
 from readers.vcr_fields import NUM_CHOICES
 
@@ -94,32 +97,6 @@ def preprocess_tags(tags, max_num_detections):
   return tf.where(tags >= max_num_detections, -ones, tags)
 
 
-def ground_detection_features(detection_features, tags):
-  """Grounds tag sequence using detection features.
-
-  Args:
-    detection_features: A [batch, max_num_detections, feature_dims] float tensor.
-    tags: A [batch, NUM_CHOICES, max_seq_len] int tensor.
-
-  Returns:
-    grounded_detection_features: A [batch, NUM_CHOICES, max_seq_len, 
-      feature_dims] float tensor.
-  """
-  # Add ZEROs to the end.
-  batch_size, _, dims = detection_features.shape
-  detection_features = tf.concat(
-      [detection_features, tf.zeros([batch_size, 1, dims])], 1)
-
-  tag_features = []
-  base_indices = tf.tile(tf.expand_dims(tf.range(batch_size), axis=1),
-                         [1, tf.shape(tags)[-1]])
-  for tag_tensor in tf.unstack(tags, axis=1):
-    indices = tf.stack([base_indices, tag_tensor], -1)
-    tag_features.append(tf.gather_nd(detection_features, indices))
-
-  return tf.stack(tag_features, axis=1)
-
-
 class VBertFtFrcnnMLM(ModelBase):
   """Finetune the VBert model to solve the VCR task."""
 
@@ -364,18 +341,14 @@ class VBertFtFrcnnMLM(ModelBase):
     is_training = self._is_training
     options = self._model_proto
 
-    # Decode image fields from `inputs`.
-    (image, image_height, image_width, num_detections, detection_boxes,
-     detection_classes, detection_scores) = (
-         inputs[InputFields.img_data],
-         inputs[InputFields.img_height],
-         inputs[InputFields.img_width],
-         inputs[InputFields.num_detections],
-         inputs[InputFields.detection_boxes],
-         inputs[InputFields.detection_classes],
-         inputs[InputFields.detection_scores],
+    # Decode detection fields from `inputs`.
+    (num_detections, detection_boxes, detection_classes, detection_scores) = (
+        inputs[InputFields.num_detections],
+        inputs[InputFields.detection_boxes],
+        inputs[InputFields.detection_classes],
+        inputs[InputFields.detection_scores],
     )
-    batch_size = image.shape[0]
+    batch_size = num_detections.shape[0]
     (max_num_detections, num_detections, detection_boxes, detection_classes,
      detection_scores) = remove_detections(
          num_detections,
@@ -384,16 +357,27 @@ class VBertFtFrcnnMLM(ModelBase):
          detection_scores,
          max_num_detections=options.max_num_detections)
 
-    # Extract Fast-RCNN features.
-    image_batch_shape = tf.shape(image)
-    detection_boxes = convert_to_batch_coordinates(detection_boxes,
-                                                   image_height, image_width,
-                                                   image_batch_shape[1],
-                                                   image_batch_shape[2])
-    detection_features, _ = fast_rcnn.FastRCNN(image,
-                                               detection_boxes,
-                                               options=options.fast_rcnn_config,
-                                               is_training=is_training)
+    if options.use_precomputed_detection_features:
+      # Read the Fast-RCNN features extracted offline.
+      detection_features = inputs[
+          InputFields.detection_features][:, :max_num_detections, :]
+    else:
+      # Extract Fast-RCNN features.
+      image, image_height, image_width = (
+          inputs[InputFields.img_data],
+          inputs[InputFields.img_height],
+          inputs[InputFields.img_width],
+      )
+      image_batch_shape = tf.shape(image)
+      detection_boxes = convert_to_batch_coordinates(detection_boxes,
+                                                     image_height, image_width,
+                                                     image_batch_shape[1],
+                                                     image_batch_shape[2])
+      detection_features, _ = fast_rcnn.FastRCNN(
+          image,
+          detection_boxes,
+          options=options.fast_rcnn_config,
+          is_training=is_training)
     predictions.update({'detection_features': detection_features})
     with slim.arg_scope(self._slim_fc_scope):
       detection_features = self.project_detection_features(detection_features)
@@ -405,8 +389,8 @@ class VBertFtFrcnnMLM(ModelBase):
                         inputs[self._field_choices_len])
 
     choice_tag_ids = preprocess_tags(choice_tag_ids, max_num_detections)
-    choice_tag_features = ground_detection_features(detection_features,
-                                                    choice_tag_ids)
+    choice_tag_features = grounding_ops.ground_detection_features(
+        detection_features, choice_tag_ids)
     choice_ids_raw = choice_ids
 
     # Create MLM predictions for masked tokens.
@@ -445,29 +429,25 @@ class VBertFtFrcnnMLM(ModelBase):
 
     # if options.apply_masks:
 
-    choice_ids_list = tf.unstack(choice_ids, axis=1)
-    choice_tag_ids_list = tf.unstack(choice_tag_ids, axis=1)
-    choice_tag_features_list = tf.unstack(choice_tag_features, axis=1)
-    choice_lengths_list = tf.unstack(choice_lengths, axis=1)
-
-    # Create ITM predictions for matching the ansewrs.
-    reuse = False
-    feature_to_predict_choices = []
-    feature_to_predict_masks = []
-    for caption_ids, caption_tag_ids, caption_tag_features, caption_length in zip(
-            choice_ids_list, choice_tag_ids_list, choice_tag_features_list,
-            choice_lengths_list):
-      with tf.variable_scope(tf.get_variable_scope(), reuse=reuse):
-        (bert_output,
-         bert_sequence_output, embedding_table) = self.image_text_matching(
-             num_detections, detection_boxes, detection_classes,
-             detection_scores, detection_features, caption_ids, caption_tag_ids,
-             caption_tag_features, caption_length, attention_entropy_regularizer=options.bert_attention_entropy_regularizer)
-        feature_to_predict_choices.append(bert_output)
-        feature_to_predict_masks.append(bert_sequence_output)
-      reuse = True
-    bert_outputs = tf.stack(feature_to_predict_choices, 1)
-    bert_sequence_outputs = tf.stack(feature_to_predict_masks, 1)
+    # Create ITM predictions for matching the ansewrs. The choices are merged
+    # into the batch and scored in a single pass. The entropy regularizer is
+    # averaged over the merged batch, so it is scaled by NUM_CHOICES to match
+    # the sum of the per-choice losses.
+    (bert_output,
+     bert_sequence_output, embedding_table) = self.image_text_matching(
+         sequence_ops.tile_choices(num_detections),
+         sequence_ops.tile_choices(detection_boxes),
+         sequence_ops.tile_choices(detection_classes),
+         sequence_ops.tile_choices(detection_scores),
+         sequence_ops.tile_choices(detection_features),
+         sequence_ops.flatten_choices(choice_ids),
+         sequence_ops.flatten_choices(choice_tag_ids),
+         sequence_ops.flatten_choices(choice_tag_features),
+         sequence_ops.flatten_choices(choice_lengths),
+         attention_entropy_regularizer=(
+             NUM_CHOICES * options.bert_attention_entropy_regularizer))
+    bert_outputs = sequence_ops.unflatten_choices(bert_output)
+    bert_sequence_outputs = sequence_ops.unflatten_choices(bert_sequence_output)
 
     with slim.arg_scope(self._slim_fc_scope):
       logits = slim.fully_connected(bert_outputs,
@@ -572,6 +552,31 @@ class VBertFtFrcnnMLM(ModelBase):
 
     return metric_dict
 
+  def get_required_input_fields(self):
+    """Returns the input fields consumed by the model.
+
+    Returns:
+      A list of InputFields names.
+    """
+    input_fields = [
+        InputFields.num_detections,
+        InputFields.detection_boxes,
+        InputFields.detection_classes,
+        InputFields.detection_scores,
+        self._field_label,
+        self._field_choices,
+        self._field_choices_tag,
+        self._field_choices_len,
+        InputFields.question_len,
+    ]
+    if self._model_proto.use_precomputed_detection_features:
+      input_fields.append(InputFields.detection_features)
+    else:
+      input_fields.extend(IMAGE_FIELDS)
+    if self._model_proto.rationale_model:
+      input_fields.append(InputFields.answer_len)
+    return input_fields
+
   def get_variables_to_train(self):
     """Returns model variables.
       
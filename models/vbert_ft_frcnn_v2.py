@@ -11,6 +11,7 @@ from collections import namedtuple
 
 from protos import model_pb2
 from modeling.models import fast_rcnn
+from modeling.utils import grounding_ops
 from modeling.utils import hyperparams
 from modeling.utils import visualization
 from modeling.utils import checkpoints
@@ -131,18 +132,8 @@ class MixedSequence(object):
     Returns:
       set `self.tag_features`.
     """
-    detection_features = detections.detection_features
-    batch_size, _, dims = detection_features.shape
-
-    detection_features_padded = tf.concat(
-        [detection_features,
-         tf.zeros([batch_size, 1, dims])], 1)
-
-    batch_indices = tf.expand_dims(tf.range(batch_size), axis=1)
-    batch_indices = tf.tile(batch_indices, [1, tf.shape(self.tags)[-1]])
-    indices = tf.stack([batch_indices, self.tags], -1)
-
-    self.tag_features = tf.gather_nd(detection_features_padded, indices)
+    self.tag_features = grounding_ops.ground_detection_features(
+        detections.detection_features, self.tags)
 
 
 class VBertFtFrcnnV2(ModelBase):
@@ -316,6 +307,124 @@ class VBertFtFrcnnV2(ModelBase):
                                          scope='bert')
     return bert_model.get_pooled_output()
 
+  def image_text_matching_with_prefix_cache(self, detections, question,
+                                            choices):
+    """Predicts the matching scores of all the choices.
+
+    The BERT input of `image_text_matching` is kept, the choices being padded
+    to the same length: [CLS] question [SEP] choice [SEP] detections [SEP].
+    The `question [SEP] detections [SEP]` prefix is encoded once per example
+    and does not attend to the choice, see `PrefixCachedBertModel`.
+
+    Args:
+      detections: A Detections object.
+      question: A MixedSequence object.
+      choices: A list of MixedSequence objects.
+
+    Returns:
+      bert_outputs: A [batch, num_choices, dims] float tensor.
+    """
+    batch_size = detections.num_detections.shape[0]
+    num_choices = len(choices)
+    num_sequences = batch_size * num_choices
+    dims = detections.detection_features.shape[-1]
+
+    max_question_len = tf.shape(question.tokens)[1]
+    max_choice_len = tf.reduce_max([tf.shape(x.tokens)[1] for x in choices])
+    max_detections = tf.shape(detections.detection_classes)[1]
+
+    # Create the prefix, `question [SEP] detections [SEP]`.
+    id_sep = tf.fill([batch_size, 1], SEP_ID)
+    prefix_ids = tf.concat(
+        [question.tokens, id_sep, detections.detection_classes, id_sep], -1)
+
+    mask_true = tf.fill([batch_size, 1], True)
+    prefix_masks = tf.concat([
+        question.sequence_masks, mask_true, detections.detection_masks,
+        mask_true
+    ], -1)
+
+    prefix_token_type_ids = tf.concat([
+        tf.fill([batch_size, 1 + max_question_len], 0),
+        tf.fill([batch_size, 1 + max_detections], 2),
+    ], -1)
+
+    zeros = tf.fill([batch_size, 1, dims], 0.0)
+    prefix_tag_features = tf.concat(
+        [question.tag_features, zeros, detections.detection_features, zeros],
+        1)
+
+    # The positions of the prefix skip the [CLS] token and the choice.
+    prefix_position_ids = tf.concat([
+        tf.range(1, 2 + max_question_len),
+        tf.range(3 + max_question_len + max_choice_len,
+                 4 + max_question_len + max_choice_len + max_detections)
+    ], 0)
+    prefix_position_ids = tf.tile(tf.expand_dims(prefix_position_ids, 0),
+                                  [batch_size, 1])
+
+    # Create the [batch * num_choices] sequences, `[CLS] choice [SEP]`.
+    choice_ids = tf.stack([
+        tf.pad(x.tokens, [[0, 0], [0, max_choice_len - tf.shape(x.tokens)[1]]])
+        for x in choices
+    ], 1)
+    choice_masks = tf.stack(
+        [tf.sequence_mask(x.length, maxlen=max_choice_len) for x in choices],
+        1)
+    choice_tag_features = tf.stack([
+        tf.pad(x.tag_features,
+               [[0, 0], [0, max_choice_len - tf.shape(x.tokens)[1]], [0, 0]])
+        for x in choices
+    ], 1)
+
+    id_cls = tf.fill([num_sequences, 1], CLS_ID)
+    id_sep = tf.fill([num_sequences, 1], SEP_ID)
+    input_ids = tf.concat([
+        id_cls,
+        tf.reshape(choice_ids, [num_sequences, max_choice_len]), id_sep
+    ], -1)
+
+    mask_true = tf.fill([num_sequences, 1], True)
+    input_masks = tf.concat([
+        mask_true,
+        tf.reshape(choice_masks, [num_sequences, max_choice_len]), mask_true
+    ], -1)
+
+    token_type_ids = tf.concat([
+        tf.fill([num_sequences, 1], 0),
+        tf.fill([num_sequences, 1 + max_choice_len], 1),
+    ], -1)
+
+    zeros = tf.fill([num_sequences, 1, dims], 0.0)
+    token_tag_features = tf.concat([
+        zeros,
+        tf.reshape(choice_tag_features, [num_sequences, max_choice_len, dims]),
+        zeros
+    ], 1)
+
+    position_ids = tf.concat(
+        [[0], tf.range(2 + max_question_len, 3 + max_question_len +
+                       max_choice_len)], 0)
+    position_ids = tf.tile(tf.expand_dims(position_ids, 0),
+                           [num_sequences, 1])
+
+    bert_model = bert_modeling.PrefixCachedBertModel(
+        self._bert_config,
+        self._is_training,
+        prefix_ids=prefix_ids,
+        input_ids=input_ids,
+        prefix_mask=prefix_masks,
+        input_mask=input_masks,
+        prefix_token_type_ids=prefix_token_type_ids,
+        token_type_ids=token_type_ids,
+        prefix_tag_features=prefix_tag_features,
+        token_tag_features=token_tag_features,
+        prefix_position_ids=prefix_position_ids,
+        position_ids=position_ids,
+        scope='bert')
+    return tf.reshape(bert_model.get_pooled_output(),
+                      [batch_size, num_choices, -1])
+
   def predict(self, inputs, **kwargs):
     """Predicts the resulting tensors.
 
@@ -372,18 +481,22 @@ class VBertFtFrcnnV2(ModelBase):
     detections.detection_features = frcnn_features
 
     # Create BERT VQA model.
-    reuse = False
-    bert_outputs = []
-    question.remove_tags(max_num_detections)
-    question.ground_detections(detections)
-    for choice in choices:
-      choice.remove_tags(max_num_detections)
-      choice.ground_detections(detections)
-      with tf.variable_scope(tf.get_variable_scope(), reuse=reuse):
-        bert_outputs.append(
-            self.image_text_matching(detections, question, choice))
-      reuse = True
-    bert_outputs = tf.stack(bert_outputs, 1)
+    for sequence in [question] + choices:
+      sequence.remove_tags(max_num_detections)
+      sequence.ground_detections(detections)
+
+    if options.cache_shared_prefix:
+      bert_outputs = self.image_text_matching_with_prefix_cache(
+          detections, question, choices)
+    else:
+      reuse = False
+      bert_outputs = []
+      for choice in choices:
+        with tf.variable_scope(tf.get_variable_scope(), reuse=reuse):
+          bert_outputs.append(
+              self.image_text_matching(detections, question, choice))
+        reuse = True
+      bert_outputs = tf.stack(bert_outputs, 1)
 
     # Predicting the answer.
     with slim.arg_scope(self._slim_fc_scope):
@@ -445,6 +558,17 @@ class VBertFtFrcnnV2(ModelBase):
     accuracy_metric.update_state(y_true, y_pred)
     return {'metrics/accuracy': accuracy_metric}
 
+  def get_required_input_fields(self):
+    """Returns the input fields consumed by the model.
+
+    Returns:
+      A list of the top-level fields of vcr_reader_v2.
+    """
+    return [
+        'img_data', 'img_height', 'img_width', 'detections', 'question',
+        self._field_label
+    ] + [self._field_choice + '_%i' % i for i in range(NUM_CHOICES)]
+
   def get_variables_to_train(self):
     """Returns model variables.
       
@@ -0,0 +1,161 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import re
+import json
+import tensorflow as tf
+
+from readers import feature_index
+
+
+def get_annot_shard_id(annot_id, num_shards):
+  """Gets the shard id of an annotation, e.g., `val-123`."""
+  return int(annot_id.split('-')[-1]) % num_shards
+
+
+_SHARD_FNS = {
+    'annot_id': get_annot_shard_id,
+    'img_fn': feature_index.get_image_shard_id,
+}
+
+
+def _get_string_field(line, field):
+  """Extracts a string field from a json line without decoding the line.
+
+  Args:
+    line: A json object in string format.
+    field: Name of the field.
+
+  Returns:
+    The field value. The line is decoded only if the value is not a plain
+    string, e.g., it contains escapes.
+  """
+  match = re.search(r'"%s":\s*"([^"\\]*)"' % field, line)
+  if match is None:
+    return json.loads(line)[field]
+  return match.group(1)
+
+
+def _get_shard_fn(shard_by):
+  """Returns the function mapping a raw json line to its shard id."""
+  if shard_by not in _SHARD_FNS:
+    raise ValueError('Invalid shard_by %s.' % shard_by)
+  shard_fn = _SHARD_FNS[shard_by]
+  return lambda line, num_shards: shard_fn(_get_string_field(line, shard_by),
+                                           num_shards)
+
+
+def _read_lines(filename):
+  """Streams the non-empty raw json lines of a jsonl file."""
+  with tf.io.gfile.GFile(filename, 'r') as f:
+    for line in f:
+      line = line.strip('\n')
+      if line:
+        yield line
+
+
+def _read_shard_lines(filename, num_shards, shard_id, shard_by):
+  """Streams the raw json lines of a shard.
+
+  Args:
+    filename: Path to the jsonl annotations file.
+    num_shards: Total number of shards.
+    shard_id: Shard id of the lines to yield.
+    shard_by: Either `annot_id` or `img_fn`, the field to shard on.
+
+  Yields:
+    A json object in string format.
+  """
+  if not 0 <= shard_id < num_shards:
+    raise ValueError('Invalid shard_id %i of %i shards.' %
+                     (shard_id, num_shards))
+  shard_fn = _get_shard_fn(shard_by)
+
+  for line in _read_lines(filename):
+    if num_shards > 1 and shard_fn(line, num_shards) != shard_id:
+      continue
+    yield line
+
+
+def split_annotations(filename, output_dir, num_shards, shard_by='annot_id'):
+  """Splits the annotations into one jsonl file per shard, in a single pass.
+
+  The lines are routed to their shard without being decoded, and keep their
+  order within a shard. The shard files can be read by `read_annotations`
+  with the default `num_shards`, so that each worker only reads its own
+  annotations.
+
+  Args:
+    filename: Path to the jsonl annotations file.
+    output_dir: Directory to write the shard files to.
+    num_shards: Total number of shards.
+    shard_by: Either `annot_id` or `img_fn`, the field to shard on.
+
+  Returns:
+    filenames: A list of the paths to the jsonl file of each shard.
+    num_annotations: A list of the number of annotations of each shard.
+  """
+  shard_fn = _get_shard_fn(shard_by)
+
+  basename = os.path.basename(filename)
+  filenames = [
+      os.path.join(output_dir, '%s-%05d-of-%05d' % (basename, i, num_shards))
+      for i in range(num_shards)
+  ]
+  num_annotations = [0] * num_shards
+
+  tf.io.gfile.makedirs(output_dir)
+  files = [tf.io.gfile.GFile(x, 'w') for x in filenames]
+  try:
+    for line in _read_lines(filename):
+      shard_id = shard_fn(line, num_shards) if num_shards > 1 else 0
+      files[shard_id].write(line + '\n')
+      num_annotations[shard_id] += 1
+  finally:
+    for f in files:
+      f.close()
+  return filenames, num_annotations
+
+
+def read_annotations(filename,
+                     num_shards=1,
+                     shard_id=0,
+                     shard_by='annot_id',
+                     annot_ids=None,
+                     skip_annot_ids=None,
+                     filter_fn=None):
+  """Streams the annotations of a shard from a jsonl file.
+
+  Sharding and the annotation ids are checked on the raw lines, so the skipped
+  lines are never json decoded, and only one annotation is held in memory at a
+  time.
+
+  Args:
+    filename: Path to the jsonl annotations file.
+    num_shards: Total number of shards.
+    shard_id: Shard id of the annotations to yield.
+    shard_by: Either `annot_id` or `img_fn`, the field to shard on. Sharding on
+      `img_fn` keeps all the annotations of an image in the same shard.
+    annot_ids: If not None, a container of the `annot_id` to keep.
+    skip_annot_ids: If not None, a container of the `annot_id` to skip, e.g.,
+      the ones committed by a previous run.
+    filter_fn: If not None, a callable taking the decoded annotation and
+      returning False for the ones to skip.
+
+  Yields:
+    A python dictionary parsed from a json object.
+  """
+  for line in _read_shard_lines(filename, num_shards, shard_id, shard_by):
+    if (annot_ids is not None and
+        _get_string_field(line, 'annot_id') not in annot_ids):
+      continue
+    if (skip_annot_ids is not None and
+        _get_string_field(line, 'annot_id') in skip_annot_ids):
+      continue
+
+    annot = json.loads(line)
+    if filter_fn is not None and not filter_fn(annot):
+      continue
+    yield annot
@@ -0,0 +1,89 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import json
+import tempfile
+import tensorflow as tf
+
+from readers import annotation_reader
+from readers import feature_index
+
+
+class AnnotationReaderTest(tf.test.TestCase):
+
+  def setUp(self):
+    self._filename = os.path.join(tempfile.mkdtemp(), 'annots.jsonl')
+    with open(self._filename, 'w') as f:
+      for i in range(10):
+        f.write(
+            json.dumps({
+                'img_fn': 'movie/%i.jpg' % (i // 2),
+                'annot_id': 'val-%i' % i,
+                'question': ['What', 'is', [0], 'doing', '"?"'],
+            }) + '\n')
+
+  def _read_annot_ids(self, **kwargs):
+    return [
+        x['annot_id']
+        for x in annotation_reader.read_annotations(self._filename, **kwargs)
+    ]
+
+  def test_read_all(self):
+    self.assertAllEqual(self._read_annot_ids(),
+                        ['val-%i' % i for i in range(10)])
+
+  def test_shard_by_annot_id(self):
+    self.assertAllEqual(self._read_annot_ids(num_shards=3, shard_id=1),
+                        ['val-1', 'val-4', 'val-7'])
+
+  def test_shard_by_img_fn(self):
+    annot_ids = []
+    for shard_id in range(3):
+      for annot_id in self._read_annot_ids(num_shards=3,
+                                           shard_id=shard_id,
+                                           shard_by='img_fn'):
+        img_fn = 'movie/%i.jpg' % (int(annot_id.split('-')[-1]) // 2)
+        self.assertEqual(feature_index.get_image_shard_id(img_fn, 3), shard_id)
+        annot_ids.append(annot_id)
+    self.assertCountEqual(annot_ids, ['val-%i' % i for i in range(10)])
+
+  def test_filter(self):
+    self.assertAllEqual(
+        self._read_annot_ids(annot_ids={'val-2', 'val-4', 'val-11'},
+                             filter_fn=lambda x: x['img_fn'] != 'movie/2.jpg'),
+        ['val-2'])
+
+  def test_skip_annot_ids(self):
+    self.assertAllEqual(
+        self._read_annot_ids(num_shards=3,
+                             shard_id=1,
+                             skip_annot_ids={'val-4', 'val-5'}),
+        ['val-1', 'val-7'])
+
+  def test_split_annotations(self):
+    output_dir = tempfile.mkdtemp()
+    for shard_by in ['annot_id', 'img_fn']:
+      filenames, num_annotations = annotation_reader.split_annotations(
+          self._filename, output_dir, num_shards=3, shard_by=shard_by)
+      self.assertEqual(sum(num_annotations), 10)
+      for shard_id, filename in enumerate(filenames):
+        annot_ids = [
+            x['annot_id']
+            for x in annotation_reader.read_annotations(filename)
+        ]
+        self.assertAllEqual(
+            annot_ids,
+            self._read_annot_ids(num_shards=3,
+                                 shard_id=shard_id,
+                                 shard_by=shard_by))
+        self.assertEqual(len(annot_ids), num_annotations[shard_id])
+
+  def test_invalid_shard_id(self):
+    with self.assertRaises(ValueError):
+      self._read_annot_ids(num_shards=3, shard_id=3)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,442 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from absl import app
+from absl import flags
+from absl import logging
+
+import os
+import tempfile
+import time
+import contextlib
+import numpy as np
+import tensorflow as tf
+
+from google.protobuf import text_format
+from modeling.layers import token_to_id
+from protos import pipeline_pb2
+from protos import reader_pb2
+from readers import reader
+from readers import sharding
+from readers import text_utils
+from readers import vcr_reader
+from readers import vcr_reader_v2
+from readers import vcr_text_frcnn_reader
+
+flags.DEFINE_string('pipeline_proto', None, 'Path to the pipeline proto file.')
+
+flags.DEFINE_enum('reader', 'train_reader', ['train_reader', 'eval_reader'],
+                  'Reader of the pipeline proto to benchmark.')
+
+flags.DEFINE_string(
+    'synthetic_dir', None, 'Directory of the synthetic records, a temporary '
+    'directory if not specified.')
+
+flags.DEFINE_integer('num_examples', 512, 'Number of synthetic examples.')
+
+flags.DEFINE_integer('num_files', 4, 'Number of synthetic record files.')
+
+flags.DEFINE_integer('num_batches', 50, 'Number of batches to time.')
+
+flags.DEFINE_integer('num_warmup_batches', 5,
+                     'Number of batches to skip before timing.')
+
+flags.DEFINE_list('sweep_num_parallel_calls', ['1', '2', '4', '8'],
+                  'Values of `num_parallel_calls` to sweep.')
+
+flags.DEFINE_list('sweep_interleave_cycle_length', ['1', '2', '4'],
+                  'Values of `interleave_cycle_length` to sweep.')
+
+flags.DEFINE_list('sweep_prefetch_buffer_size', ['1', '8', '64'],
+                  'Values of `prefetch_buffer_size` to sweep.')
+
+FLAGS = flags.FLAGS
+
+NUM_CHOICES = 4
+VOCAB_SIZE = 30522
+UNK_TOKEN_ID = 100
+DETECTION_CLASSES = ['person', 'dog', 'car', 'chair', 'cup', 'bottle', 'horse']
+
+# Sizes of the synthetic images, in both orientations.
+_IMAGE_SIZES = [(480, 640), (640, 480), (600, 800), (375, 500)]
+
+
+def _create_vocab(filename):
+  """Writes a synthetic vocabulary, laid out as the Bert vocabulary.
+
+  Args:
+    filename: Path to the vocabulary file.
+
+  Returns:
+    A list of the words, excluding the special tokens.
+  """
+  tokens = ['[PAD]'] + ['[unused%i]' % i for i in range(UNK_TOKEN_ID - 1)]
+  tokens += ['[UNK]', '[CLS]', '[SEP]', '[MASK]'] + DETECTION_CLASSES
+  words = ['word%i' % i for i in range(VOCAB_SIZE - len(tokens))]
+  with tf.io.gfile.GFile(filename, 'w') as f:
+    f.write('\n'.join(tokens + words) + '\n')
+  return words
+
+
+def _bytes_feature_list(value):
+  return tf.train.Feature(bytes_list=tf.train.BytesList(
+      value=[x.encode('utf8') if isinstance(x, str) else x for x in value]))
+
+
+def _int64_feature_list(value):
+  return tf.train.Feature(int64_list=tf.train.Int64List(value=value))
+
+
+def _float_feature_list(value):
+  return tf.train.Feature(float_list=tf.train.FloatList(value=value))
+
+
+def _create_example(rng, reader_oneof, options, words, vocab, images):
+  """Creates a synthetic tf.train.Example in the format of the reader.
+
+  Args:
+    rng: A np.random.RandomState instance.
+    reader_oneof: Name of the reader, e.g., 'vcr_reader'.
+    options: The reader proto.
+    words: A list of words to sample the sentences from.
+    vocab: A text_utils.Vocab object, or None to write the tokens as strings.
+    images: A list of encoded jpeg images.
+
+  Returns:
+    A tf.train.Example instance.
+  """
+  token_suffix, tokens_feature = '', _bytes_feature_list
+  if vocab is not None:
+    token_suffix = '_id'
+    tokens_feature = lambda x: _int64_feature_list(
+        vocab.convert_tokens_to_ids(x))
+
+  num_detections = rng.randint(2, 20)
+  ymin, xmin = rng.rand(2, num_detections) * 0.5
+  ymax, xmax = 0.5 + rng.rand(2, num_detections) * 0.5
+  labels = [DETECTION_CLASSES[i] for i in rng.randint(len(DETECTION_CLASSES),
+                                                      size=num_detections)]
+  feature = {
+      'annot_id': _bytes_feature_list(['synthetic-%i' % rng.randint(1 << 30)]),
+      'img_id': _bytes_feature_list(['img-%i' % rng.randint(1 << 30)]),
+      'answer_label': _int64_feature_list([rng.randint(NUM_CHOICES)]),
+      'rationale_label': _int64_feature_list([rng.randint(NUM_CHOICES)]),
+      'image/object/bbox/ymin': _float_feature_list(ymin),
+      'image/object/bbox/xmin': _float_feature_list(xmin),
+      'image/object/bbox/ymax': _float_feature_list(ymax),
+      'image/object/bbox/xmax': _float_feature_list(xmax),
+      'image/object/bbox/score': _float_feature_list(rng.rand(num_detections)),
+      'image/object/bbox/label' + token_suffix: tokens_feature(labels),
+  }
+  if vocab is not None:
+    feature['vocab_hash'] = _bytes_feature_list([vocab.hash])
+
+  if 'desired_size' in options.DESCRIPTOR.fields_by_name:
+    feature['image/encoded'] = _bytes_feature_list(
+        [images[rng.randint(len(images))]])
+    feature['image/format'] = _bytes_feature_list(['jpeg'])
+
+  if 'frcnn_feature_dims' in options.DESCRIPTOR.fields_by_name:
+    features = rng.rand(num_detections, options.frcnn_feature_dims)
+    if options.frcnn_feature_encoding == reader_pb2.FLOAT_LIST:
+      feature['image/object/bbox/feature'] = _float_feature_list(
+          features.flatten())
+    else:
+      dtype = {reader_pb2.RAW_FLOAT32: '<f4', reader_pb2.RAW_FLOAT16: '<f2'}
+      feature['image/object/bbox/feature'] = _bytes_feature_list(
+          [features.astype(dtype[options.frcnn_feature_encoding]).tobytes()])
+
+  def _add_sentence(key, tag_key, min_len, max_len):
+    length = rng.randint(min_len, max_len)
+    tags = np.where(rng.rand(length) < 0.1,
+                    rng.randint(num_detections, size=length), -1)
+    feature[key] = tokens_feature(
+        [words[i] for i in rng.randint(len(words), size=length)])
+    feature[tag_key] = _int64_feature_list(tags)
+
+  _add_sentence('question' + token_suffix, 'question_tag', 8, 20)
+
+  # The choices are numbered from 0 by VCRReaderV2, from 1 otherwise.
+  offset = 0 if reader_oneof == 'vcr_reader_v2' else 1
+  for i in range(offset, offset + NUM_CHOICES):
+    _add_sentence('answer_choice%s_%i' % (token_suffix, i),
+                  'answer_choice_tag_%i' % i, 4, 24)
+    _add_sentence('rationale_choice%s_%i' % (token_suffix, i),
+                  'rationale_choice_tag_%i' % i, 8, 40)
+  return tf.train.Example(features=tf.train.Features(feature=feature))
+
+
+def create_synthetic_dataset(options, reader_oneof, output_dir, num_examples,
+                             num_files):
+  """Writes synthetic records and points the reader options at them.
+
+  The vocabularies are synthetic as well, the cache directory and the feature
+  store are cleared so that only the records are read.
+
+  Args:
+    options: The reader proto, modified in place.
+    reader_oneof: Name of the reader, e.g., 'vcr_reader'.
+    output_dir: Directory to write the records and the vocabularies to.
+    num_examples: Number of examples.
+    num_files: Number of record files.
+  """
+  tf.io.gfile.makedirs(output_dir)
+  options.vocab_file = os.path.join(output_dir, 'vocab.txt')
+  options.out_of_vocabulary_token_id = UNK_TOKEN_ID
+  words = _create_vocab(options.vocab_file)
+
+  if reader_oneof == 'vcr_reader_v2':
+    options.detection_vocab_file = os.path.join(output_dir,
+                                                'detection_vocab.txt')
+    with tf.io.gfile.GFile(options.detection_vocab_file, 'w') as f:
+      f.write('\n'.join(DETECTION_CLASSES) + '\n')
+
+  for field in ['cache_dir', 'feature_store_dir']:
+    if field in options.DESCRIPTOR.fields_by_name:
+      options.ClearField(field)
+
+  vocab = None
+  if getattr(options, 'use_token_ids', False):
+    vocab = text_utils.Vocab(options.vocab_file,
+                             options.out_of_vocabulary_token_id)
+
+  rng = np.random.RandomState(0)
+  images = [
+      tf.io.encode_jpeg(
+          tf.constant(rng.randint(256, size=size + (3,), dtype=np.uint8)))
+      .numpy() for size in _IMAGE_SIZES
+  ]
+
+  del options.input_pattern[:]
+  options.input_pattern.append(os.path.join(output_dir, 'synthetic.record-*'))
+  for file_id in range(num_files):
+    filename = os.path.join(output_dir,
+                            'synthetic.record-%05d-of-%05d' % (file_id,
+                                                               num_files))
+    with tf.io.TFRecordWriter(filename) as writer:
+      for _ in range(file_id, num_examples, num_files):
+        writer.write(
+            _create_example(rng, reader_oneof, options, words, vocab,
+                            images).SerializeToString())
+  logging.info('Wrote %i synthetic examples to %s.', num_examples, output_dir)
+
+
+def _get_parse_fn(reader_oneof, options):
+  """Returns the function parsing a serialized record of the reader."""
+  vocab = None
+  if getattr(options, 'use_token_ids', False):
+    vocab = text_utils.Vocab(options.vocab_file,
+                             options.out_of_vocabulary_token_id)
+  if reader_oneof == 'vcr_reader':
+    return lambda x: vcr_reader._parse_single_example(x, options, vocab)
+  if reader_oneof == 'vcr_reader_v2':
+    return lambda x: vcr_reader_v2._parse_single_example(x, options)
+  return lambda x: vcr_text_frcnn_reader._parse_single_example(
+      x, options, vocab=vocab)
+
+
+class _IdentityLayer(object):
+  """Stands for token_to_id.TokenToIdLayer, keeping the tokens as strings."""
+
+  def __init__(self, *args, **kwargs):
+    pass
+
+  def __call__(self, inputs):
+    return inputs
+
+
+@contextlib.contextmanager
+def _skip_token_lookup():
+  """Makes the readers keep the tokens as strings while in the context.
+
+  The readers look up the token ids with token_to_id.TokenToIdLayer inside
+  their parse function, which tf.data traces when `map` is called.
+  """
+  layer_class = token_to_id.TokenToIdLayer
+  token_to_id.TokenToIdLayer = _IdentityLayer
+  try:
+    yield
+  finally:
+    token_to_id.TokenToIdLayer = layer_class
+
+
+def _time_dataset(dataset, num_elements, num_warmup_elements):
+  """Iterates through the dataset and returns the time per element.
+
+  Args:
+    dataset: A tf.data.Dataset instance.
+    num_elements: Number of elements to time.
+    num_warmup_elements: Number of elements to skip before timing.
+
+  Returns:
+    Seconds per element.
+  """
+  iterator = iter(dataset)
+  for _ in range(num_warmup_elements):
+    next(iterator)
+
+  count = 0
+  start_time = time.time()
+  for _ in range(num_elements):
+    try:
+      next(iterator)
+    except StopIteration:
+      break
+    count += 1
+  if count == 0:
+    raise ValueError('The dataset is exhausted by the warmup, more synthetic '
+                     'examples are required.')
+  return (time.time() - start_time) / count
+
+
+def create_stage_pipelines(reader_oneof, options, is_training):
+  """Creates the pipelines stopping after each stage of the input pipeline.
+
+  The `decode` stage parses the records with the token lookup of the readers
+  replaced by the identity, the `token_lookup` stage parses them as the
+  readers do, so that the difference is the cost of the lookup. It is close to
+  0 with `use_token_ids`.
+
+  Args:
+    reader_oneof: Name of the reader, e.g., 'vcr_reader'.
+    options: The reader proto.
+    is_training: If true, create the training pipeline.
+
+  Returns:
+    A list of (stage name, dataset, elements per batch) tuples.
+  """
+  batch_size = options.batch_size
+  records = sharding.read_records(options, is_training).repeat()
+  with _skip_token_lookup():
+    decoded = records.map(_get_parse_fn(reader_oneof, options),
+                          num_parallel_calls=options.num_parallel_calls)
+  parsed = records.map(_get_parse_fn(reader_oneof, options),
+                       num_parallel_calls=options.num_parallel_calls)
+  batched = parsed.padded_batch(
+      batch_size,
+      padded_shapes=tf.compat.v1.data.get_output_shapes(parsed),
+      drop_remainder=True)
+
+  return [
+      ('read', records, batch_size),
+      ('decode', decoded, batch_size),
+      ('token_lookup', parsed, batch_size),
+      ('padded_batch', batched, 1),
+  ]
+
+
+def benchmark_stages(reader_oneof, options, is_training, num_batches,
+                     num_warmup_batches):
+  """Times the stages of the input pipeline.
+
+  Each stage is timed as a pipeline stopping after it, the time of the stage
+  is the increase over the previous one. The stages run in parallel in the
+  full pipeline, so the numbers give where the time goes, not a sum. The token
+  lookup is timed as the increase of the parsing over the parsing without the
+  lookup, see `create_stage_pipelines`.
+
+  Args:
+    reader_oneof: Name of the reader, e.g., 'vcr_reader'.
+    options: The reader proto.
+    is_training: If true, benchmark the training pipeline.
+    num_batches: Number of batches to time.
+    num_warmup_batches: Number of batches to skip before timing.
+
+  Returns:
+    A list of (stage name, seconds per batch) tuples.
+  """
+  stages, previous_time = [], 0.0
+  for name, dataset, elements_per_batch in create_stage_pipelines(
+      reader_oneof, options, is_training):
+    elapsed = elements_per_batch * _time_dataset(
+        dataset, num_batches * elements_per_batch,
+        num_warmup_batches * elements_per_batch)
+    stages.append((name, elapsed - previous_time))
+    previous_time = elapsed
+  return stages
+
+
+def benchmark_input_fn(options, reader_oneof, is_training, num_batches,
+                       num_warmup_batches):
+  """Times the input_fn of the reader.
+
+  Args:
+    options: The reader proto.
+    reader_oneof: Name of the reader, e.g., 'vcr_reader'.
+    is_training: If true, benchmark the training pipeline.
+    num_batches: Number of batches to time.
+    num_warmup_batches: Number of batches to skip before timing.
+
+  Returns:
+    Seconds per batch.
+  """
+  reader_proto = reader_pb2.Reader()
+  getattr(reader_proto, reader_oneof).CopyFrom(options)
+  dataset = reader.get_input_fn(reader_proto, is_training=is_training)()
+  return _time_dataset(dataset, num_batches, num_warmup_batches)
+
+
+def _get_record_size(options):
+  """Returns the average size in bytes of the records."""
+  num_bytes, num_records = 0, 0
+  for input_pattern in options.input_pattern:
+    for filename in tf.io.gfile.glob(input_pattern):
+      num_bytes += tf.io.gfile.stat(filename).length
+      num_records += sum(1 for _ in tf.data.TFRecordDataset(filename))
+  return num_bytes / max(num_records, 1)
+
+
+def main(_):
+  logging.set_verbosity(logging.INFO)
+
+  tf.compat.v1.enable_eager_execution()
+  tf.config.experimental.set_visible_devices([], 'GPU')
+
+  with tf.io.gfile.GFile(FLAGS.pipeline_proto, 'r') as fp:
+    pipeline_proto = text_format.Merge(fp.read(), pipeline_pb2.Pipeline())
+  reader_proto = getattr(pipeline_proto, FLAGS.reader)
+  reader_oneof = reader_proto.WhichOneof('reader_oneof')
+  options = getattr(reader_proto, reader_oneof)
+  is_training = FLAGS.reader == 'train_reader'
+
+  create_synthetic_dataset(options, reader_oneof, FLAGS.synthetic_dir or
+                           tempfile.mkdtemp(), FLAGS.num_examples,
+                           FLAGS.num_files)
+  record_size = _get_record_size(options)
+
+  def _log_throughput(name, seconds_per_batch):
+    examples_per_sec = options.batch_size / seconds_per_batch
+    logging.info('%s: %.1lf examples/sec, %.2lf MB/sec.', name,
+                 examples_per_sec, examples_per_sec * record_size / 1e6)
+
+  for name, seconds_per_batch in benchmark_stages(reader_oneof, options,
+                                                  is_training,
+                                                  FLAGS.num_batches,
+                                                  FLAGS.num_warmup_batches):
+    logging.info('Stage %s: %.2lf ms/batch.', name, 1e3 * seconds_per_batch)
+
+  _log_throughput(
+      'input_fn',
+      benchmark_input_fn(options, reader_oneof, is_training, FLAGS.num_batches,
+                         FLAGS.num_warmup_batches))
+
+  # Each option is swept with the others kept at the configured values.
+  for field, values in [
+      ('num_parallel_calls', FLAGS.sweep_num_parallel_calls),
+      ('interleave_cycle_length', FLAGS.sweep_interleave_cycle_length),
+      ('prefetch_buffer_size', FLAGS.sweep_prefetch_buffer_size),
+  ]:
+    for value in values:
+      sweep_options = type(options)()
+      sweep_options.CopyFrom(options)
+      setattr(sweep_options, field, int(value))
+      _log_throughput(
+          '%s=%s' % (field, value),
+          benchmark_input_fn(sweep_options, reader_oneof, is_training,
+                             FLAGS.num_batches, FLAGS.num_warmup_batches))
+
+
+if __name__ == '__main__':
+  flags.mark_flag_as_required('pipeline_proto')
+  app.run(main)
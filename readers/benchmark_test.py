@@ -0,0 +1,79 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tempfile
+import tensorflow as tf
+
+from protos import reader_pb2
+from readers import benchmark
+from readers.vcr_fields import InputFields
+
+tf.compat.v1.enable_eager_execution()
+
+
+class BenchmarkTest(tf.test.TestCase):
+
+  def _create_options(self, reader_oneof):
+    reader_proto = reader_pb2.Reader()
+    options = getattr(reader_proto, reader_oneof)
+    options.batch_size = 4
+    options.interleave_cycle_length = 1
+    benchmark.create_synthetic_dataset(options, reader_oneof,
+                                       tempfile.mkdtemp(),
+                                       num_examples=12,
+                                       num_files=2)
+    return options
+
+  def test_synthetic_dataset(self):
+    for reader_oneof in [
+        'vcr_reader', 'vcr_reader_v2', 'vcr_text_frcnn_reader'
+    ]:
+      options = self._create_options(reader_oneof)
+      seconds_per_batch = benchmark.benchmark_input_fn(options,
+                                                       reader_oneof,
+                                                       is_training=False,
+                                                       num_batches=2,
+                                                       num_warmup_batches=1)
+      self.assertGreater(seconds_per_batch, 0)
+
+  def test_synthetic_token_ids(self):
+    options = self._create_options('vcr_text_frcnn_reader')
+    options.use_token_ids = True
+    options.frcnn_feature_encoding = reader_pb2.RAW_FLOAT16
+    benchmark.create_synthetic_dataset(options, 'vcr_text_frcnn_reader',
+                                       tempfile.mkdtemp(),
+                                       num_examples=8,
+                                       num_files=1)
+    self.assertGreater(
+        benchmark.benchmark_input_fn(options,
+                                     'vcr_text_frcnn_reader',
+                                     is_training=True,
+                                     num_batches=1,
+                                     num_warmup_batches=0), 0)
+
+  def test_benchmark_stages(self):
+    stages = benchmark.benchmark_stages('vcr_reader',
+                                        self._create_options('vcr_reader'),
+                                        is_training=False,
+                                        num_batches=2,
+                                        num_warmup_batches=1)
+    self.assertEqual([name for name, _ in stages],
+                     ['read', 'decode', 'token_lookup', 'padded_batch'])
+
+  def test_stage_pipelines(self):
+    pipelines = benchmark.create_stage_pipelines(
+        'vcr_reader', self._create_options('vcr_reader'), is_training=False)
+    pipelines = dict((name, dataset) for name, dataset, _ in pipelines)
+
+    # Only the `token_lookup` stage converts the tokens to ids.
+    decoded = next(iter(pipelines['decode']))
+    self.assertEqual(decoded[InputFields.answer_choices].dtype, tf.string)
+    self.assertEqual(decoded[InputFields.detection_classes].dtype, tf.string)
+    parsed = next(iter(pipelines['token_lookup']))
+    self.assertEqual(parsed[InputFields.answer_choices].dtype, tf.int32)
+    self.assertEqual(parsed[InputFields.detection_classes].dtype, tf.int32)
+
+
+if __name__ == '__main__':
+  tf.test.main()
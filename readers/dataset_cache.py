@@ -0,0 +1,88 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import hashlib
+import tensorflow as tf
+
+# Reader options that do not change the parsed examples.
+_IGNORED_FIELDS = [
+    'shuffle_buffer_size',
+    'interleave_cycle_length',
+    'num_parallel_calls',
+    'batch_size',
+    'prefetch_buffer_size',
+    'cache_dataset',
+    'cache_dir',
+    'bucket_boundaries',
+]
+
+
+def _list_input_files(input_patterns):
+  """Lists the input files, as sorted (filename, length, mtime) tuples."""
+  input_files = []
+  for input_pattern in input_patterns:
+    for filename in tf.io.gfile.glob(input_pattern):
+      stat = tf.io.gfile.stat(filename)
+      input_files.append((filename, stat.length, stat.mtime_nsec))
+  return sorted(set(input_files))
+
+
+def get_cache_key(options, vocab_hash, input_fields=None, shard=None):
+  """Computes the key of the parsed examples.
+
+  The key covers everything the parsed examples depend on, so that a cache is
+  invalidated when the parsing options, the vocabulary, the projected fields,
+  the input files or the files of the feature store change.
+
+  Args:
+    options: A reader proto, e.g., reader_pb2.VCRReader.
+    vocab_hash: Hash of the vocabulary, see text_utils.Vocab.
+    input_fields: A collection of the input fields consumed by the model, None
+      if all the fields are decoded.
+    shard: A (num_shards, shard_id) tuple if the input files are sharded.
+
+  Returns:
+    A hex string.
+  """
+  parsing_options = type(options)()
+  parsing_options.CopyFrom(options)
+  for field in _IGNORED_FIELDS:
+    if field in parsing_options.DESCRIPTOR.fields_by_name:
+      parsing_options.ClearField(field)
+
+  key = hashlib.sha256()
+  key.update(parsing_options.SerializeToString(deterministic=True))
+  key.update(vocab_hash.encode('utf8'))
+  if input_fields is not None:
+    key.update(','.join(sorted(input_fields)).encode('utf8'))
+  if shard is not None:
+    key.update(('%i/%i' % shard).encode('utf8'))
+
+  # The looked up features change when the store is re-extracted in place.
+  input_patterns = list(options.input_pattern)
+  if ('feature_store_dir' in options.DESCRIPTOR.fields_by_name and
+      options.HasField('feature_store_dir')):
+    input_patterns.append(os.path.join(options.feature_store_dir, '*'))
+  for input_file in _list_input_files(input_patterns):
+    key.update(('%s:%i:%i' % input_file).encode('utf8'))
+  return key.hexdigest()
+
+
+def get_cache_filename(options, vocab_hash, input_fields=None, shard=None):
+  """Returns the cache filename of the parsed examples, under `cache_dir`.
+
+  Args:
+    options: A reader proto having a `cache_dir` field.
+    vocab_hash: Hash of the vocabulary, see text_utils.Vocab.
+    input_fields: A collection of the input fields consumed by the model, None
+      if all the fields are decoded.
+    shard: A (num_shards, shard_id) tuple if the input files are sharded.
+
+  Returns:
+    A path to be passed to tf.data.Dataset.cache.
+  """
+  tf.io.gfile.makedirs(options.cache_dir)
+  key = get_cache_key(options, vocab_hash, input_fields, shard)
+  return os.path.join(options.cache_dir, 'parsed-%s' % key[:16])
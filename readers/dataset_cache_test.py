@@ -0,0 +1,79 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import tempfile
+import tensorflow as tf
+
+from protos import reader_pb2
+from readers import dataset_cache
+
+
+class DatasetCacheTest(tf.test.TestCase):
+
+  def setUp(self):
+    self._input_dir = tempfile.mkdtemp()
+    for shard_id in range(2):
+      self._write_shard(shard_id, b'records')
+
+    self._options = reader_pb2.VCRReader(
+        input_pattern=[os.path.join(self._input_dir, 'val.record-*')],
+        vocab_file='vocab.txt',
+        cache_dir=os.path.join(self._input_dir, 'cache'))
+
+  def _write_shard(self, shard_id, contents):
+    with open(os.path.join(self._input_dir, 'val.record-%i' % shard_id),
+              'wb') as f:
+      f.write(contents)
+
+  def _get_key(self, options=None, vocab_hash='vocab', **kwargs):
+    return dataset_cache.get_cache_key(options or self._options, vocab_hash,
+                                       **kwargs)
+
+  def test_ignored_fields(self):
+    options = reader_pb2.VCRReader()
+    options.CopyFrom(self._options)
+    options.batch_size = 7
+    options.prefetch_buffer_size = 1
+    self.assertEqual(self._get_key(options), self._get_key())
+
+  def test_invalidation(self):
+    key = self._get_key()
+    self.assertNotEqual(self._get_key(vocab_hash='new_vocab'), key)
+    self.assertNotEqual(self._get_key(input_fields=['answer_label']), key)
+    self.assertNotEqual(self._get_key(shard=(2, 0)), key)
+
+    options = reader_pb2.VCRReader()
+    options.CopyFrom(self._options)
+    options.use_token_ids = True
+    self.assertNotEqual(self._get_key(options), key)
+
+    self._write_shard(1, b'new records')
+    self.assertNotEqual(self._get_key(), key)
+
+  def test_feature_store_invalidation(self):
+    store_dir = tempfile.mkdtemp()
+    index_path = os.path.join(store_dir, 'features-00000-of-00001.tsv')
+    with open(index_path, 'w') as f:
+      f.write('val-0\t0\t3\n')
+
+    options = reader_pb2.VCRTextFRCNNReader(
+        input_pattern=self._options.input_pattern,
+        vocab_file='vocab.txt',
+        feature_store_dir=store_dir)
+    key = self._get_key(options)
+
+    # The store is re-extracted in place.
+    with open(index_path, 'a') as f:
+      f.write('val-1\t3\t2\n')
+    self.assertNotEqual(self._get_key(options), key)
+
+  def test_get_cache_filename(self):
+    filename = dataset_cache.get_cache_filename(self._options, 'vocab')
+    self.assertTrue(os.path.isdir(self._options.cache_dir))
+    self.assertEqual(os.path.dirname(filename), self._options.cache_dir)
+
+
+if __name__ == '__main__':
+  tf.test.main()
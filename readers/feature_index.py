@@ -0,0 +1,93 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import json
+import hashlib
+import tensorflow as tf
+
+NUM_PARTITIONS = 100
+IMAGE_KEY_PREFIX = 'img'
+
+
+def get_image_key(img_fn, boxes):
+  """Gets the key of the region features of an image.
+
+  Args:
+    img_fn: Path to the image, e.g., `movieclips_xxx/xxx.jpg`.
+    boxes: A list of [xmin, ymin, xmax, ymax, score] boxes.
+
+  Returns:
+    A string in the format of `img-<hex digest>`.
+  """
+  digest = hashlib.md5(img_fn.encode('utf8'))
+  digest.update(json.dumps(boxes).encode('utf8'))
+  return '%s-%s' % (IMAGE_KEY_PREFIX, digest.hexdigest()[:16])
+
+
+def get_image_shard_id(img_fn, num_shards):
+  """Gets the shard id of an image, so that an image is owned by one shard.
+
+  Args:
+    img_fn: Path to the image.
+    num_shards: Total number of shards.
+
+  Returns:
+    An integer in the range of [0, num_shards).
+  """
+  digest = hashlib.md5(img_fn.encode('utf8')).hexdigest()
+  return int(digest[:8], 16) % num_shards
+
+
+def get_partition_id(key, num_partitions=NUM_PARTITIONS):
+  """Gets the partition id of a feature key.
+
+  Args:
+    key: Either an annotation id (e.g., `val-123`) or an image key.
+    num_partitions: Total number of partitions.
+
+  Returns:
+    An integer in the range of [0, num_partitions).
+  """
+  split, number = key.split('-')
+  if split == IMAGE_KEY_PREFIX:
+    return int(number, 16) % num_partitions
+  return int(number) % num_partitions
+
+
+def get_feature_path(feature_dir, key):
+  """Gets the path to the `.npy` file of a feature key."""
+  return os.path.join(feature_dir, '%02d' % get_partition_id(key),
+                      key + '.npy')
+
+
+def get_index_path(feature_dir, shard_id, num_shards):
+  """Gets the path to the index file written by a shard."""
+  return os.path.join(feature_dir,
+                      'index-%05d-of-%05d.tsv' % (shard_id, num_shards))
+
+
+def get_manifest_path(feature_dir, shard_id, num_shards):
+  """Gets the path to the manifest of the npy files written by a shard."""
+  return os.path.join(feature_dir,
+                      'manifest-%05d-of-%05d.tsv' % (shard_id, num_shards))
+
+
+def load_index(feature_dir):
+  """Loads the mapping from annotation id to feature key.
+
+  Args:
+    feature_dir: Path to the directory saving features.
+
+  Returns:
+    A python dictionary mapping from `annot_id` to feature key. It is empty if
+    the features are keyed by `annot_id`.
+  """
+  index = {}
+  for filename in tf.io.gfile.glob(os.path.join(feature_dir, 'index-*.tsv')):
+    with tf.io.gfile.GFile(filename, 'r') as f:
+      for line in f:
+        annot_id, key = line.rstrip('\n').split('\t')
+        index[annot_id] = key
+  return index
@@ -0,0 +1,46 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import tempfile
+import tensorflow as tf
+
+from readers import feature_index
+
+
+class FeatureIndexTest(tf.test.TestCase):
+
+  def test_get_image_key(self):
+    boxes = [[0, 0, 10, 10, 0.9]]
+    key = feature_index.get_image_key('movie/1.jpg', boxes)
+    self.assertTrue(key.startswith(feature_index.IMAGE_KEY_PREFIX + '-'))
+    self.assertEqual(key, feature_index.get_image_key('movie/1.jpg', boxes))
+    self.assertNotEqual(key, feature_index.get_image_key('movie/2.jpg', boxes))
+    self.assertNotEqual(
+        key, feature_index.get_image_key('movie/1.jpg', [[0, 0, 5, 5, 0.9]]))
+
+  def test_get_partition_id(self):
+    self.assertEqual(feature_index.get_partition_id('val-123'), 23)
+    self.assertEqual(feature_index.get_partition_id('img-00000000000000ff'),
+                     255 % feature_index.NUM_PARTITIONS)
+
+  def test_load_index(self):
+    feature_dir = tempfile.mkdtemp()
+    self.assertDictEqual(feature_index.load_index(feature_dir), {})
+
+    for shard_id in range(2):
+      with open(feature_index.get_index_path(feature_dir, shard_id, 2),
+                'w') as f:
+        f.write('val-%i\timg-%i\n' % (shard_id, shard_id))
+    self.assertDictEqual(feature_index.load_index(feature_dir), {
+        'val-0': 'img-0',
+        'val-1': 'img-1'
+    })
+    self.assertEqual(
+        feature_index.get_feature_path(feature_dir, 'val-1'),
+        os.path.join(feature_dir, '01', 'val-1.npy'))
+
+
+if __name__ == '__main__':
+  tf.test.main()
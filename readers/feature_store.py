@@ -0,0 +1,235 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import json
+import numpy as np
+import tensorflow as tf
+
+from readers import feature_index
+
+_DATA_SUFFIX = '.bin'
+_INDEX_SUFFIX = '.tsv'
+_HEADER_SUFFIX = '.json'
+
+
+def _get_shard_prefix(store_dir, shard_id, num_shards):
+  return os.path.join(store_dir,
+                      'features-%05d-of-%05d' % (shard_id, num_shards))
+
+
+def _load_shard_index(index_path):
+  """Loads the committed entries of a shard.
+
+  Args:
+    index_path: Path to the index file of the shard.
+
+  Returns:
+    entries: A python dictionary mapping from key to (row_offset, num_rows).
+    num_bytes: Byte offset following the last complete line of the index.
+  """
+  entries = {}
+  num_bytes = 0
+  if os.path.isfile(index_path):
+    with open(index_path, 'rb') as f:
+      for line in f:
+        if not line.endswith(b'\n'):
+          break  # Partially written line.
+        key, row_offset, num_rows = line.decode('utf8').rstrip('\n').split(
+            '\t')
+        entries[key] = (int(row_offset), int(num_rows))
+        num_bytes += len(line)
+  return entries, num_bytes
+
+
+class FeatureStoreWriter(object):
+  """Appends region features to one shard of the feature store.
+
+  A shard consists of a contiguous array file holding the rows of all the
+  features, an index file mapping each key to its (row_offset, num_rows), and a
+  header describing the dtype and the feature dimensions. The array is written
+  before the index, so an entry is only visible once its data is complete.
+  """
+
+  def __init__(self,
+               store_dir,
+               shard_id,
+               num_shards,
+               feature_dims,
+               dtype='float32'):
+    """Initializes the writer, resuming from the committed entries.
+
+    Args:
+      store_dir: Path to the directory of the feature store.
+      shard_id: Shard id of the current process.
+      num_shards: Total number of shards.
+      feature_dims: Dimensions of the feature rows.
+      dtype: Either `float32` or `float16`.
+    """
+    tf.io.gfile.makedirs(store_dir)
+    prefix = _get_shard_prefix(store_dir, shard_id, num_shards)
+
+    self._dtype = np.dtype(dtype).newbyteorder('<')
+    self._feature_dims = feature_dims
+
+    header = {'dtype': self._dtype.str, 'feature_dims': feature_dims}
+    header_path = prefix + _HEADER_SUFFIX
+    if os.path.isfile(header_path):
+      with open(header_path, 'r') as f:
+        if json.load(f) != header:
+          raise ValueError('The existing shard %s has a different header.' %
+                           prefix)
+    else:
+      with open(header_path, 'w') as f:
+        json.dump(header, f)
+
+    # Drop the rows that were not committed to the index.
+    self._entries, index_num_bytes = _load_shard_index(prefix + _INDEX_SUFFIX)
+    self._num_rows = max([x + n for x, n in self._entries.values()] + [0])
+
+    self._data_file = open(prefix + _DATA_SUFFIX, 'ab')
+    self._data_file.truncate(self._num_rows * feature_dims *
+                             self._dtype.itemsize)
+    self._data_file.seek(0, os.SEEK_END)
+
+    # Drop the partially written line of the index, if any.
+    self._index_file = open(prefix + _INDEX_SUFFIX, 'ab')
+    self._index_file.truncate(index_num_bytes)
+    self._index_file.seek(0, os.SEEK_END)
+
+  def __contains__(self, key):
+    return key in self._entries
+
+  def __len__(self):
+    return len(self._entries)
+
+  def add(self, key, features):
+    """Appends the features of a key.
+
+    Args:
+      key: A string, either an annotation id or an image key.
+      features: A [num_rows, feature_dims] numpy array.
+    """
+    features = np.asarray(features, dtype=self._dtype)
+    if features.ndim != 2 or features.shape[1] != self._feature_dims:
+      raise ValueError('Invalid feature shape %s.' % (features.shape,))
+
+    self._data_file.write(features.tobytes())
+    self._data_file.flush()
+    self._index_file.write(
+        ('%s\t%i\t%i\n' % (key, self._num_rows,
+                             features.shape[0])).encode('utf8'))
+    self._index_file.flush()
+
+    self._entries[key] = (self._num_rows, features.shape[0])
+    self._num_rows += features.shape[0]
+
+  def close(self):
+    self._data_file.close()
+    self._index_file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+
+class FeatureStore(object):
+  """Reads region features from all the shards of the feature store.
+
+  Shards are opened with `np.memmap`, so a lookup returns a view of the mapped
+  file and no data is copied until the caller touches it.
+  """
+
+  def __init__(self, store_dir, aliases=None):
+    """Opens the feature store.
+
+    Args:
+      store_dir: Path to the directory of the feature store.
+      aliases: A python dictionary mapping from `annot_id` to feature key. If
+        None, load the index written by the `key_by_image` extractors.
+    """
+    if aliases is None:
+      aliases = feature_index.load_index(store_dir)
+    self._aliases = aliases
+
+    self._arrays = []
+    self._entries = {}
+    self._dtype = self._feature_dims = None
+
+    header_paths = sorted(
+        tf.io.gfile.glob(
+            os.path.join(store_dir, 'features-*-of-*' + _HEADER_SUFFIX)))
+    if not header_paths:
+      raise ValueError('No feature store is found in %s.' % store_dir)
+
+    for header_path in header_paths:
+      prefix = header_path[:-len(_HEADER_SUFFIX)]
+      with open(header_path, 'r') as f:
+        header = json.load(f)
+      if self._dtype is None:
+        self._dtype = np.dtype(header['dtype'])
+        self._feature_dims = header['feature_dims']
+      elif (np.dtype(header['dtype']) != self._dtype or
+            header['feature_dims'] != self._feature_dims):
+        raise ValueError('Inconsistent header in %s.' % header_path)
+
+      entries, _ = _load_shard_index(prefix + _INDEX_SUFFIX)
+      num_rows = max([x + n for x, n in entries.values()] + [0])
+      if num_rows == 0:
+        continue
+
+      shard_index = len(self._arrays)
+      self._arrays.append(
+          np.memmap(prefix + _DATA_SUFFIX,
+                    dtype=self._dtype,
+                    mode='r',
+                    shape=(num_rows, self._feature_dims)))
+      for key, (row_offset, num_rows) in entries.items():
+        self._entries[key] = (shard_index, row_offset, num_rows)
+
+  @property
+  def feature_dims(self):
+    return self._feature_dims
+
+  @property
+  def dtype(self):
+    return self._dtype
+
+  def __len__(self):
+    return len(self._entries)
+
+  def __contains__(self, key):
+    return self._aliases.get(key, key) in self._entries
+
+  def __getitem__(self, key):
+    """Gets the features of an annotation id or a feature key.
+
+    Args:
+      key: A string, either an annotation id or an image key.
+
+    Returns:
+      A [num_rows, feature_dims] read-only numpy array.
+    """
+    shard_index, row_offset, num_rows = self._entries[self._aliases.get(
+        key, key)]
+    return self._arrays[shard_index][row_offset:row_offset + num_rows]
+
+  def lookup(self, key):
+    """Looks up the features of a string tensor, for use in tf.data.
+
+    Args:
+      key: A scalar string tensor.
+
+    Returns:
+      A [num_rows, feature_dims] float32 tensor.
+    """
+
+    def _lookup_fn(key):
+      return np.asarray(self[key.decode('utf8')], dtype=np.float32)
+
+    features = tf.numpy_function(_lookup_fn, [key], tf.float32)
+    features.set_shape([None, self._feature_dims])
+    return features
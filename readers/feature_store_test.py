@@ -0,0 +1,87 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tempfile
+import numpy as np
+import tensorflow as tf
+
+from readers import feature_store
+
+tf.compat.v1.enable_eager_execution()
+
+
+class FeatureStoreTest(tf.test.TestCase):
+
+  def test_write_and_read(self):
+    store_dir = tempfile.mkdtemp()
+    features_1 = np.random.rand(3, 4).astype(np.float32)
+    features_2 = np.random.rand(5, 4).astype(np.float32)
+
+    with feature_store.FeatureStoreWriter(store_dir, 0, 2, 4) as writer:
+      writer.add('val-1', features_1)
+    with feature_store.FeatureStoreWriter(store_dir, 1, 2, 4) as writer:
+      writer.add('img-ff', features_2)
+
+    store = feature_store.FeatureStore(store_dir, aliases={'val-2': 'img-ff'})
+    self.assertEqual(len(store), 2)
+    self.assertEqual(store.feature_dims, 4)
+    self.assertIn('val-2', store)
+    self.assertNotIn('val-3', store)
+    self.assertAllEqual(store['val-1'], features_1)
+    self.assertAllEqual(store['val-2'], features_2)
+    self.assertAllEqual(store.lookup(tf.constant('val-2')), features_2)
+
+  def test_resume(self):
+    store_dir = tempfile.mkdtemp()
+    features = np.random.rand(3, 2).astype(np.float16)
+
+    with feature_store.FeatureStoreWriter(store_dir, 0, 1, 2,
+                                          dtype='float16') as writer:
+      writer.add('val-1', features)
+
+    # Simulate a crash after writing the data but before the index.
+    with open(store_dir + '/features-00000-of-00001.bin', 'ab') as f:
+      f.write(b'\0' * 7)
+
+    with feature_store.FeatureStoreWriter(store_dir, 0, 1, 2,
+                                          dtype='float16') as writer:
+      self.assertIn('val-1', writer)
+      writer.add('val-2', features * 2)
+
+    store = feature_store.FeatureStore(store_dir)
+    self.assertAllEqual(store['val-1'], features)
+    self.assertAllEqual(store['val-2'], features * 2)
+
+  def test_resume_from_partial_index_line(self):
+    store_dir = tempfile.mkdtemp()
+    features = np.random.rand(3, 2).astype(np.float32)
+
+    with feature_store.FeatureStoreWriter(store_dir, 0, 1, 2) as writer:
+      writer.add('val-1', features)
+
+    # Simulate a crash while writing the index.
+    with open(store_dir + '/features-00000-of-00001.bin', 'ab') as f:
+      f.write(features.tobytes())
+    with open(store_dir + '/features-00000-of-00001.tsv', 'a') as f:
+      f.write('val-2\t3')
+
+    with feature_store.FeatureStoreWriter(store_dir, 0, 1, 2) as writer:
+      self.assertEqual(len(writer), 1)
+      self.assertNotIn('val-2', writer)
+      writer.add('val-3', features * 3)
+
+    store = feature_store.FeatureStore(store_dir)
+    self.assertEqual(len(store), 2)
+    self.assertAllEqual(store['val-1'], features)
+    self.assertAllEqual(store['val-3'], features * 3)
+
+  def test_header_mismatch(self):
+    store_dir = tempfile.mkdtemp()
+    feature_store.FeatureStoreWriter(store_dir, 0, 1, 2).close()
+    with self.assertRaises(ValueError):
+      feature_store.FeatureStoreWriter(store_dir, 0, 1, 3)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,73 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+# Downscaling ratios supported by the jpeg decoder, in decreasing order.
+_JPEG_RATIOS = [8, 4, 2]
+
+
+def _decode_jpeg(encoded_image, desired_size):
+  """Decodes a jpeg, downscaled in the DCT domain by a power of 2.
+
+  The largest ratio keeping the shorter side at least `desired_size` is used,
+  so the decoded image is never smaller than the target size.
+
+  Args:
+    encoded_image: A scalar string tensor, the encoded jpeg data.
+    desired_size: Desired size of the shorter side.
+
+  Returns:
+    A [height, width, 3] uint8 tensor.
+  """
+  min_size = tf.reduce_min(tf.image.extract_jpeg_shape(encoded_image)[:2])
+
+  def _decode_fn(ratio):
+    return lambda: tf.image.decode_jpeg(encoded_image, channels=3, ratio=ratio)
+
+  return tf.case([(min_size >= ratio * desired_size, _decode_fn(ratio))
+                  for ratio in _JPEG_RATIOS],
+                 default=_decode_fn(1),
+                 exclusive=False)
+
+
+def decode_image(encoded_image, desired_size=0):
+  """Decodes an image so that its shorter side is at most `desired_size`.
+
+  Jpeg images are first downscaled while decoding, which is much cheaper than
+  decoding the full image, and only the remaining factor is resampled on the
+  decoded pixels. Smaller images are returned at their original size.
+
+  Args:
+    encoded_image: A scalar string tensor, the encoded image data.
+    desired_size: Desired size of the shorter side, 0 to keep the original
+      size.
+
+  Returns:
+    A [height, width, 3] uint8 tensor.
+  """
+  if desired_size <= 0:
+    image = tf.image.decode_image(encoded_image,
+                                  channels=3,
+                                  expand_animations=False)
+    image.set_shape([None, None, 3])
+    return image
+
+  image = tf.cond(
+      tf.io.is_jpeg(encoded_image),
+      true_fn=lambda: _decode_jpeg(encoded_image, desired_size),
+      false_fn=lambda: tf.image.decode_image(
+          encoded_image, channels=3, expand_animations=False))
+  image.set_shape([None, None, 3])
+
+  image_shape = tf.cast(tf.shape(image)[:2], tf.float32)
+  scale = desired_size / tf.reduce_min(image_shape)
+
+  def _resize_fn():
+    new_size = tf.cast(tf.math.floor(scale * image_shape), tf.int32)
+    return tf.cast(tf.image.resize(image, new_size), tf.uint8)
+
+  image = tf.cond(scale < 1.0, true_fn=_resize_fn, false_fn=lambda: image)
+  image.set_shape([None, None, 3])
+  return image
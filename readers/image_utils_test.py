@@ -0,0 +1,41 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+from readers import image_utils
+
+tf.compat.v1.enable_eager_execution()
+
+
+class ImageUtilsTest(tf.test.TestCase):
+
+  def _encode(self, height, width, encode_fn=tf.image.encode_jpeg):
+    return encode_fn(tf.zeros([height, width, 3], tf.uint8))
+
+  def test_decode_image(self):
+    image = image_utils.decode_image(self._encode(400, 300))
+    self.assertAllEqual(image.shape, [400, 300, 3])
+
+  def test_decode_jpeg_downscaled(self):
+    # Downscaled by 4 when decoding, then resized.
+    image = image_utils.decode_image(self._encode(1000, 800), desired_size=150)
+    self.assertAllEqual(image.shape, [187, 150, 3])
+
+    image = image_utils.decode_image(self._encode(1000, 800), desired_size=200)
+    self.assertAllEqual(image.shape, [250, 200, 3])
+
+  def test_decode_small_image(self):
+    image = image_utils.decode_image(self._encode(100, 80), desired_size=200)
+    self.assertAllEqual(image.shape, [100, 80, 3])
+
+  def test_decode_png(self):
+    image = image_utils.decode_image(self._encode(200, 100,
+                                                  tf.image.encode_png),
+                                     desired_size=50)
+    self.assertAllEqual(image.shape, [100, 50, 3])
+
+
+if __name__ == '__main__':
+  tf.test.main()
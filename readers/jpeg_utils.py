@@ -0,0 +1,91 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+import multiprocessing
+import PIL.Image
+
+_DEFAULT_QUALITY = 75
+
+
+def resize_jpeg(encoded_jpeg, desired_size=400, quality=_DEFAULT_QUALITY):
+  """Resizes jpeg data so that its shorter side is at most `desired_size`.
+
+  The jpeg is decoded in draft mode, which lets libjpeg downscale in the DCT
+  domain by a power of 2 while staying at least as large as the target size,
+  so only the remaining factor is resampled on the decoded pixels. Images that
+  are already small enough are returned as they are, without re-encoding.
+
+  Args:
+    encoded_jpeg: A python string, the encoded jpeg data.
+    desired_size: Maximum size of the shorter side.
+    quality: Quality of the re-encoded jpeg.
+
+  Returns:
+    encoded_jpeg: A python string, the resized jpeg data.
+  """
+  image = PIL.Image.open(io.BytesIO(encoded_jpeg))
+  assert image.format == 'JPEG'
+
+  min_size = min(image.width, image.height)
+  scale = 1.0 * desired_size / min_size
+  if scale >= 1.0:
+    return encoded_jpeg
+
+  new_height, new_width = (int(image.height * scale), int(image.width * scale))
+  image.draft(image.mode, (new_width, new_height))
+  image = image.resize((new_width, new_height))
+  with io.BytesIO() as f:
+    image.save(f, format='JPEG', quality=quality)
+    return f.getvalue()
+
+
+def _resize_jpeg_fn(args):
+  return resize_jpeg(*args)
+
+
+class JpegResizer(object):
+  """Resizes batches of jpeg data, optionally using a pool of processes."""
+
+  def __init__(self,
+               desired_size=400,
+               quality=_DEFAULT_QUALITY,
+               num_workers=0):
+    """Initializes the resizer.
+
+    Args:
+      desired_size: Maximum size of the shorter side.
+      quality: Quality of the re-encoded jpeg.
+      num_workers: Number of worker processes, 0 to resize in this process.
+    """
+    self._desired_size = desired_size
+    self._quality = quality
+    self._pool = None
+    if num_workers > 0:
+      self._pool = multiprocessing.get_context('fork').Pool(num_workers)
+
+  def resize(self, encoded_jpegs):
+    """Resizes a batch of jpeg data.
+
+    Args:
+      encoded_jpegs: A list of python strings, the encoded jpeg data.
+
+    Returns:
+      A list of python strings, the resized jpeg data in the same order.
+    """
+    args = [(x, self._desired_size, self._quality) for x in encoded_jpegs]
+    if self._pool is None:
+      return [_resize_jpeg_fn(x) for x in args]
+    return self._pool.map(_resize_jpeg_fn, args)
+
+  def close(self):
+    if self._pool is not None:
+      self._pool.close()
+      self._pool.join()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
@@ -0,0 +1,46 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+import numpy as np
+import PIL.Image
+import tensorflow as tf
+
+from readers import jpeg_utils
+
+
+def _encode_jpeg(height, width):
+  image = PIL.Image.fromarray(
+      np.random.randint(0, 255, size=(height, width, 3), dtype=np.uint8))
+  with io.BytesIO() as f:
+    image.save(f, format='JPEG')
+    return f.getvalue()
+
+
+def _get_size(encoded_jpeg):
+  return PIL.Image.open(io.BytesIO(encoded_jpeg)).size
+
+
+class JpegUtilsTest(tf.test.TestCase):
+
+  def test_resize_jpeg(self):
+    encoded_jpeg = jpeg_utils.resize_jpeg(_encode_jpeg(1000, 1600),
+                                          desired_size=400,
+                                          quality=90)
+    self.assertEqual(_get_size(encoded_jpeg), (640, 400))
+
+  def test_resize_jpeg_small_image(self):
+    encoded_jpeg = _encode_jpeg(300, 200)
+    self.assertEqual(jpeg_utils.resize_jpeg(encoded_jpeg), encoded_jpeg)
+
+  def test_jpeg_resizer(self):
+    encoded_jpegs = [_encode_jpeg(800, 800), _encode_jpeg(100, 100)]
+    with jpeg_utils.JpegResizer(desired_size=200, num_workers=2) as resizer:
+      resized_jpegs = resizer.resize(encoded_jpegs)
+    self.assertEqual(_get_size(resized_jpegs[0]), (200, 200))
+    self.assertEqual(resized_jpegs[1], encoded_jpegs[1])
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,122 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from absl import logging
+
+import time
+import collections
+import contextlib
+import multiprocessing
+
+# The shard function and the progress counter are inherited by the forked
+# workers, so that closures over large objects (e.g., annotations) are never
+# pickled.
+_shard_fn = None
+_progress_counter = None
+
+
+def _init_worker(counter):
+  global _progress_counter
+  _progress_counter = counter
+
+
+def _run_shard(shard_id):
+  return _shard_fn(shard_id)
+
+
+def report_progress(num_examples=1):
+  """Reports the number of examples processed by the current worker.
+
+  The skipped examples, e.g., the ones committed by a previous run, count as
+  processed, so that the progress reaches the total given to `run_in_pool`. It
+  is a no-op if not called from a worker of `run_in_pool`.
+
+  Args:
+    num_examples: Number of examples processed since the last call.
+  """
+  if _progress_counter is not None:
+    with _progress_counter.get_lock():
+      _progress_counter.value += num_examples
+
+
+def _log_progress(num_processed, num_examples, start_time):
+  elapsed = max(time.time() - start_time, 1e-8)
+  if num_examples:
+    logging.info('Processed %i/%i examples (%.1lf%%), %.2lf examples/sec.',
+                 num_processed, num_examples,
+                 100.0 * num_processed / num_examples, num_processed / elapsed)
+  else:
+    logging.info('Processed %i examples, %.2lf examples/sec.', num_processed,
+                 num_processed / elapsed)
+
+
+def run_in_pool(shard_fn,
+                num_shards,
+                num_workers,
+                num_examples=None,
+                log_every_secs=30):
+  """Runs `shard_fn` over all the shards using a pool of forked processes.
+
+  Args:
+    shard_fn: A callable taking the shard id, which writes the shard and calls
+      `report_progress` as examples are processed, written or skipped.
+    num_shards: Total number of shards.
+    num_workers: Number of worker processes.
+    num_examples: Total number of examples, used to report the progress.
+    log_every_secs: Frequency of logging the overall progress.
+
+  Returns:
+    A list of the results of `shard_fn`, ordered by shard id.
+  """
+  global _shard_fn
+  _shard_fn = shard_fn
+
+  context = multiprocessing.get_context('fork')
+  counter = context.Value('l', 0)
+  pool = context.Pool(num_workers,
+                      initializer=_init_worker,
+                      initargs=(counter,))
+
+  start_time = time.time()
+  try:
+    async_results = pool.map_async(_run_shard, range(num_shards), chunksize=1)
+    while not async_results.ready():
+      async_results.wait(log_every_secs)
+      _log_progress(counter.value, num_examples, start_time)
+    results = async_results.get()
+  finally:
+    pool.close()
+    pool.join()
+    _shard_fn = None
+
+  logging.info('Finished %i shards using %i workers.', num_shards, num_workers)
+  _log_progress(counter.value, num_examples, start_time)
+  return results
+
+
+class StageTimer(object):
+  """Accumulates the wall time spent in each stage of a pipeline."""
+
+  def __init__(self):
+    self._elapsed = collections.OrderedDict()
+    self._counts = collections.OrderedDict()
+
+  @contextlib.contextmanager
+  def time(self, stage):
+    """Times the enclosed block as one call of `stage`."""
+    start_time = time.time()
+    try:
+      yield
+    finally:
+      self._elapsed[stage] = (self._elapsed.get(stage, 0.0) + time.time() -
+                              start_time)
+      self._counts[stage] = self._counts.get(stage, 0) + 1
+
+  def log(self, prefix=''):
+    """Logs the total and per-call time of each stage."""
+    total = max(sum(self._elapsed.values()), 1e-8)
+    for stage, elapsed in self._elapsed.items():
+      logging.info('%s%s: %.2lfs (%.1lf%%), %.3lfms per call.', prefix, stage,
+                   elapsed, 100.0 * elapsed / total,
+                   1000.0 * elapsed / self._counts[stage])
@@ -0,0 +1,28 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+from readers import parallel
+
+
+class ParallelTest(tf.test.TestCase):
+
+  def test_run_in_pool(self):
+    data = [list(range(i + 1)) for i in range(5)]
+
+    def _shard_fn(shard_id):
+      for _ in data[shard_id]:
+        parallel.report_progress()
+      return sum(data[shard_id])
+
+    results = parallel.run_in_pool(_shard_fn, 5, 2, num_examples=15)
+    self.assertAllEqual(results, [0, 1, 3, 6, 10])
+
+  def test_report_progress_outside_pool(self):
+    parallel.report_progress(10)
+
+
+if __name__ == '__main__':
+  tf.test.main()
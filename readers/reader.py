@@ -14,12 +14,14 @@ _READERS = {
 }
 
 
-def get_input_fn(options, is_training):
+def get_input_fn(options, is_training, input_fields=None):
   """Returns a function that generate input examples.
 
   Args:
     options: an instance of reader_pb2.Reader.
     is_training: If true, shuffle the dataset.
+    input_fields: A collection of the input fields consumed by the model, see
+      `builder.get_required_input_fields`. None to decode all the fields.
 
   Returns:
     input_fn: a callable that returns a dataset.
@@ -32,4 +34,5 @@ def get_input_fn(options, is_training):
     raise ValueError('Invalid reader %s!' % reader_oneof)
 
   return _READERS[reader_oneof].get_input_fn(getattr(options, reader_oneof),
-                                             is_training=is_training)
+                                             is_training=is_training,
+                                             input_fields=input_fields)
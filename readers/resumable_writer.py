@@ -0,0 +1,221 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import re
+import zlib
+import collections
+import tensorflow as tf
+
+_TEMP_SUFFIX = '.tmp'
+_CHUNK_SUFFIX = '.chunk'
+_MANIFEST_SUFFIX = '.manifest'
+
+# A record is framed by its uint64 length, the crc of the length and the crc
+# of the data, see tensorflow/core/lib/io/record_writer.cc.
+_RECORD_OVERHEAD = 16
+
+# Number of keys buffered before a commit.
+_COMMIT_EVERY = 100
+
+
+def _checksum(data):
+  return zlib.crc32(data) & 0xffffffff
+
+
+def check_local_path(path):
+  """Checks that `path` is on the local file system.
+
+  Resuming truncates and syncs the files in place, which the gfile file
+  systems, e.g., `gs://`, do not support.
+
+  Args:
+    path: An output path.
+
+  Raises:
+    ValueError: If `path` has a file system scheme.
+  """
+  if re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*://', path):
+    raise ValueError('Only local output paths are supported, got %s. Write '
+                     'to a local directory, then copy the complete shards.' %
+                     path)
+
+
+class Manifest(object):
+  """An append-only log of the committed entries of a shard.
+
+  Each line holds a key followed by tab-separated fields. Lines are flushed and
+  synced in batches, and a partially written last line is ignored on load.
+  """
+
+  def __init__(self, path):
+    """Loads the committed entries and opens the manifest for appending.
+
+    Args:
+      path: Path to the manifest file.
+    """
+    check_local_path(path)
+    self._entries = collections.OrderedDict()
+    num_bytes = 0
+    if os.path.isfile(path):
+      with open(path, 'rb') as f:
+        for line in f:
+          if not line.endswith(b'\n'):
+            break  # Partially written line.
+          fields = line.decode('utf8').rstrip('\n').split('\t')
+          self._entries[fields[0]] = tuple(fields[1:])
+          num_bytes += len(line)
+
+    # Drop the partially written line, if any.
+    self._file = open(path, 'ab')
+    self._file.truncate(num_bytes)
+    self._file.seek(0, os.SEEK_END)
+
+  def __contains__(self, key):
+    return key in self._entries
+
+  def __len__(self):
+    return len(self._entries)
+
+  def get(self, key):
+    return self._entries[key]
+
+  def last(self):
+    """Returns the last committed (key, fields), or None if empty."""
+    if not self._entries:
+      return None
+    key = next(reversed(self._entries))
+    return key, self._entries[key]
+
+  def add_all(self, entries):
+    """Commits a batch of entries.
+
+    Args:
+      entries: A list of (key, fields) tuples, fields being a tuple of values.
+    """
+    for key, fields in entries:
+      fields = tuple(str(x) for x in fields)
+      self._file.write(('\t'.join((key,) + fields) + '\n').encode('utf8'))
+      self._entries[key] = fields
+    self._file.flush()
+    os.fsync(self._file.fileno())
+
+  def close(self):
+    self._file.close()
+
+
+def is_complete(path):
+  """Returns true if the shard at `path` has been committed and renamed."""
+  return os.path.isfile(path)
+
+
+class ResumableTFRecordWriter(object):
+  """Writes a tfrecord shard that survives restarts.
+
+  Records are appended to a temporary file in chunks. After a chunk is synced,
+  the manifest commits the key, the byte range and the checksum of the records
+  of each key. A restarted writer truncates the temporary file to the last
+  committed offset and skips the committed keys. `close` renames the temporary
+  file to `path`, so a shard is either complete or absent.
+  """
+
+  def __init__(self, path, commit_every=_COMMIT_EVERY):
+    """Initializes the writer, resuming from the committed keys.
+
+    Args:
+      path: Path to the output tfrecord file.
+      commit_every: Number of keys buffered before a commit.
+    """
+    check_local_path(path)
+    if is_complete(path):
+      raise ValueError('The shard %s is already complete.' % path)
+
+    self._path = path
+    self._temp_path = path + _TEMP_SUFFIX
+    self._commit_every = commit_every
+    self._buffer = []
+    self._buffered_keys = set()
+
+    self._manifest = Manifest(path + _MANIFEST_SUFFIX)
+    self._num_bytes = 0
+    last = self._manifest.last()
+    if last is not None:
+      _, (start, end, checksum) = last
+      self._num_bytes = int(end)
+
+    # Drop the records that were not committed to the manifest.
+    self._temp_file = open(self._temp_path, 'ab')
+    if os.path.getsize(self._temp_path) < self._num_bytes:
+      raise ValueError('The temporary file of %s is shorter than the manifest.'
+                       % path)
+    self._temp_file.truncate(self._num_bytes)
+    self._temp_file.seek(0, os.SEEK_END)
+
+    if last is not None:
+      with open(self._temp_path, 'rb') as f:
+        f.seek(int(start))
+        if _checksum(f.read(int(end) - int(start))) != int(checksum):
+          raise ValueError('Checksum mismatch of %s in %s.' %
+                           (last[0], self._temp_path))
+
+  def __contains__(self, key):
+    return key in self._manifest
+
+  def __len__(self):
+    return len(self._manifest)
+
+  def add(self, key, serialized_examples):
+    """Adds the serialized examples of a key.
+
+    Args:
+      key: A string, e.g., the annot_id.
+      serialized_examples: A list of serialized tf.train.Example protos.
+    """
+    if key in self._manifest or key in self._buffered_keys:
+      raise ValueError('The key %s is already added.' % key)
+    self._buffer.append((key, serialized_examples))
+    self._buffered_keys.add(key)
+    if len(self._buffer) >= self._commit_every:
+      self.commit()
+
+  def commit(self):
+    """Appends the buffered records and commits them to the manifest."""
+    if not self._buffer:
+      return
+
+    chunk_path = self._temp_path + _CHUNK_SUFFIX
+    writer = tf.io.TFRecordWriter(chunk_path)
+    for _, serialized_examples in self._buffer:
+      for serialized_example in serialized_examples:
+        writer.write(serialized_example)
+    writer.close()
+    with open(chunk_path, 'rb') as f:
+      data = f.read()
+    os.remove(chunk_path)
+
+    entries = []
+    offset = 0
+    for key, serialized_examples in self._buffer:
+      size = sum(len(x) + _RECORD_OVERHEAD for x in serialized_examples)
+      checksum = _checksum(data[offset:offset + size])
+      entries.append((key, (self._num_bytes + offset,
+                            self._num_bytes + offset + size, checksum)))
+      offset += size
+    assert offset == len(data), 'Unexpected tfrecord framing.'
+
+    self._temp_file.write(data)
+    self._temp_file.flush()
+    os.fsync(self._temp_file.fileno())
+    self._manifest.add_all(entries)
+
+    self._num_bytes += len(data)
+    self._buffer = []
+    self._buffered_keys = set()
+
+  def close(self):
+    """Commits the remaining records and publishes the shard."""
+    self.commit()
+    self._temp_file.close()
+    self._manifest.close()
+    os.rename(self._temp_path, self._path)
@@ -0,0 +1,118 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import tempfile
+import tensorflow as tf
+
+from readers import resumable_writer
+
+
+class ResumableWriterTest(tf.test.TestCase):
+
+  def setUp(self):
+    self._path = os.path.join(tempfile.mkdtemp(), 'val.record-00000-of-00001')
+
+  def _read_records(self):
+    return list(tf.compat.v1.io.tf_record_iterator(self._path))
+
+  def test_write(self):
+    writer = resumable_writer.ResumableTFRecordWriter(self._path,
+                                                      commit_every=2)
+    for i in range(5):
+      writer.add('val-%i' % i, [b'record-%i' % i])
+    self.assertFalse(resumable_writer.is_complete(self._path))
+    writer.close()
+
+    self.assertTrue(resumable_writer.is_complete(self._path))
+    self.assertFalse(os.path.isfile(self._path + '.tmp'))
+    self.assertAllEqual(self._read_records(),
+                        [b'record-%i' % i for i in range(5)])
+
+  def test_resume(self):
+    writer = resumable_writer.ResumableTFRecordWriter(self._path,
+                                                      commit_every=2)
+    for i in range(5):
+      writer.add('val-%i' % i, [b'record-%i' % i, b'variant-%i' % i])
+
+    # Simulate a crash, leaving partially written records and manifest lines.
+    with open(self._path + '.tmp', 'ab') as f:
+      f.write(b'partial')
+    with open(self._path + '.manifest', 'a') as f:
+      f.write('val-4\t')
+    del writer
+
+    writer = resumable_writer.ResumableTFRecordWriter(self._path,
+                                                      commit_every=2)
+    self.assertEqual(len(writer), 4)
+    self.assertIn('val-3', writer)
+    self.assertNotIn('val-4', writer)
+    for i in range(4, 6):
+      writer.add('val-%i' % i, [b'record-%i' % i, b'variant-%i' % i])
+    writer.close()
+
+    expected_records = []
+    for i in range(6):
+      expected_records.extend([b'record-%i' % i, b'variant-%i' % i])
+    self.assertAllEqual(self._read_records(), expected_records)
+
+  def test_resume_with_non_ascii_keys(self):
+    writer = resumable_writer.ResumableTFRecordWriter(self._path,
+                                                      commit_every=1)
+    for i in range(3):
+      writer.add(u'val-\u00e9t\u00e9-%i' % i, [b'record-%i' % i])
+
+    # Simulate a crash, leaving a partially written manifest line.
+    with open(self._path + '.manifest', 'ab') as f:
+      f.write(u'val-\u00e9t\u00e9-3\t'.encode('utf8'))
+    del writer
+
+    writer = resumable_writer.ResumableTFRecordWriter(self._path,
+                                                      commit_every=1)
+    self.assertEqual(len(writer), 3)
+    self.assertIn(u'val-\u00e9t\u00e9-2', writer)
+    writer.add(u'val-\u00e9t\u00e9-3', [b'record-3'])
+    writer.close()
+
+    self.assertAllEqual(self._read_records(),
+                        [b'record-%i' % i for i in range(4)])
+    self.assertLen(resumable_writer.Manifest(self._path + '.manifest'), 4)
+
+  def test_duplicate_key(self):
+    writer = resumable_writer.ResumableTFRecordWriter(self._path,
+                                                      commit_every=2)
+    writer.add('val-0', [b'record-0'])
+    with self.assertRaises(ValueError):
+      writer.add('val-0', [b'record-0'])
+    writer.add('val-1', [b'record-1'])
+    with self.assertRaises(ValueError):
+      writer.add('val-0', [b'record-0'])
+
+  def test_checksum_mismatch(self):
+    writer = resumable_writer.ResumableTFRecordWriter(self._path,
+                                                      commit_every=1)
+    writer.add('val-0', [b'record-0'])
+    del writer
+
+    with open(self._path + '.tmp', 'r+b') as f:
+      f.seek(-6, os.SEEK_END)
+      f.write(b'X')
+    with self.assertRaises(ValueError):
+      resumable_writer.ResumableTFRecordWriter(self._path)
+
+  def test_complete(self):
+    resumable_writer.ResumableTFRecordWriter(self._path).close()
+    with self.assertRaises(ValueError):
+      resumable_writer.ResumableTFRecordWriter(self._path)
+
+  def test_non_local_path(self):
+    with self.assertRaises(ValueError):
+      resumable_writer.ResumableTFRecordWriter('gs://bucket/val.record')
+    with self.assertRaises(ValueError):
+      resumable_writer.check_local_path('gs://bucket/val.record')
+    resumable_writer.check_local_path(self._path)
+
+
+if __name__ == '__main__':
+  tf.test.main()
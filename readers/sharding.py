@@ -0,0 +1,152 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+from protos import reader_pb2
+
+# Seed of the file shuffling when the records are sharded, all the shards have
+# to visit the files in the same order to keep the shards disjoint.
+_DATA_SHARDING_SEED = 6174
+
+# annot_id of the examples padding the last batch, see `pad_last_batch`.
+PADDING_ANNOT_ID = ''
+
+
+def get_shard(options, input_pipeline_context=None):
+  """Returns the shard read by this input pipeline.
+
+  The process shards of `options.sharding` are further divided among the input
+  pipelines of a tf.distribute strategy.
+
+  Args:
+    options: A reader proto having a `sharding` field.
+    input_pipeline_context: A tf.distribute.InputContext instance.
+
+  Returns:
+    A (num_shards, shard_id) tuple.
+  """
+  num_shards = options.sharding.num_shards
+  shard_id = options.sharding.shard_id
+  if not 0 <= shard_id < num_shards:
+    raise ValueError('Invalid shard %i of %i.' % (shard_id, num_shards))
+
+  if input_pipeline_context:
+    num_shards *= input_pipeline_context.num_input_pipelines
+    shard_id = (shard_id * input_pipeline_context.num_input_pipelines +
+                input_pipeline_context.input_pipeline_id)
+  return num_shards, shard_id
+
+
+def get_policy(options, num_files, num_shards):
+  """Resolves the AUTO sharding policy.
+
+  Args:
+    options: A reader proto having a `sharding` field.
+    num_files: Number of input files.
+    num_shards: Total number of shards.
+
+  Returns:
+    Either reader_pb2.Sharding.FILE or reader_pb2.Sharding.DATA.
+  """
+  policy = options.sharding.policy
+  if policy == reader_pb2.Sharding.AUTO:
+    if num_files >= num_shards:
+      return reader_pb2.Sharding.FILE
+    return reader_pb2.Sharding.DATA
+  return policy
+
+
+def read_records(options, is_training, shard=(1, 0)):
+  """Reads the serialized records of a shard.
+
+  Args:
+    options: A reader proto, e.g., reader_pb2.VCRReader.
+    is_training: If true, shuffle and repeat the input files.
+    shard: A (num_shards, shard_id) tuple, see `get_shard`.
+
+  Returns:
+    A tf.data.Dataset of scalar string tensors.
+  """
+  filenames = set()
+  for input_pattern in options.input_pattern:
+    filenames.update(tf.io.gfile.glob(input_pattern))
+  if not filenames:
+    raise ValueError('No input file matches %s.' %
+                     ','.join(options.input_pattern))
+  filenames = sorted(filenames)
+
+  num_shards, shard_id = shard
+  policy = get_policy(options, len(filenames), num_shards)
+  if num_shards > 1 and policy == reader_pb2.Sharding.FILE:
+    if len(filenames) < num_shards:
+      raise ValueError('Can not shard %i files among %i shards.' %
+                       (len(filenames), num_shards))
+    filenames = filenames[shard_id::num_shards]
+
+  # The shards read the same records in the DATA mode.
+  seed = None
+  if num_shards > 1 and policy == reader_pb2.Sharding.DATA:
+    seed = _DATA_SHARDING_SEED
+
+  dataset = tf.data.Dataset.from_tensor_slices(filenames)
+  if is_training:
+    dataset = dataset.shuffle(len(filenames), seed=seed)
+    if getattr(options, 'cache_dataset', False):
+      dataset = dataset.cache()
+    dataset = dataset.repeat()
+    dataset = dataset.shuffle(options.shuffle_buffer_size, seed=seed)
+
+  cycle_length = options.interleave_cycle_length
+  if options.deterministic and not is_training:
+    cycle_length = 1
+  dataset = dataset.interleave(tf.data.TFRecordDataset,
+                               cycle_length=cycle_length)
+
+  if num_shards > 1 and policy == reader_pb2.Sharding.DATA:
+    dataset = dataset.shard(num_shards, shard_id)
+
+  if options.deterministic and not is_training:
+    dataset_options = tf.data.Options()
+    dataset_options.experimental_deterministic = True
+    dataset = dataset.with_options(dataset_options)
+  return dataset
+
+
+def pad_last_batch(dataset, batch_size):
+  """Pads the last partial batch to `batch_size`.
+
+  The models rely on a static batch size, so the evaluation drops the last
+  partial batch of each shard, i.e., up to `batch_size - 1` examples per
+  shard. Instead, the partial batch is filled with copies of its first
+  example, whose `annot_id` is set to PADDING_ANNOT_ID to be removed from the
+  results.
+
+  Args:
+    dataset: A tf.data.Dataset of batches that are not padded, i.e., batched
+      with `drop_remainder=False`, having a top-level `annot_id` field.
+    batch_size: The static batch size.
+
+  Returns:
+    A tf.data.Dataset of batches of `batch_size` examples.
+  """
+
+  def _pad(batch):
+    num_examples = tf.shape(batch['annot_id'])[0]
+    indices = tf.concat(
+        [tf.range(num_examples),
+         tf.zeros([batch_size - num_examples], tf.int32)], 0)
+
+    def _gather(value):
+      value = tf.gather(value, indices)
+      value.set_shape([batch_size] + value.shape.as_list()[1:])
+      return value
+
+    batch = tf.nest.map_structure(_gather, batch)
+    batch['annot_id'] = tf.where(
+        tf.range(batch_size) < num_examples, batch['annot_id'],
+        tf.fill([batch_size], PADDING_ANNOT_ID))
+    return batch
+
+  return dataset.map(_pad)
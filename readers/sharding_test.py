@@ -0,0 +1,103 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import tempfile
+import tensorflow as tf
+
+from protos import reader_pb2
+from readers import sharding
+
+tf.compat.v1.enable_eager_execution()
+
+
+class _InputContext(object):
+
+  def __init__(self, num_input_pipelines, input_pipeline_id):
+    self.num_input_pipelines = num_input_pipelines
+    self.input_pipeline_id = input_pipeline_id
+
+
+class ShardingTest(tf.test.TestCase):
+
+  def setUp(self):
+    input_dir = tempfile.mkdtemp()
+    for file_id in range(3):
+      filename = os.path.join(input_dir, 'val.record-%i' % file_id)
+      with tf.io.TFRecordWriter(filename) as writer:
+        for record_id in range(4):
+          writer.write(('%i-%i' % (file_id, record_id)).encode('utf8'))
+
+    self._options = reader_pb2.VCRReader(
+        input_pattern=[os.path.join(input_dir, 'val.record-*')],
+        interleave_cycle_length=2,
+        deterministic=True)
+
+  def _read(self, shard):
+    dataset = sharding.read_records(self._options, False, shard)
+    return [x.decode('utf8') for x in dataset.as_numpy_iterator()]
+
+  def test_get_shard(self):
+    options = reader_pb2.VCRReader()
+    self.assertEqual(sharding.get_shard(options), (1, 0))
+
+    options.sharding.num_shards = 2
+    options.sharding.shard_id = 1
+    self.assertEqual(sharding.get_shard(options), (2, 1))
+    self.assertEqual(sharding.get_shard(options, _InputContext(3, 2)), (6, 5))
+
+    options.sharding.shard_id = 2
+    with self.assertRaises(ValueError):
+      sharding.get_shard(options)
+
+  def test_get_policy(self):
+    options = reader_pb2.VCRReader()
+    self.assertEqual(sharding.get_policy(options, 4, 4),
+                     reader_pb2.Sharding.FILE)
+    self.assertEqual(sharding.get_policy(options, 3, 4),
+                     reader_pb2.Sharding.DATA)
+
+    options.sharding.policy = reader_pb2.Sharding.DATA
+    self.assertEqual(sharding.get_policy(options, 4, 2),
+                     reader_pb2.Sharding.DATA)
+
+  def test_deterministic_order(self):
+    self.assertAllEqual(self._read((1, 0)), [
+        '%i-%i' % (file_id, record_id)
+        for file_id in range(3)
+        for record_id in range(4)
+    ])
+
+  def test_file_sharding(self):
+    self._options.sharding.policy = reader_pb2.Sharding.FILE
+    self.assertAllEqual(self._read((2, 0)), [
+        '%i-%i' % (file_id, record_id)
+        for file_id in [0, 2]
+        for record_id in range(4)
+    ])
+    with self.assertRaises(ValueError):
+      self._read((4, 0))
+
+  def test_data_sharding(self):
+    # AUTO falls back to DATA with more shards than files.
+    records = [self._read((4, shard_id)) for shard_id in range(4)]
+    self.assertAllEqual(records[1], ['0-1', '1-1', '2-1'])
+    self.assertCountEqual(sum(records, []), self._read((1, 0)))
+
+  def test_pad_last_batch(self):
+    dataset = tf.data.Dataset.from_tensor_slices({
+        'annot_id': ['val-%i' % i for i in range(5)],
+        'question': {
+            'length': tf.range(5)
+        },
+    }).batch(3)
+    batches = list(sharding.pad_last_batch(dataset, 3).as_numpy_iterator())
+
+    self.assertEqual(len(batches), 2)
+    self.assertAllEqual(batches[1]['annot_id'], [b'val-3', b'val-4', b''])
+    self.assertAllEqual(batches[1]['question']['length'], [3, 4, 3])
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,199 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+from readers.vcr_fields import InputFields
+from readers.vcr_fields import STATIC_PADDING_FIELDS
+
+_DETECTION_FIELDS = [
+    InputFields.detection_boxes,
+    InputFields.detection_classes,
+    InputFields.detection_scores,
+    InputFields.detection_features,
+]
+
+# The text fields, as (tokens, tags, lengths) tuples.
+_TEXT_FIELDS = [
+    (InputFields.question, InputFields.question_tag, InputFields.question_len),
+    (InputFields.answer_choices, InputFields.answer_choices_tag,
+     InputFields.answer_choices_len),
+    (InputFields.rationale_choices, InputFields.rationale_choices_tag,
+     InputFields.rationale_choices_len),
+]
+
+# The sequences fed to BERT, starting with the question shared by the choices.
+# The truncated tokens are counted on them.
+_MIXED_FIELDS = [
+    (InputFields.mixed_answer_choices, InputFields.mixed_answer_choices_tag,
+     InputFields.mixed_answer_choices_len),
+    (InputFields.mixed_rationale_choices,
+     InputFields.mixed_rationale_choices_tag,
+     InputFields.mixed_rationale_choices_len),
+]
+
+
+def _fit_image(image, height, width):
+  """Resizes the image to fit in the canvas, keeping the aspect ratio.
+
+  Args:
+    image: A [image_height, image_width, 3] uint8 tensor.
+    height: Height of the canvas.
+    width: Width of the canvas.
+
+  Returns:
+    image: The image, resized only if it is larger than the canvas.
+    resized: A scalar int tensor, 1 if the image is resized.
+  """
+  image_shape = tf.cast(tf.shape(image)[:2], tf.float32)
+  scale = tf.reduce_min(tf.constant([height, width], tf.float32) / image_shape)
+
+  def _resize_fn():
+    new_size = tf.cast(tf.math.floor(scale * image_shape), tf.int32)
+    return tf.cast(tf.image.resize(image, new_size), tf.uint8)
+
+  image = tf.cond(scale < 1.0, true_fn=_resize_fn, false_fn=lambda: image)
+  image.set_shape([None, None, 3])
+  return image, tf.cast(scale < 1.0, tf.int32)
+
+
+def _truncate_mixed_sequences(example, max_seq_len):
+  """Truncates the mixed sequences, dropping the tail of the shared question.
+
+  The choice, the only part telling the sequences apart, is kept. The same
+  question tokens are dropped from all the sequences, as few as required for
+  the longest sequence to fit, and the question fields are updated
+  accordingly. The choices are truncated only if the question is dropped
+  entirely.
+
+  Args:
+    example: A dictionary of the tensors of an example.
+    max_seq_len: Length of the text sequences.
+
+  Returns:
+    example: The same dictionary, with the truncated tensors.
+    num_truncated_tokens: A scalar int tensor, total number of tokens dropped
+      from the mixed sequences.
+  """
+  num_truncated_tokens = tf.constant(0)
+  mixed_fields = [x for x in _MIXED_FIELDS if x[0] in example]
+  if not mixed_fields:
+    return example, num_truncated_tokens
+
+  # The question is tiled, one copy for each choice.
+  question_len = example[InputFields.question_len][0]
+  max_len = tf.reduce_max(
+      [tf.reduce_max(example[len_name]) for _, _, len_name in mixed_fields])
+  num_dropped = tf.clip_by_value(max_len - max_seq_len, 0, question_len)
+  kept_question_len = question_len - num_dropped
+
+  for tokens_name, tag_name, len_name in mixed_fields:
+    # Indices of the kept tokens, skipping the dropped question tokens.
+    indices = tf.range(tf.shape(example[tokens_name])[-1] - num_dropped)
+    indices = tf.where(indices < kept_question_len, indices,
+                       indices + num_dropped)
+
+    tokens = tf.gather(example[tokens_name], indices, axis=-1)
+    tags = tf.gather(example[tag_name], indices, axis=-1)
+
+    lengths = example[len_name]
+    truncated_lengths = tf.minimum(lengths - num_dropped, max_seq_len)
+    num_truncated_tokens += tf.reduce_sum(lengths - truncated_lengths)
+
+    example.update({
+        tokens_name: tokens[..., :max_seq_len],
+        tag_name: tags[..., :max_seq_len],
+        len_name: truncated_lengths,
+    })
+
+  example.update({
+      InputFields.question:
+          example[InputFields.question][..., :kept_question_len],
+      InputFields.question_tag:
+          example[InputFields.question_tag][..., :kept_question_len],
+      InputFields.question_len:
+          example[InputFields.question_len] - num_dropped,
+  })
+  return example, num_truncated_tokens
+
+
+def truncate_example(example, options):
+  """Truncates an example to the sizes of the static padding.
+
+  The mixed sequences are truncated by dropping question tokens, see
+  `_truncate_mixed_sequences`. The statistics of the truncation are added to
+  the example, namely the number of truncated tokens of the mixed sequences,
+  the number of dropped detections and whether the image is resized.
+
+  Args:
+    example: A dictionary of the tensors of an example.
+    options: A reader_pb2.StaticPadding proto.
+
+  Returns:
+    The same dictionary, with the truncated tensors.
+  """
+  # Text sequences.
+  max_seq_len = options.max_seq_len
+  example, num_truncated_tokens = _truncate_mixed_sequences(
+      example, max_seq_len)
+  for tokens_name, tag_name, len_name in _TEXT_FIELDS:
+    if tokens_name not in example:
+      continue
+    example.update({
+        tokens_name: example[tokens_name][..., :max_seq_len],
+        tag_name: example[tag_name][..., :max_seq_len],
+        len_name: tf.minimum(example[len_name], max_seq_len),
+    })
+
+  # Detections, the tags referring to the dropped detections are handled by
+  # the models, see `preprocess_tags`.
+  num_detections = example[InputFields.num_detections]
+  truncated_num_detections = tf.minimum(num_detections,
+                                        options.max_num_detections)
+  for name in _DETECTION_FIELDS:
+    if name in example:
+      example[name] = example[name][:options.max_num_detections]
+
+  example.update({
+      InputFields.num_detections: truncated_num_detections,
+      InputFields.num_truncated_tokens: num_truncated_tokens,
+      InputFields.num_truncated_detections:
+          num_detections - truncated_num_detections,
+  })
+
+  # Image.
+  if InputFields.img_data in example:
+    image, resized = _fit_image(example[InputFields.img_data],
+                                options.image_height, options.image_width)
+    image_shape = tf.shape(image)
+    example.update({
+        InputFields.img_data: image,
+        InputFields.img_height: image_shape[0],
+        InputFields.img_width: image_shape[1],
+        InputFields.img_resized: resized,
+    })
+  return example
+
+
+def update_padded_shapes(padded_shapes, padding_values, options):
+  """Sets the fixed shapes of the static padding.
+
+  Args:
+    padded_shapes: A dictionary of the padded shapes keyed by name, in which
+      the dynamic dimensions are None.
+    padding_values: A dictionary of the padding values keyed by name.
+    options: A reader_pb2.StaticPadding proto.
+  """
+  for name, shape in padded_shapes.items():
+    if name == InputFields.img_data:
+      shape = [options.image_height, options.image_width, 3]
+    elif name in _DETECTION_FIELDS:
+      shape = [options.max_num_detections] + shape[1:]
+    else:
+      shape = [options.max_seq_len if x is None else x for x in shape]
+    padded_shapes[name] = shape
+
+  for name in STATIC_PADDING_FIELDS:
+    padded_shapes[name] = []
+    padding_values[name] = 0
@@ -0,0 +1,111 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+from protos import reader_pb2
+from readers import static_padding
+from readers.vcr_fields import InputFields
+
+tf.compat.v1.enable_eager_execution()
+
+
+class StaticPaddingTest(tf.test.TestCase):
+
+  def setUp(self):
+    self._options = reader_pb2.StaticPadding(max_seq_len=3,
+                                             max_num_detections=2,
+                                             image_height=4,
+                                             image_width=6)
+
+  def test_truncate_example(self):
+    example = static_padding.truncate_example(
+        {
+            InputFields.img_data: tf.zeros([8, 6, 3], tf.uint8),
+            InputFields.num_detections: tf.constant(3),
+            InputFields.detection_boxes: tf.zeros([3, 4]),
+            InputFields.detection_scores: tf.constant([0.9, 0.8, 0.7]),
+            InputFields.answer_choices: tf.ones([4, 5], tf.int32),
+            InputFields.answer_choices_tag: tf.ones([4, 5], tf.int32),
+            InputFields.answer_choices_len: tf.constant([5, 2, 4, 3]),
+        }, self._options)
+
+    self.assertAllEqual(example[InputFields.answer_choices].shape, [4, 3])
+    self.assertAllEqual(example[InputFields.answer_choices_len], [3, 2, 3, 3])
+    self.assertEqual(example[InputFields.num_truncated_tokens], 0)
+    self.assertEqual(example[InputFields.num_detections], 2)
+    self.assertEqual(example[InputFields.num_truncated_detections], 1)
+    self.assertAllClose(example[InputFields.detection_scores], [0.9, 0.8])
+    self.assertEqual(example[InputFields.img_resized], 1)
+    self.assertAllEqual(example[InputFields.img_data].shape, [4, 3, 3])
+    self.assertEqual(example[InputFields.img_width], 3)
+
+  def test_truncate_mixed_sequences(self):
+    # The question [11, 12, 13, 14] followed by [SEP] and each choice.
+    question, question_tag = [11, 12, 13, 14], [-1, 1, -1, 2]
+    choices = [[21], [31, 32], [41, 42, 43], [51]]
+    choices_tag = [[3], [-1, 4], [5, -1, -1], [-1]]
+
+    def _pad(sequences, pad):
+      return [x + [pad] * (8 - len(x)) for x in sequences]
+
+    example = static_padding.truncate_example(
+        {
+            InputFields.num_detections:
+                tf.constant(0),
+            InputFields.question:
+                tf.constant([question] * 4),
+            InputFields.question_tag:
+                tf.constant([question_tag] * 4),
+            InputFields.question_len:
+                tf.constant([4] * 4),
+            InputFields.mixed_answer_choices:
+                tf.constant(_pad([question + [102] + x for x in choices], 0)),
+            InputFields.mixed_answer_choices_tag:
+                tf.constant(
+                    _pad([question_tag + [-1] + x for x in choices_tag], -1)),
+            InputFields.mixed_answer_choices_len:
+                tf.constant([6, 7, 8, 6]),
+        },
+        reader_pb2.StaticPadding(max_seq_len=6))
+
+    # Two question tokens are dropped, the choices are kept.
+    self.assertAllEqual(example[InputFields.mixed_answer_choices], [
+        [11, 12, 102, 21, 0, 0],
+        [11, 12, 102, 31, 32, 0],
+        [11, 12, 102, 41, 42, 43],
+        [11, 12, 102, 51, 0, 0],
+    ])
+    self.assertAllEqual(example[InputFields.mixed_answer_choices_tag], [
+        [-1, 1, -1, 3, -1, -1],
+        [-1, 1, -1, -1, 4, -1],
+        [-1, 1, -1, 5, -1, -1],
+        [-1, 1, -1, -1, -1, -1],
+    ])
+    self.assertAllEqual(example[InputFields.mixed_answer_choices_len],
+                        [4, 5, 6, 4])
+    self.assertAllEqual(example[InputFields.question], [[11, 12]] * 4)
+    self.assertAllEqual(example[InputFields.question_tag], [[-1, 1]] * 4)
+    self.assertAllEqual(example[InputFields.question_len], [2] * 4)
+    self.assertEqual(example[InputFields.num_truncated_tokens], 8)
+
+  def test_update_padded_shapes(self):
+    padded_shapes = {
+        InputFields.img_data: [None, None, 3],
+        InputFields.detection_boxes: [None, 4],
+        InputFields.mixed_answer_choices: [4, None],
+        InputFields.mixed_answer_choices_len: [4],
+    }
+    padding_values = {}
+    static_padding.update_padded_shapes(padded_shapes, padding_values,
+                                        self._options)
+    self.assertEqual(padded_shapes[InputFields.img_data], [4, 6, 3])
+    self.assertEqual(padded_shapes[InputFields.detection_boxes], [2, 4])
+    self.assertEqual(padded_shapes[InputFields.mixed_answer_choices], [4, 3])
+    self.assertEqual(padded_shapes[InputFields.mixed_answer_choices_len], [4])
+    self.assertEqual(padding_values[InputFields.num_truncated_tokens], 0)
+
+
+if __name__ == '__main__':
+  tf.test.main()
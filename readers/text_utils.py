@@ -0,0 +1,188 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import collections
+import numpy as np
+import tensorflow as tf
+
+GENDER_NEUTRAL_NAMES = [
+    'Casey', 'Riley', 'Jessie', 'Jackie', 'Avery', 'Jaime', 'Peyton', 'Kerry',
+    'Kendall', 'Frankie', 'Pat', 'Quinn'
+]
+MASK = '[MASK]'
+
+_GENDER_NEUTRAL_NAMES = np.array(GENDER_NEUTRAL_NAMES)
+
+
+class WordpieceCache(object):
+  """Caches the wordpiece tokenization of tokens, shared across examples.
+
+  The VCR vocabulary is small compared to the number of token occurrences, so
+  most calls are served from the cache instead of running the greedy
+  longest-match-first wordpiece search again.
+  """
+
+  def __init__(self, bert_tokenizer, max_size=200000):
+    """Initializes the cache.
+
+    Args:
+      bert_tokenizer: A tokenization.FullTokenizer object.
+      max_size: Maximum number of entries, the least recently used ones are
+        evicted first.
+    """
+    self._wordpiece_tokenizer = bert_tokenizer.wordpiece_tokenizer
+    self._max_size = max_size
+    self._cache = collections.OrderedDict()
+    self.num_hits = 0
+    self.num_misses = 0
+
+  def __len__(self):
+    return len(self._cache)
+
+  def tokenize(self, token, do_lower_case):
+    """Tokenizes a token into wordpieces.
+
+    Args:
+      token: A python string.
+      do_lower_case: If true, convert the token to lower case first.
+
+    Returns:
+      A tuple of wordpiece strings.
+    """
+    key = (token, do_lower_case)
+    sub_tokens = self._cache.get(key)
+    if sub_tokens is not None:
+      self._cache.move_to_end(key)
+      self.num_hits += 1
+      return sub_tokens
+
+    self.num_misses += 1
+    sub_tokens = tuple(
+        self._wordpiece_tokenizer.tokenize(
+            token.lower() if do_lower_case else token))
+    self._cache[key] = sub_tokens
+    if len(self._cache) > self._max_size:
+      self._cache.popitem(last=False)
+    return sub_tokens
+
+
+class Vocab(object):
+  """Maps tokens to ids in the same way as token_to_id.TokenToIdLayer."""
+
+  def __init__(self, vocab_file, unk_token_id):
+    """Loads the vocabulary.
+
+    Args:
+      vocab_file: Path to the vocabulary file, in which each line is a token
+        and the line number is the token id.
+      unk_token_id: A number, id of the out-of-vocabulary tokens.
+    """
+    with tf.io.gfile.GFile(vocab_file, 'rb') as f:
+      contents = f.read()
+    self.hash = hashlib.sha256(contents).hexdigest()
+    self._unk_token_id = unk_token_id
+    self._token_to_id = {}
+    tokens = contents.decode('utf8').split('\n')
+    if tokens[-1] == '':
+      tokens.pop()
+    for token_id, token in enumerate(tokens):
+      self._token_to_id.setdefault(token, token_id)
+
+  def __len__(self):
+    return len(self._token_to_id)
+
+  def convert_tokens_to_ids(self, tokens):
+    """Converts a list of tokens to a list of ids."""
+    return [self._token_to_id.get(x, self._unk_token_id) for x in tokens]
+
+
+def fix_tokenizations(sentences,
+                      obj_to_type,
+                      old_det_to_new_ind,
+                      do_lower_case,
+                      wordpiece_cache=None,
+                      masking_offset=None):
+  """Converts tokenized annotations into tokenized sentences, in a batch.
+
+  The object tags of all the sentences are substituted at once using numpy
+  index arrays, and the text tokens are looked up in the wordpiece cache.
+
+  Args:
+    sentences: A list of tokenized sentences with detections collapsed to
+      lists, e.g., the question and the answer and rationale choices.
+    obj_to_type: [person, person, pottedplant] indexed by the labels.
+    old_det_to_new_ind: A mapping from the old indices to the new indices.
+    do_lower_case: If true, convert text to lower case.
+    wordpiece_cache: A WordpieceCache object. If None, the text tokens are kept
+      without wordpiece tokenization.
+    masking_offset: If not None, tags no less than the offset denote masked
+      objects, which are replaced by `[MASK]`; `[MASK]` text tokens are kept as
+      they are.
+
+  Returns:
+    A list of (tokens, tags) tuples, one for each sentence.
+  """
+  # Substitute the object tags of all the sentences.
+  tags = [
+      idx for sentence in sentences for tok in sentence
+      if isinstance(tok, list) for idx in tok
+  ]
+  tags = np.array(tags, dtype=np.int64)
+  masked = np.zeros(tags.shape, dtype=bool)
+  if masking_offset is not None:
+    masked = tags >= masking_offset
+    tags = np.where(masked, tags - masking_offset, tags)
+  if old_det_to_new_ind is not None:
+    tags = np.asarray(old_det_to_new_ind, dtype=np.int64)[tags]
+
+  obj_types = np.asarray(obj_to_type, dtype=np.str_)[tags]
+  names = np.where(
+      obj_types == 'person',
+      _GENDER_NEUTRAL_NAMES[tags % len(GENDER_NEUTRAL_NAMES)], obj_types)
+  if do_lower_case:
+    names = np.char.lower(names)
+  names = np.where(masked, MASK, names).tolist()
+  tags = tags.tolist()
+
+  # Interleave the object names and the text tokens.
+  results = []
+  tag_index = 0
+  for sentence in sentences:
+    tokens, sentence_tags = [], []
+    for tok in sentence:
+      if isinstance(tok, list):
+        end_index = tag_index + len(tok)
+        tokens.extend(names[tag_index:end_index])
+        sentence_tags.extend(tags[tag_index:end_index])
+        tag_index = end_index
+      elif wordpiece_cache is None:
+        tokens.append(tok.lower() if do_lower_case else tok)
+        sentence_tags.append(-1)
+      elif masking_offset is not None and tok == MASK:
+        tokens.append(tok)
+        sentence_tags.append(-1)
+      else:
+        sub_tokens = wordpiece_cache.tokenize(tok, do_lower_case)
+        tokens.extend(sub_tokens)
+        sentence_tags.extend([-1] * len(sub_tokens))
+    results.append((tokens, sentence_tags))
+  return results
+
+
+def normalize_boxes(boxes, image_width, image_height):
+  """Normalizes [xmin, ymin, xmax, ymax, score] boxes by the image size.
+
+  Args:
+    boxes: A [num_boxes, 5] numpy array in pixel coordinates.
+    image_width: Width of the image.
+    image_height: Height of the image.
+
+  Returns:
+    A tuple of python lists (xmin, ymin, xmax, ymax, score).
+  """
+  boxes = np.array(boxes, dtype=np.float64).reshape([-1, 5])
+  boxes[:, :4] /= np.array(
+      [image_width, image_height, image_width, image_height], dtype=np.float64)
+  return tuple(boxes.T.tolist())
@@ -0,0 +1,102 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import tempfile
+import collections
+import numpy as np
+import tensorflow as tf
+
+from readers import text_utils
+
+
+class _FakeWordpieceTokenizer(object):
+
+  def __init__(self):
+    self.num_calls = 0
+
+  def tokenize(self, text):
+    self.num_calls += 1
+    if len(text) <= 4:
+      return [text]
+    return [text[:4], '##' + text[4:]]
+
+
+_FakeBertTokenizer = collections.namedtuple('_FakeBertTokenizer',
+                                            ['wordpiece_tokenizer'])
+
+
+class TextUtilsTest(tf.test.TestCase):
+
+  def test_wordpiece_cache(self):
+    wordpiece_tokenizer = _FakeWordpieceTokenizer()
+    cache = text_utils.WordpieceCache(_FakeBertTokenizer(wordpiece_tokenizer),
+                                      max_size=2)
+
+    self.assertEqual(cache.tokenize('Walking', True), ('walk', '##ing'))
+    self.assertEqual(cache.tokenize('Walking', False), ('Walk', '##ing'))
+    self.assertEqual(cache.tokenize('Walking', True), ('walk', '##ing'))
+    self.assertEqual(wordpiece_tokenizer.num_calls, 2)
+    self.assertEqual((cache.num_hits, cache.num_misses), (1, 2))
+
+    # ('Walking', False) is the least recently used.
+    cache.tokenize('is', True)
+    self.assertEqual(len(cache), 2)
+    cache.tokenize('Walking', False)
+    self.assertEqual(wordpiece_tokenizer.num_calls, 4)
+
+  def test_fix_tokenizations(self):
+    cache = text_utils.WordpieceCache(
+        _FakeBertTokenizer(_FakeWordpieceTokenizer()))
+    obj_to_type = np.array(['[unused400]', 'person', 'dog', 'person'])
+    old_det_to_new_ind = [1, 2, 3]
+
+    results = text_utils.fix_tokenizations(
+        [['Why', 'is', [0, 2], 'Sitting', '?'], [[10001], '[MASK]', 'ok']],
+        obj_to_type,
+        old_det_to_new_ind,
+        do_lower_case=True,
+        wordpiece_cache=cache,
+        masking_offset=10000)
+    self.assertEqual(results, [
+        (['why', 'is', 'riley', 'jackie', 'sitt', '##ing', '?'],
+         [-1, -1, 1, 3, -1, -1, -1]),
+        (['[MASK]', '[MASK]', 'ok'], [2, -1, -1]),
+    ])
+
+  def test_fix_tokenizations_without_wordpiece(self):
+    results = text_utils.fix_tokenizations([['Sitting', [1]], ['Ok']],
+                                           ['[unused400]', 'dog'],
+                                           None,
+                                           do_lower_case=False)
+    self.assertEqual(results, [(['Sitting', 'dog'], [-1, 1]), (['Ok'], [-1])])
+
+  def test_normalize_boxes(self):
+    boxes = np.array([[0, 0, 200, 100, 1], [50, 25, 100, 50, 0.5]])
+    xmin, ymin, xmax, ymax, score = text_utils.normalize_boxes(boxes, 200, 100)
+    self.assertAllClose(xmin, [0, 0.25])
+    self.assertAllClose(ymin, [0, 0.25])
+    self.assertAllClose(xmax, [1, 0.5])
+    self.assertAllClose(ymax, [1, 0.5])
+    self.assertAllClose(score, [1, 0.5])
+    self.assertEqual(boxes[1, 0], 50)
+
+  def test_vocab(self):
+    vocab_file = os.path.join(tempfile.mkdtemp(), 'vocab.txt')
+    with open(vocab_file, 'w') as f:
+      f.write('[PAD]\n[UNK]\n[SEP]\ndog\n##s\n')
+
+    vocab = text_utils.Vocab(vocab_file, unk_token_id=1)
+    self.assertEqual(len(vocab), 5)
+    self.assertEqual(vocab.convert_tokens_to_ids(['dog', '##s', '[SEP]', 'cat']),
+                     [3, 4, 2, 1])
+    self.assertEqual(vocab.hash, text_utils.Vocab(vocab_file, 100).hash)
+
+    with open(vocab_file, 'a') as f:
+      f.write('cat\n')
+    self.assertNotEqual(vocab.hash, text_utils.Vocab(vocab_file, 1).hash)
+
+
+if __name__ == '__main__':
+  tf.test.main()
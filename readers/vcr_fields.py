@@ -34,6 +34,19 @@ class TFExampleFields(object):
   rationale_choice = 'rationale_choice'
   rationale_choice_tag = 'rationale_choice_tag'
 
+  # Token ids, written instead of the tokens by `encode_token_ids`, along with
+  # the hash of the vocabulary.
+  vocab_hash = 'vocab_hash'
+  detection_classes_id = 'image/object/bbox/label_id'
+  question_id = 'question_id'
+  answer_choice_id = 'answer_choice_id'
+  rationale_choice_id = 'rationale_choice_id'
+
+  # Records holding several text variants of the same image, the first variant
+  # uses the fields above and the others are scoped.
+  num_text_variants = 'num_text_variants'
+  text_variant_scope = 'text_variant_%i/'
+
 
 class InputFields(object):
   """Names of the input tensors."""
@@ -77,3 +90,54 @@ class InputFields(object):
   mixed_rationale_choices = 'mixed_rationale_choices'
   mixed_rationale_choices_tag = 'mixed_rationale_choices_tag'
   mixed_rationale_choices_len = 'mixed_rationale_choices_len'
+
+  # Truncation statistics of the static padding.
+  num_truncated_tokens = 'num_truncated_tokens'
+  num_truncated_detections = 'num_truncated_detections'
+  img_resized = 'image_resized'
+
+
+# Fields decoded whatever the model consumes.
+META_FIELDS = (
+    InputFields.img_id,
+    InputFields.annot_id,
+    InputFields.answer_label,
+    InputFields.rationale_label,
+)
+
+# Truncation statistics added by the static padding.
+STATIC_PADDING_FIELDS = (
+    InputFields.num_truncated_tokens,
+    InputFields.num_truncated_detections,
+    InputFields.img_resized,
+)
+
+# Fields requiring to decode the image.
+IMAGE_FIELDS = (
+    InputFields.img_data,
+    InputFields.img_height,
+    InputFields.img_width,
+)
+
+# Fields requiring to decode the rationale choices.
+RATIONALE_FIELDS = (
+    InputFields.rationale_choices,
+    InputFields.rationale_choices_tag,
+    InputFields.rationale_choices_len,
+    InputFields.mixed_rationale_choices,
+    InputFields.mixed_rationale_choices_tag,
+    InputFields.mixed_rationale_choices_len,
+)
+
+# Text fields from which the mixed fields are assembled in the compact mode.
+COMPACT_FIELDS = (
+    InputFields.question,
+    InputFields.question_tag,
+    InputFields.question_len,
+    InputFields.answer_choices,
+    InputFields.answer_choices_tag,
+    InputFields.answer_choices_len,
+    InputFields.rationale_choices,
+    InputFields.rationale_choices_tag,
+    InputFields.rationale_choices_len,
+)
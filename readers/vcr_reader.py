@@ -8,6 +8,11 @@ import tensorflow as tf
 
 from tf_slim import tfexample_decoder
 from protos import reader_pb2
+from readers import dataset_cache
+from readers import image_utils
+from readers import sharding
+from readers import static_padding
+from readers import text_utils
 from readers.vcr_fields import *
 from modeling.layers import token_to_id
 
@@ -34,18 +39,72 @@ def _pad_sequences(sequences, pad=PAD):
   return padded_sequences, tf.stack(lengths)
 
 
-def _update_decoded_example(decoded_example, options):
+def _requires_any(input_fields, fields):
+  """Checks if any of the fields is required, None requires all the fields."""
+  return input_fields is None or any(x in input_fields for x in fields)
+
+
+def _project_fields(decoded_example, options, input_fields):
+  """Keeps the fields consumed by the model.
+
+  Args:
+    decoded_example: A tensor dictionary keyed by name.
+    options: An instance of reader_pb2.Reader.
+    input_fields: A collection of the InputFields consumed by the model, None
+      to keep all the fields.
+
+  Returns:
+    A dictionary of the required fields and the meta fields.
+  """
+  if input_fields is None:
+    return decoded_example
+  kept_fields = set(input_fields).union(META_FIELDS)
+  if options.compact_inputs:
+    kept_fields.update(COMPACT_FIELDS)
+  if options.HasField('static_padding'):
+    kept_fields.update(STATIC_PADDING_FIELDS)
+  return dict((k, v) for k, v in decoded_example.items() if k in kept_fields)
+
+
+def _finalize_example(decoded_example, options, input_fields):
+  """Applies the static padding, then keeps the fields consumed by the model.
+
+  The static padding is applied first, as truncating the mixed sequences
+  requires the question length, whether the model consumes it or not.
+
+  Args:
+    decoded_example: A tensor dictionary keyed by name.
+    options: An instance of reader_pb2.Reader.
+    input_fields: A collection of the InputFields consumed by the model, None
+      to keep all the fields.
+
+  Returns:
+    A dictionary of the required fields and the meta fields.
+  """
+  if options.HasField('static_padding'):
+    decoded_example = static_padding.truncate_example(decoded_example,
+                                                      options.static_padding)
+  return _project_fields(decoded_example, options, input_fields)
+
+
+def _update_decoded_example(decoded_example, options, vocab=None):
   """Updates the decoded example, add size to the varlen feature.
 
   Args:
     decoded_example: A tensor dictionary keyed by name.
     options: An instance of reader_pb2.Reader.
+    vocab: A text_utils.Vocab object if the tokens are decoded as ids.
 
   Returns:
     decoded_example: The same instance with content modified.
   """
-  token_to_id_func = token_to_id.TokenToIdLayer(
-      options.vocab_file, options.out_of_vocabulary_token_id)
+  if vocab is not None:
+    token_to_id_func = lambda x: x
+    pad, sep = PAD_ID, vocab.convert_tokens_to_ids(['[SEP]'])
+  else:
+    token_to_id_func = token_to_id.TokenToIdLayer(
+        options.vocab_file, options.out_of_vocabulary_token_id)
+    pad, sep = PAD, ['[SEP]']
 
   # Number of objects.
   detection_boxes = decoded_example[InputFields.detection_boxes]
@@ -66,20 +125,64 @@ def _update_decoded_example(decoded_example, options):
       decoded_example.pop(TFExampleFields.answer_choice_tag + '_%i' % i)
       for i in range(1, 1 + NUM_CHOICES)
   ]
-  (answer_choices, answer_choices_len) = _pad_sequences(answer_choices_list)
+  (answer_choices,
+   answer_choices_len) = _pad_sequences(answer_choices_list, pad)
   (answer_choices_tag, _) = _pad_sequences(answer_choices_tag_list, -1)
 
-  rationale_choices_list = [
-      decoded_example.pop(TFExampleFields.rationale_choice + '_%i' % i)
-      for i in range(1, 1 + NUM_CHOICES)
-  ]
-  rationale_choices_tag_list = [
-      decoded_example.pop(TFExampleFields.rationale_choice_tag + '_%i' % i)
-      for i in range(1, 1 + NUM_CHOICES)
-  ]
-  (rationale_choices,
-   rationale_choices_len) = _pad_sequences(rationale_choices_list)
-  (rationale_choices_tag, _) = _pad_sequences(rationale_choices_tag_list, -1)
+  # The rationale choices are not decoded if the model does not consume them.
+  decode_rationale = (TFExampleFields.rationale_choice + '_1' in
+                      decoded_example)
+  if decode_rationale:
+    rationale_choices_list = [
+        decoded_example.pop(TFExampleFields.rationale_choice + '_%i' % i)
+        for i in range(1, 1 + NUM_CHOICES)
+    ]
+    rationale_choices_tag_list = [
+        decoded_example.pop(TFExampleFields.rationale_choice_tag + '_%i' % i)
+        for i in range(1, 1 + NUM_CHOICES)
+    ]
+    (rationale_choices,
+     rationale_choices_len) = _pad_sequences(rationale_choices_list, pad)
+    (rationale_choices_tag, _) = _pad_sequences(rationale_choices_tag_list, -1)
+    decoded_example.update({
+        InputFields.rationale_choices:
+            token_to_id_func(rationale_choices),
+        InputFields.rationale_choices_tag:
+            rationale_choices_tag,
+        InputFields.rationale_choices_len:
+            rationale_choices_len,
+    })
+
+  # Image shape, the image is not decoded if the model does not consume it.
+  if InputFields.img_data in decoded_example:
+    image_shape = tf.shape(decoded_example[InputFields.img_data])
+    decoded_example.update({
+        InputFields.img_height: image_shape[0],
+        InputFields.img_width: image_shape[1],
+    })
+
+  decoded_example.update({
+      InputFields.num_detections:
+          num_detections,
+      InputFields.detection_classes:
+          token_to_id_func(detection_classes),
+      InputFields.answer_choices:
+          token_to_id_func(answer_choices),
+      InputFields.answer_choices_tag:
+          answer_choices_tag,
+      InputFields.answer_choices_len:
+          answer_choices_len,
+  })
+
+  if options.compact_inputs:
+    # The question is kept once, the tiled and mixed fields are assembled on
+    # device by sequence_ops.expand_compact_inputs.
+    decoded_example.update({
+        InputFields.question: token_to_id_func(question),
+        InputFields.question_tag: question_tag,
+        InputFields.question_len: question_len,
+    })
+    return decoded_example
 
   # Mixed question -> answer, question-answer -> rationale.
   answer_len = answer_choices_len[decoded_example[InputFields.answer_label]]
@@ -89,59 +192,39 @@ def _update_decoded_example(decoded_example, options):
       InputFields.answer_label]][:answer_len]
 
   mixed_answer_choices_list = [
-      tf.concat([question, ['[SEP]'], x], 0) for x in answer_choices_list
+      tf.concat([question, sep, x], 0) for x in answer_choices_list
   ]
   mixed_answer_choices_tag_list = [
       tf.concat([question_tag, [-1], x], 0) for x in answer_choices_tag_list
   ]
   (mixed_answer_choices,
-   mixed_answer_choices_len) = _pad_sequences(mixed_answer_choices_list)
+   mixed_answer_choices_len) = _pad_sequences(mixed_answer_choices_list, pad)
   (mixed_answer_choices_tag, _) = _pad_sequences(mixed_answer_choices_tag_list,
                                                  pad=-1)
 
-  mixed_rationale_choices_list = [
-      tf.concat([question, ['[SEP]'], answer, ['[SEP]'], x], 0)
-      for x in rationale_choices_list
-  ]
-  mixed_rationale_choices_tag_list = [
-      tf.concat([question_tag, [-1], answer_tag, [-1], x], 0)
-      for x in rationale_choices_tag_list
-  ]
-  (mixed_rationale_choices,
-   mixed_rationale_choices_len) = _pad_sequences(mixed_rationale_choices_list)
-  (mixed_rationale_choices_tag,
-   _) = _pad_sequences(mixed_rationale_choices_tag_list, pad=-1)
-
-  # Image shape.
-  image = decoded_example[InputFields.img_data]
-  image_shape = tf.shape(image)
-
-  # min_size = tf.reduce_min(image_shape[:2])
-  # scale = 1.0 * options.desired_size / tf.cast(min_size, dtype=tf.float32)
-
-  # def resize_fn():
-  #   new_height = scale * tf.cast(image_shape[0], dtype=tf.float32)
-  #   new_width = scale * tf.cast(image_shape[1], dtype=tf.float32)
-  #   new_height = tf.cast(new_height, dtype=tf.int32)
-  #   new_width = tf.cast(new_width, dtype=tf.int32)
-  #   resized_image = tf.image.resize(image,
-  #                                   size=tf.stack([new_height, new_width], 0))
-  #   return tf.cast(resized_image, dtype=tf.uint8)
-
-  # image = tf.cond(scale >= 1.0, true_fn=lambda: image, false_fn=resize_fn)
-  # image_shape = tf.shape(image)
+  if decode_rationale:
+    mixed_rationale_choices_list = [
+        tf.concat([question, sep, answer, sep, x], 0)
+        for x in rationale_choices_list
+    ]
+    mixed_rationale_choices_tag_list = [
+        tf.concat([question_tag, [-1], answer_tag, [-1], x], 0)
+        for x in rationale_choices_tag_list
+    ]
+    (mixed_rationale_choices, mixed_rationale_choices_len) = _pad_sequences(
+        mixed_rationale_choices_list, pad)
+    (mixed_rationale_choices_tag,
+     _) = _pad_sequences(mixed_rationale_choices_tag_list, pad=-1)
+    decoded_example.update({
+        InputFields.mixed_rationale_choices:
+            token_to_id_func(mixed_rationale_choices),
+        InputFields.mixed_rationale_choices_tag:
+            mixed_rationale_choices_tag,
+        InputFields.mixed_rationale_choices_len:
+            mixed_rationale_choices_len,
+    })
 
   decoded_example.update({
-      InputFields.img_data:
-          image,
-      InputFields.img_height:
-          image_shape[0],
-      InputFields.img_width:
-          image_shape[1],
-      InputFields.num_detections:
-          num_detections,
-      InputFields.detection_classes:
-          token_to_id_func(detection_classes),
       InputFields.question:
           tf.tile(tf.expand_dims(token_to_id_func(question), 0),
                   [NUM_CHOICES, 1]),
@@ -151,72 +234,200 @@ def _update_decoded_example(decoded_example, options):
           tf.tile(tf.expand_dims(question_len, 0), [NUM_CHOICES]),
       InputFields.answer_len:
           tf.tile(tf.expand_dims(answer_len, 0), [NUM_CHOICES]),
-      InputFields.answer_choices:
-          token_to_id_func(answer_choices),
-      InputFields.answer_choices_tag:
-          answer_choices_tag,
-      InputFields.answer_choices_len:
-          answer_choices_len,
-      InputFields.rationale_choices:
-          token_to_id_func(rationale_choices),
-      InputFields.rationale_choices_tag:
-          rationale_choices_tag,
-      InputFields.rationale_choices_len:
-          rationale_choices_len,
       InputFields.mixed_answer_choices:
           token_to_id_func(mixed_answer_choices),
       InputFields.mixed_answer_choices_tag:
           mixed_answer_choices_tag,
       InputFields.mixed_answer_choices_len:
           mixed_answer_choices_len,
-      InputFields.mixed_rationale_choices:
-          token_to_id_func(mixed_rationale_choices),
-      InputFields.mixed_rationale_choices_tag:
-          mixed_rationale_choices_tag,
-      InputFields.mixed_rationale_choices_len:
-          mixed_rationale_choices_len,
   })
 
   return decoded_example
 
 
-def _parse_single_example(example, options):
+def _get_token_fields(use_token_ids):
+  """Returns the tf.Example fields of the tokens.
+
+  Args:
+    use_token_ids: If true, the tokens are stored as int64 ids.
+
+  Returns:
+    keys: A tuple of the question, answer_choice and rationale_choice keys.
+    dtype: Data type of the tokens.
+    default_value: Padding of the tokens.
+  """
+  if use_token_ids:
+    return (TFExampleFields.question_id, TFExampleFields.answer_choice_id,
+            TFExampleFields.rationale_choice_id), tf.int64, PAD_ID
+  return (TFExampleFields.question, TFExampleFields.answer_choice,
+          TFExampleFields.rationale_choice), tf.string, PAD
+
+
+def _get_text_keys_to_features(scope='',
+                               use_token_ids=False,
+                               decode_rationale=True):
+  """Returns the `keys_to_features` of a text variant."""
+  ((question_key, answer_choice_key, rationale_choice_key), dtype,
+   _) = _get_token_fields(use_token_ids)
+
+  keys_to_features = {
+      scope + question_key: tf.io.VarLenFeature(dtype),
+      scope + TFExampleFields.question_tag: tf.io.VarLenFeature(tf.int64),
+  }
+  for i in range(1, 1 + NUM_CHOICES):
+    keys_to_features.update({
+        scope + answer_choice_key + '_%i' % i:
+            tf.io.VarLenFeature(dtype),
+        scope + TFExampleFields.answer_choice_tag + '_%i' % i:
+            tf.io.VarLenFeature(tf.int64),
+    })
+    if decode_rationale:
+      keys_to_features.update({
+          scope + rationale_choice_key + '_%i' % i:
+              tf.io.VarLenFeature(dtype),
+          scope + TFExampleFields.rationale_choice_tag + '_%i' % i:
+              tf.io.VarLenFeature(tf.int64),
+      })
+  return keys_to_features
+
+
+def _get_text_items_to_handlers(scope='',
+                                use_token_ids=False,
+                                decode_rationale=True):
+  """Returns the `items_to_handlers` of a text variant.
+
+  The items are named after the token fields, whether the tokens or the token
+  ids are decoded.
+  """
+  ((question_key, answer_choice_key, rationale_choice_key), _,
+   default_value) = _get_token_fields(use_token_ids)
+
+  items_to_handlers = {
+      scope + InputFields.question:
+          tfexample_decoder.Tensor(tensor_key=scope + question_key,
+                                   default_value=default_value),
+      scope + InputFields.question_tag:
+          tfexample_decoder.Tensor(tensor_key=scope +
+                                   TFExampleFields.question_tag,
+                                   default_value=-1),
+  }
+
+  for i in range(1, 1 + NUM_CHOICES):
+    items_to_handlers[scope + TFExampleFields.answer_choice +
+                      '_%i' % i] = tfexample_decoder.Tensor(
+                          tensor_key=scope + answer_choice_key + '_%i' % i,
+                          default_value=default_value)
+
+    tensor_key = scope + TFExampleFields.answer_choice_tag + '_%i' % i
+    items_to_handlers[tensor_key] = tfexample_decoder.Tensor(
+        tensor_key=tensor_key, default_value=-1)
+
+    if decode_rationale:
+      items_to_handlers[scope + TFExampleFields.rationale_choice +
+                        '_%i' % i] = tfexample_decoder.Tensor(
+                            tensor_key=scope + rationale_choice_key + '_%i' % i,
+                            default_value=default_value)
+
+      tensor_key = scope + TFExampleFields.rationale_choice_tag + '_%i' % i
+      items_to_handlers[tensor_key] = tfexample_decoder.Tensor(
+          tensor_key=tensor_key, default_value=-1)
+  return items_to_handlers
+
+
+def _check_num_text_variants(decoded_example, num_text_variants):
+  """Checks that the record has no more text variants than configured.
+
+  Args:
+    decoded_example: A tensor dictionary keyed by name.
+    num_text_variants: Number of text variants expanded by the reader.
+
+  Returns:
+    decoded_example: The same instance, with the `annot_id` depending on the
+      check.
+  """
+  assert_op = tf.debugging.assert_less_equal(
+      decoded_example[TFExampleFields.num_text_variants],
+      num_text_variants,
+      message='The record has more text variants than `num_text_variants`.')
+  with tf.control_dependencies([assert_op]):
+    decoded_example[InputFields.annot_id] = tf.identity(
+        decoded_example[InputFields.annot_id])
+  return decoded_example
+
+
+def _check_vocab_hash(decoded_example, vocab):
+  """Checks that the token ids are encoded using the vocabulary.
+
+  Args:
+    decoded_example: A tensor dictionary keyed by name.
+    vocab: A text_utils.Vocab object.
+
+  Returns:
+    decoded_example: The same instance, with the vocabulary hash removed.
+  """
+  vocab_hash = decoded_example.pop(TFExampleFields.vocab_hash)
+  assert_op = tf.debugging.assert_equal(
+      vocab_hash,
+      vocab.hash,
+      message='The token ids are encoded using a different vocabulary.')
+  with tf.control_dependencies([assert_op]):
+    decoded_example[InputFields.annot_id] = tf.identity(
+        decoded_example[InputFields.annot_id])
+  return decoded_example
+
+
+def _parse_single_example(example, options, vocab=None, input_fields=None):
   """Parses a single tf.Example proto.
 
+  Only the tf.Example features of the `input_fields` are parsed, e.g., the
+  JPEG is not decoded for a model that does not consume the image.
+
   Args:
     example: An Example proto.
     options: An instance of reader_pb2.Reader.
+    vocab: A text_utils.Vocab object. If not None, decode the token ids instead
+      of the tokens.
+    input_fields: A collection of the InputFields consumed by the model, None
+      to decode all the fields.
 
   Returns:
-    A dictionary indexed by tensor name.
+    A dictionary indexed by tensor name. If `num_text_variants` is greater than
+    1, a tuple of (num_variants, variants) instead, where `variants` holds a
+    dictionary for each text variant, all sharing the same decoded image.
   """
+  num_text_variants = options.num_text_variants
+  use_token_ids = vocab is not None
+  decode_image = _requires_any(input_fields, IMAGE_FIELDS)
+  decode_rationale = _requires_any(input_fields, RATIONALE_FIELDS)
+  scopes = [''] + [
+      TFExampleFields.text_variant_scope % i
+      for i in range(1, num_text_variants)
+  ]
+
   # Initialize `keys_to_features`.
   keys_to_features = {
       TFExampleFields.img_id: tf.io.FixedLenFeature([], tf.string),
-      TFExampleFields.img_encoded: tf.io.FixedLenFeature([], tf.string),
-      TFExampleFields.img_format: tf.io.FixedLenFeature([], tf.string),
       TFExampleFields.annot_id: tf.io.FixedLenFeature([], tf.string),
       TFExampleFields.answer_label: tf.io.FixedLenFeature([], tf.int64),
       TFExampleFields.rationale_label: tf.io.FixedLenFeature([], tf.int64),
-      TFExampleFields.detection_classes: tf.io.VarLenFeature(tf.string),
       TFExampleFields.detection_scores: tf.io.VarLenFeature(tf.float32),
-      TFExampleFields.question: tf.io.VarLenFeature(tf.string),
-      TFExampleFields.question_tag: tf.io.VarLenFeature(tf.int64),
   }
-  for bbox_key in TFExampleFields.detection_boxes_keys:
-    bbox_field = os.path.join(TFExampleFields.detection_boxes_scope, bbox_key)
-    keys_to_features[bbox_field] = tf.io.VarLenFeature(tf.float32)
-  for i in range(1, 1 + NUM_CHOICES):
+  if use_token_ids:
     keys_to_features.update({
-        TFExampleFields.answer_choice + '_%i' % i:
-            tf.io.VarLenFeature(tf.string),
-        TFExampleFields.answer_choice_tag + '_%i' % i:
-            tf.io.VarLenFeature(tf.int64),
-        TFExampleFields.rationale_choice + '_%i' % i:
-            tf.io.VarLenFeature(tf.string),
-        TFExampleFields.rationale_choice_tag + '_%i' % i:
+        TFExampleFields.detection_classes_id:
             tf.io.VarLenFeature(tf.int64),
+        TFExampleFields.vocab_hash:
+            tf.io.FixedLenFeature([], tf.string, default_value=''),
     })
+  else:
+    keys_to_features[TFExampleFields.detection_classes] = (
+        tf.io.VarLenFeature(tf.string))
+  for bbox_key in TFExampleFields.detection_boxes_keys:
+    bbox_field = os.path.join(TFExampleFields.detection_boxes_scope, bbox_key)
+    keys_to_features[bbox_field] = tf.io.VarLenFeature(tf.float32)
+  for scope in scopes:
+    keys_to_features.update(
+        _get_text_keys_to_features(scope, use_token_ids, decode_rationale))
 
   # Initialize `items_to_handlers`.
   items_to_handlers = {
@@ -232,44 +443,42 @@ def _parse_single_example(example, options):
       InputFields.rationale_label:
           tfexample_decoder.Tensor(tensor_key=TFExampleFields.rationale_label,
                                    default_value=-1),
-      InputFields.img_data:
-          tfexample_decoder.Image(image_key=TFExampleFields.img_encoded,
-                                  format_key=TFExampleFields.img_format,
-                                  shape=None),
       InputFields.detection_boxes:
           tfexample_decoder.BoundingBox(
               keys=TFExampleFields.detection_boxes_keys,
               prefix=TFExampleFields.detection_boxes_scope),
-      InputFields.detection_classes:
-          tfexample_decoder.Tensor(tensor_key=TFExampleFields.detection_classes,
-                                   default_value=''),
       InputFields.detection_scores:
           tfexample_decoder.Tensor(tensor_key=TFExampleFields.detection_scores,
                                    default_value=0),
-      InputFields.question:
-          tfexample_decoder.Tensor(tensor_key=TFExampleFields.question,
-                                   default_value=PAD),
-      InputFields.question_tag:
-          tfexample_decoder.Tensor(tensor_key=TFExampleFields.question_tag,
-                                   default_value=-1),
   }
-
-  for i in range(1, 1 + NUM_CHOICES):
-    tensor_key = TFExampleFields.answer_choice + '_%i' % i
-    items_to_handlers[tensor_key] = tfexample_decoder.Tensor(
-        tensor_key=tensor_key, default_value=PAD)
-
-    tensor_key = TFExampleFields.answer_choice_tag + '_%i' % i
-    items_to_handlers[tensor_key] = tfexample_decoder.Tensor(
-        tensor_key=tensor_key, default_value=-1)
-
-    tensor_key = TFExampleFields.rationale_choice + '_%i' % i
-    items_to_handlers[tensor_key] = tfexample_decoder.Tensor(
-        tensor_key=tensor_key, default_value=PAD)
-
-    tensor_key = TFExampleFields.rationale_choice_tag + '_%i' % i
-    items_to_handlers[tensor_key] = tfexample_decoder.Tensor(
-        tensor_key=tensor_key, default_value=-1)
+  if decode_image:
+    keys_to_features[TFExampleFields.img_encoded] = tf.io.FixedLenFeature(
+        [], tf.string)
+    items_to_handlers[TFExampleFields.img_encoded] = tfexample_decoder.Tensor(
+        tensor_key=TFExampleFields.img_encoded)
+  if use_token_ids:
+    items_to_handlers.update({
+        InputFields.detection_classes:
+            tfexample_decoder.Tensor(
+                tensor_key=TFExampleFields.detection_classes_id,
+                default_value=PAD_ID),
+        TFExampleFields.vocab_hash:
+            tfexample_decoder.Tensor(tensor_key=TFExampleFields.vocab_hash),
+    })
+  else:
+    items_to_handlers[InputFields.detection_classes] = (
+        tfexample_decoder.Tensor(tensor_key=TFExampleFields.detection_classes,
+                                 default_value=''))
+  for scope in scopes:
+    items_to_handlers.update(
+        _get_text_items_to_handlers(scope, use_token_ids, decode_rationale))
+
+  # Always decoded, so that the variants beyond `num_text_variants` are not
+  # silently dropped.
+  keys_to_features[TFExampleFields.num_text_variants] = (
+      tf.io.FixedLenFeature([], tf.int64, default_value=1))
+  items_to_handlers[TFExampleFields.num_text_variants] = (
+      tfexample_decoder.Tensor(tensor_key=TFExampleFields.num_text_variants))
 
   # Decode example.
   example_decoder = tfexample_decoder.TFExampleDecoder(keys_to_features,
@@ -281,40 +490,164 @@ def _parse_single_example(example, options):
       x if x.dtype != tf.int64 else tf.cast(x, tf.int32) for x in output_tensors
   ]
   decoded_example = dict(zip(output_keys, output_tensors))
-  return _update_decoded_example(decoded_example, options)
+
+  # The image is decoded once, shared by the text variants, and downscaled to
+  # `desired_size` while decoding.
+  if decode_image:
+    decoded_example[InputFields.img_data] = image_utils.decode_image(
+        decoded_example.pop(TFExampleFields.img_encoded), options.desired_size)
+  if use_token_ids:
+    decoded_example = _check_vocab_hash(decoded_example, vocab)
+  decoded_example = _check_num_text_variants(decoded_example,
+                                             num_text_variants)
+  num_variants = decoded_example.pop(TFExampleFields.num_text_variants)
+  if num_text_variants == 1:
+    return _finalize_example(
+        _update_decoded_example(decoded_example, options, vocab), options,
+        input_fields)
+
+  # Split the shared fields and the text fields of each variant.
+  text_fields_list = [
+      dict((item[len(scope):], decoded_example.pop(item))
+           for item in _get_text_items_to_handlers(
+               scope, decode_rationale=decode_rationale))
+      for scope in scopes
+  ]
+
+  variants = []
+  for text_fields in text_fields_list:
+    variant = dict(decoded_example)
+    variant.update(text_fields)
+    variants.append(
+        _finalize_example(_update_decoded_example(variant, options, vocab),
+                          options, input_fields))
+  return num_variants, tuple(variants)
+
+
+def _expand_text_variants(num_variants, variants):
+  """Expands a record into an example per text variant.
+
+  Args:
+    num_variants: A scalar int tensor, number of variants in the record.
+    variants: A tuple of `num_text_variants` dictionaries.
+
+  Returns:
+    A tf.data.Dataset object of the first `num_variants` variants.
+  """
+  dataset = tf.data.Dataset.from_tensors(variants[0])
+  for variant_id, variant in enumerate(variants[1:], 1):
+    dataset = dataset.concatenate(
+        tf.data.Dataset.from_tensors(variant).take(
+            tf.cast(variant_id < num_variants, tf.int64)))
+  return dataset
+
+
+def _get_sequence_length(example):
+  """Returns the length of the longest choice sequence, used for bucketing.
+
+  Args:
+    example: A dictionary of the tensors of an example.
+
+  Returns:
+    A scalar int tensor.
+  """
+  mixed_names = [
+      x for x in (InputFields.mixed_answer_choices_len,
+                  InputFields.mixed_rationale_choices_len) if x in example
+  ]
+  if mixed_names:
+    return tf.reduce_max([tf.reduce_max(example[x]) for x in mixed_names])
+
+  # Compact inputs, the question is prepended on device.
+  return example[InputFields.question_len] + tf.add_n([
+      tf.reduce_max(example[x])
+      for x in (InputFields.answer_choices_len,
+                InputFields.rationale_choices_len) if x in example
+  ])
 
 
-def _create_dataset(options, is_training, input_pipeline_context=None):
+def _get_bucket_id(value, boundaries):
+  """Returns the bucket index of a value given the increasing boundaries."""
+  return tf.reduce_sum(tf.cast(value >= boundaries, tf.int64))
+
+
+def _get_group_key(example, options):
+  """Returns the batching group of an example.
+
+  Args:
+    example: A dictionary of the tensors of an example.
+    options: An instance of reader_pb2.Reader.
+
+  Returns:
+    A scalar int64 tensor, the orientation of the image combined with the size
+    bucket and the length bucket.
+  """
+  height = example[InputFields.img_height]
+  width = example[InputFields.img_width]
+  key = tf.cast(height > width, tf.int64)
+
+  # Size buckets of the longer side.
+  size_boundaries = options.image_size_boundaries[:]
+  if size_boundaries:
+    key += 2 * _get_bucket_id(tf.maximum(height, width), size_boundaries)
+
+  # Length buckets.
+  if options.bucket_boundaries:
+    key += 2 * (1 + len(size_boundaries)) * _get_bucket_id(
+        _get_sequence_length(example), options.bucket_boundaries[:])
+  return key
+
+
+def _create_dataset(options,
+                    is_training,
+                    input_pipeline_context=None,
+                    input_fields=None):
   """Creates dataset object based on options.
 
   Args:
     options: An instance of reader_pb2.Reader.
     is_training: If true, shuffle the dataset.
     input_pipeline_context: A tf.distribute.InputContext instance.
+    input_fields: A collection of the InputFields consumed by the model, None
+      to decode all the fields.
 
   Returns:
     A tf.data.Dataset object.
   """
-  dataset = tf.data.Dataset.list_files(options.input_pattern[:],
-                                       shuffle=is_training)
+  if options.compact_inputs and options.HasField('static_padding'):
+    raise ValueError('The static padding does not support compact inputs.')
+
+  shard = sharding.get_shard(options, input_pipeline_context)
+  dataset = sharding.read_records(options, is_training, shard)
 
   batch_size = options.batch_size
   if input_pipeline_context:
-    if input_pipeline_context.num_input_pipelines > 1:
-      dataset = dataset.shard(input_pipeline_context.num_input_pipelines,
-                              input_pipeline_context.input_pipeline_id)
     batch_size = input_pipeline_context.get_per_replica_batch_size(
         options.batch_size)
 
-  if is_training:
-    dataset = dataset.repeat()
-    dataset = dataset.shuffle(options.shuffle_buffer_size)
-  dataset = dataset.interleave(tf.data.TFRecordDataset,
-                               cycle_length=options.interleave_cycle_length)
+  # The token ids are looked up when the records are created.
+  vocab = None
+  if options.use_token_ids:
+    vocab = text_utils.Vocab(options.vocab_file,
+                             options.out_of_vocabulary_token_id)
 
-  parse_fn = lambda x: _parse_single_example(x, options)
+  parse_fn = lambda x: _parse_single_example(x, options, vocab, input_fields)
   dataset = dataset.map(map_func=parse_fn,
                         num_parallel_calls=options.num_parallel_calls)
+  if options.num_text_variants > 1:
+    dataset = dataset.flat_map(_expand_text_variants)
+
+  # The parsed evaluation examples are cached on disk, the warm runs skip the
+  # decoding.
+  if options.HasField('cache_dir') and not is_training:
+    if vocab is not None:
+      vocab_hash = vocab.hash
+    else:
+      vocab_hash = text_utils.Vocab(options.vocab_file,
+                                    options.out_of_vocabulary_token_id).hash
+    dataset = dataset.cache(
+        dataset_cache.get_cache_filename(options, vocab_hash, input_fields,
+                                         shard if shard[0] > 1 else None))
 
   padded_shapes = {
       InputFields.img_id: [],
@@ -374,20 +707,78 @@ def _create_dataset(options, is_training, input_pipeline_context=None):
       InputFields.mixed_rationale_choices_tag: -1,
       InputFields.mixed_rationale_choices_len: 0,
   }
-  dataset = dataset.padded_batch(batch_size,
-                                 padded_shapes=padded_shapes,
-                                 padding_values=padding_values,
-                                 drop_remainder=True)
+  # The tiled and mixed fields are assembled on device in the compact mode.
+  if options.compact_inputs:
+    padded_shapes.update({
+        InputFields.question: [None],
+        InputFields.question_tag: [None],
+        InputFields.question_len: [],
+    })
+    for name in [
+        InputFields.answer_len,
+        InputFields.mixed_answer_choices,
+        InputFields.mixed_answer_choices_tag,
+        InputFields.mixed_answer_choices_len,
+        InputFields.mixed_rationale_choices,
+        InputFields.mixed_rationale_choices_tag,
+        InputFields.mixed_rationale_choices_len,
+    ]:
+      padded_shapes.pop(name, None)
+      padding_values.pop(name, None)
+
+  if options.HasField('static_padding'):
+    static_padding.update_padded_shapes(padded_shapes, padding_values,
+                                        options.static_padding)
+
+  # Only the projected fields are batched.
+  output_names = tf.compat.v1.data.get_output_shapes(dataset).keys()
+  padded_shapes = dict((k, padded_shapes[k]) for k in output_names)
+  padding_values = dict((k, padding_values[k]) for k in output_names)
+
+  if is_training and options.group_by_aspect_ratio:
+    if InputFields.img_height not in output_names:
+      raise ValueError('Grouping by aspect ratio requires the image.')
+    dataset = dataset.apply(
+        tf.data.experimental.group_by_window(
+            key_func=lambda x: _get_group_key(x, options),
+            reduce_func=lambda _, x: x.padded_batch(
+                batch_size,
+                padded_shapes=padded_shapes,
+                padding_values=padding_values,
+                drop_remainder=True),
+            window_size=batch_size))
+  elif is_training and options.bucket_boundaries:
+    bucket_boundaries = options.bucket_boundaries[:]
+    dataset = dataset.apply(
+        tf.data.experimental.bucket_by_sequence_length(
+            _get_sequence_length,
+            bucket_boundaries=bucket_boundaries,
+            bucket_batch_sizes=[batch_size] * (1 + len(bucket_boundaries)),
+            padded_shapes=padded_shapes,
+            padding_values=padding_values,
+            drop_remainder=True))
+  else:
+    # The evaluation can keep the last partial batch, padded to batch_size.
+    pad_last_batch = not is_training and options.pad_last_batch
+    dataset = dataset.padded_batch(batch_size,
+                                   padded_shapes=padded_shapes,
+                                   padding_values=padding_values,
+                                   drop_remainder=not pad_last_batch)
+    if pad_last_batch:
+      dataset = sharding.pad_last_batch(dataset, batch_size)
   dataset = dataset.prefetch(options.prefetch_buffer_size)
   return dataset
 
 
-def get_input_fn(options, is_training):
+def get_input_fn(options, is_training, input_fields=None):
   """Returns a function that generate input examples.
 
   Args:
     options: An instance of reader_pb2.Reader.
     is_training: If true, shuffle the dataset.
+    input_fields: A collection of the InputFields consumed by the model, see
+      `get_required_input_fields` in models/builder.py. None to decode all the
+      fields.
 
   Returns:
     input_fn: a callable that returns a dataset.
@@ -401,6 +792,9 @@ def get_input_fn(options, is_training):
     Returns:
       A dataset that can be fed to estimator.
     """
-    return _create_dataset(options, is_training, input_pipeline_context)
+    return _create_dataset(options,
+                           is_training,
+                           input_pipeline_context,
+                           input_fields=input_fields)
 
   return _input_fn
@@ -7,7 +7,9 @@ from absl import logging
 import tensorflow as tf
 
 import reader
+import vcr_reader
 from vcr_fields import InputFields
+from vcr_fields import TFExampleFields
 
 from google.protobuf import text_format
 from protos import reader_pb2
@@ -47,5 +49,30 @@ class VCRReaderTest(tf.test.TestCase):
       logging.info('rationale_choices_len: %s', elem['rationale_choices_len'][0])
 
 
+class TextVariantsTest(tf.test.TestCase):
+
+  def test_expand_text_variants(self):
+    num_variants = [1, 3, 2]
+    variants = tuple({
+        InputFields.annot_id: ['val-%i-%i' % (i, variant_id) for i in range(3)]
+    } for variant_id in range(3))
+    dataset = tf.data.Dataset.from_tensor_slices((num_variants, variants))
+    dataset = dataset.flat_map(vcr_reader._expand_text_variants)
+    self.assertAllEqual(
+        [x[InputFields.annot_id].numpy() for x in dataset], [
+            b'val-0-0', b'val-1-0', b'val-1-1', b'val-1-2', b'val-2-0',
+            b'val-2-1'
+        ])
+
+  def test_check_num_text_variants(self):
+    decoded_example = {
+        InputFields.annot_id: tf.constant('val-0'),
+        TFExampleFields.num_text_variants: tf.constant(2),
+    }
+    vcr_reader._check_num_text_variants(decoded_example, 2)
+    with self.assertRaises(tf.errors.InvalidArgumentError):
+      vcr_reader._check_num_text_variants(decoded_example, 1)
+
+
 if __name__ == '__main__':
   tf.test.main()
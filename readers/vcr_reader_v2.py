@@ -8,6 +8,8 @@ from modeling.layers import token_to_id
 from tf_slim import tfexample_decoder
 
 from protos import reader_pb2
+from readers import image_utils
+from readers import sharding
 
 PAD = '[PAD]'
 PAD_ID = 0
@@ -41,6 +43,10 @@ class TFExampleFields(object):
   rationale_choice_tag = 'rationale_choice_tag'
 
 
+# Fields decoded whatever the model consumes.
+META_FIELDS = ['annot_id', 'img_id', 'answer_label', 'rationale_label']
+
+
 class Detections(object):
   """Rrepresents the detection."""
 
@@ -112,34 +118,33 @@ def _update_decoded_example(decoded_example, options):
   detection_to_id_fn = token_to_id.TokenToIdLayer(options.detection_vocab_file,
                                                   0)
 
-  # Image and bounding boxes.
-  image = decoded_example['img_data']
-  image_shape = tf.shape(image)
+  # Image and bounding boxes, the image is not decoded if not consumed.
+  if 'img_data' in decoded_example:
+    image_shape = tf.shape(decoded_example['img_data'])
+    decoded_example.update({
+        'img_height': image_shape[0],
+        'img_width': image_shape[1],
+    })
 
   detections = Detections(
       decoded_example.pop('detection_boxes'),
       detection_to_id_fn(decoded_example.pop('detection_classes')),
       decoded_example.pop('detection_scores'))
 
-  decoded_example.update({
-      'img_height': image_shape[0],
-      'img_width': image_shape[1],
-      'detections': detections.to_dict(),
-  })
+  decoded_example.update({'detections': detections.to_dict()})
 
   # Answer and rationale choices.
   for i in range(NUM_CHOICES):
     answer_choice = MixedSequence(
         token_to_id_fn(decoded_example.pop('answer_choice_%i' % i)),
         decoded_example.pop('answer_choice_tag_%i' % i))
-    rationale_choice = MixedSequence(
-        token_to_id_fn(decoded_example.pop('rationale_choice_%i' % i)),
-        decoded_example.pop('rationale_choice_tag_%i' % i))
+    decoded_example['answer_choice_%i' % i] = answer_choice.to_dict()
 
-    decoded_example.update({
-        'answer_choice_%i' % i: answer_choice.to_dict(),
-        'rationale_choice_%i' % i: rationale_choice.to_dict(),
-    })
+    if 'rationale_choice_%i' % i in decoded_example:
+      rationale_choice = MixedSequence(
+          token_to_id_fn(decoded_example.pop('rationale_choice_%i' % i)),
+          decoded_example.pop('rationale_choice_tag_%i' % i))
+      decoded_example['rationale_choice_%i' % i] = rationale_choice.to_dict()
 
   # Question and answer.
   question = MixedSequence(token_to_id_fn(decoded_example.pop('question')),
@@ -150,24 +155,28 @@ def _update_decoded_example(decoded_example, options):
   return decoded_example
 
 
-def _parse_single_example(example, options):
+def _parse_single_example(example, options, input_fields=None):
   """Parses a single tf.Example proto.
 
   Args:
     example: An Example proto.
     options: An instance of reader_pb2.Reader.
+    input_fields: A collection of the top-level fields consumed by the model,
+      None to decode all the fields.
 
   Returns:
     A dictionary indexed by tensor name.
   """
+  decode_image = input_fields is None or 'img_data' in input_fields
+  decode_rationale = input_fields is None or any(
+      'rationale_choice_%i' % i in input_fields for i in range(NUM_CHOICES))
+
   ###################################
   # Initialize `keys_to_features`.
   ###################################
   keys_to_features = {
       TFExampleFields.annot_id: tf.io.FixedLenFeature([], tf.string),
       TFExampleFields.img_id: tf.io.FixedLenFeature([], tf.string),
-      TFExampleFields.img_encoded: tf.io.FixedLenFeature([], tf.string),
-      TFExampleFields.img_format: tf.io.FixedLenFeature([], tf.string),
       TFExampleFields.answer_label: tf.io.FixedLenFeature([], tf.int64),
       TFExampleFields.rationale_label: tf.io.FixedLenFeature([], tf.int64),
       TFExampleFields.detection_classes: tf.io.VarLenFeature(tf.string),
@@ -187,11 +196,14 @@ def _parse_single_example(example, options):
             tf.io.VarLenFeature(tf.string),
         TFExampleFields.answer_choice_tag + '_%i' % i:
             tf.io.VarLenFeature(tf.int64),
-        TFExampleFields.rationale_choice + '_%i' % i:
-            tf.io.VarLenFeature(tf.string),
-        TFExampleFields.rationale_choice_tag + '_%i' % i:
-            tf.io.VarLenFeature(tf.int64),
     })
+    if decode_rationale:
+      keys_to_features.update({
+          TFExampleFields.rationale_choice + '_%i' % i:
+              tf.io.VarLenFeature(tf.string),
+          TFExampleFields.rationale_choice_tag + '_%i' % i:
+              tf.io.VarLenFeature(tf.int64),
+      })
 
   ###################################
   # Initialize `items_to_handlers`.
@@ -203,10 +215,6 @@ def _parse_single_example(example, options):
       'img_id':
           tfexample_decoder.Tensor(tensor_key=TFExampleFields.img_id,
                                    default_value=''),
-      'img_data':
-          tfexample_decoder.Image(image_key=TFExampleFields.img_encoded,
-                                  format_key=TFExampleFields.img_format,
-                                  shape=None),
       'answer_label':
           tfexample_decoder.Tensor(tensor_key=TFExampleFields.answer_label,
                                    default_value=-1),
@@ -231,6 +239,12 @@ def _parse_single_example(example, options):
                                    default_value=-1),
   }
 
+  if decode_image:
+    keys_to_features[TFExampleFields.img_encoded] = tf.io.FixedLenFeature(
+        [], tf.string)
+    items_to_handlers[TFExampleFields.img_encoded] = tfexample_decoder.Tensor(
+        tensor_key=TFExampleFields.img_encoded)
+
   # Answer and rationale choices.
   for i in range(NUM_CHOICES):
     items_to_handlers['answer_choice_%i' % i] = tfexample_decoder.Tensor(
@@ -238,10 +252,13 @@ def _parse_single_example(example, options):
     items_to_handlers['answer_choice_tag_%i' % i] = tfexample_decoder.Tensor(
         tensor_key='answer_choice_tag_%i' % i, default_value=-1)
 
-    items_to_handlers['rationale_choice_%i' % i] = tfexample_decoder.Tensor(
-        tensor_key='rationale_choice_%i' % i, default_value=PAD)
-    items_to_handlers['rationale_choice_tag_%i' % i] = tfexample_decoder.Tensor(
-        tensor_key='rationale_choice_tag_%i' % i, default_value=-1)
+    if decode_rationale:
+      tensor_key = 'rationale_choice_%i' % i
+      items_to_handlers[tensor_key] = tfexample_decoder.Tensor(
+          tensor_key=tensor_key, default_value=PAD)
+      tensor_key = 'rationale_choice_tag_%i' % i
+      items_to_handlers[tensor_key] = tfexample_decoder.Tensor(
+          tensor_key=tensor_key, default_value=-1)
 
   # Decode example.
   example_decoder = tfexample_decoder.TFExampleDecoder(keys_to_features,
@@ -253,39 +270,96 @@ def _parse_single_example(example, options):
       x if x.dtype != tf.int64 else tf.cast(x, tf.int32) for x in output_tensors
   ]
   decoded_example = dict(zip(output_keys, output_tensors))
-  return _update_decoded_example(decoded_example, options)
 
+  # The image is downscaled to `desired_size` while decoding.
+  if decode_image:
+    decoded_example['img_data'] = image_utils.decode_image(
+        decoded_example.pop(TFExampleFields.img_encoded), options.desired_size)
+  decoded_example = _update_decoded_example(decoded_example, options)
+
+  # Keep the fields consumed by the model.
+  if input_fields is not None:
+    kept_fields = set(input_fields).union(META_FIELDS)
+    decoded_example = dict(
+        (k, v) for k, v in decoded_example.items() if k in kept_fields)
+  return decoded_example
+
+
+def _get_sequence_length(example):
+  """Returns the length of the longest choice sequence, used for bucketing.
+
+  Args:
+    example: A dictionary of the tensors of an example.
 
-def _create_dataset(options, is_training, input_pipeline_context=None):
+  Returns:
+    A scalar int tensor.
+  """
+  length = example['question']['length']
+  for prefix in ['answer_choice_', 'rationale_choice_']:
+    if prefix + '0' in example:
+      length += tf.reduce_max(
+          [example[prefix + '%i' % i]['length'] for i in range(NUM_CHOICES)])
+  return length
+
+
+def _get_bucket_id(value, boundaries):
+  """Returns the bucket index of a value given the increasing boundaries."""
+  return tf.reduce_sum(tf.cast(value >= boundaries, tf.int64))
+
+
+def _get_group_key(example, options):
+  """Returns the batching group of an example.
+
+  Args:
+    example: A dictionary of the tensors of an example.
+    options: An instance of reader_pb2.Reader.
+
+  Returns:
+    A scalar int64 tensor, the orientation of the image combined with the size
+    bucket and the length bucket.
+  """
+  height = example['img_height']
+  width = example['img_width']
+  key = tf.cast(height > width, tf.int64)
+
+  # Size buckets of the longer side.
+  size_boundaries = options.image_size_boundaries[:]
+  if size_boundaries:
+    key += 2 * _get_bucket_id(tf.maximum(height, width), size_boundaries)
+
+  # Length buckets.
+  if options.bucket_boundaries:
+    key += 2 * (1 + len(size_boundaries)) * _get_bucket_id(
+        _get_sequence_length(example), options.bucket_boundaries[:])
+  return key
+
+
+def _create_dataset(options,
+                    is_training,
+                    input_pipeline_context=None,
+                    input_fields=None):
   """Creates dataset object based on options.
 
   Args:
     options: An instance of reader_pb2.Reader.
     is_training: If true, shuffle the dataset.
     input_pipeline_context: A tf.distribute.InputContext instance.
+    input_fields: A collection of the top-level fields consumed by the model,
+      None to decode all the fields.
 
   Returns:
     A tf.data.Dataset object.
   """
-  dataset = tf.data.Dataset.list_files(options.input_pattern[:],
-                                       shuffle=is_training)
+  shard = sharding.get_shard(options, input_pipeline_context)
+  dataset = sharding.read_records(options, is_training, shard)
 
   batch_size = options.batch_size
   if input_pipeline_context:
-    if input_pipeline_context.num_input_pipelines > 1:
-      dataset = dataset.shard(input_pipeline_context.num_input_pipelines,
-                              input_pipeline_context.input_pipeline_id)
     batch_size = input_pipeline_context.get_per_replica_batch_size(
         options.batch_size)
 
-  if is_training:
-    dataset = dataset.repeat()
-    dataset = dataset.shuffle(options.shuffle_buffer_size)
-  dataset = dataset.interleave(tf.data.TFRecordDataset,
-                               cycle_length=options.interleave_cycle_length)
-
   def parse_fn(x):
-    return _parse_single_example(x, options)
+    return _parse_single_example(x, options, input_fields)
 
   dataset = dataset.map(map_func=parse_fn,
                         num_parallel_calls=options.num_parallel_calls)
@@ -328,20 +402,55 @@ def _create_dataset(options, is_training, input_pipeline_context=None):
       'rationale_choice_2': MixedSequence.get_padding_values(),
       'rationale_choice_3': MixedSequence.get_padding_values(),
   }
-  dataset = dataset.padded_batch(batch_size,
-                                 padded_shapes=padded_shapes,
-                                 padding_values=padding_values,
-                                 drop_remainder=True)
+
+  # Only the projected fields are batched.
+  output_names = tf.compat.v1.data.get_output_shapes(dataset).keys()
+  padded_shapes = dict((k, padded_shapes[k]) for k in output_names)
+  padding_values = dict((k, padding_values[k]) for k in output_names)
+
+  if is_training and options.group_by_aspect_ratio:
+    if 'img_height' not in output_names:
+      raise ValueError('Grouping by aspect ratio requires the image.')
+    dataset = dataset.apply(
+        tf.data.experimental.group_by_window(
+            key_func=lambda x: _get_group_key(x, options),
+            reduce_func=lambda _, x: x.padded_batch(
+                batch_size,
+                padded_shapes=padded_shapes,
+                padding_values=padding_values,
+                drop_remainder=True),
+            window_size=batch_size))
+  elif is_training and options.bucket_boundaries:
+    bucket_boundaries = options.bucket_boundaries[:]
+    dataset = dataset.apply(
+        tf.data.experimental.bucket_by_sequence_length(
+            _get_sequence_length,
+            bucket_boundaries=bucket_boundaries,
+            bucket_batch_sizes=[batch_size] * (1 + len(bucket_boundaries)),
+            padded_shapes=padded_shapes,
+            padding_values=padding_values,
+            drop_remainder=True))
+  else:
+    # The evaluation can keep the last partial batch, padded to batch_size.
+    pad_last_batch = not is_training and options.pad_last_batch
+    dataset = dataset.padded_batch(batch_size,
+                                   padded_shapes=padded_shapes,
+                                   padding_values=padding_values,
+                                   drop_remainder=not pad_last_batch)
+    if pad_last_batch:
+      dataset = sharding.pad_last_batch(dataset, batch_size)
   dataset = dataset.prefetch(options.prefetch_buffer_size)
   return dataset
 
 
-def get_input_fn(options, is_training):
+def get_input_fn(options, is_training, input_fields=None):
   """Returns a function that generate input examples.
 
   Args:
     options: An instance of reader_pb2.Reader.
     is_training: If true, shuffle the dataset.
+    input_fields: A collection of the top-level fields consumed by the model,
+      None to decode all the fields.
 
   Returns:
     input_fn: a callable that returns a dataset.
@@ -355,6 +464,9 @@ def get_input_fn(options, is_training):
     Returns:
       A dataset that can be fed to estimator.
     """
-    return _create_dataset(options, is_training, input_pipeline_context)
+    return _create_dataset(options,
+                           is_training,
+                           input_pipeline_context,
+                           input_fields=input_fields)
 
   return _input_fn
@@ -9,8 +9,18 @@ import tensorflow as tf
 from tf_slim import tfexample_decoder
 from protos import reader_pb2
 from readers.vcr_fields import *
+from readers import feature_store
+from readers import dataset_cache
+from readers import sharding
+from readers import static_padding
+from readers import text_utils
 from modeling.layers import token_to_id
 
+_RAW_FEATURE_DTYPES = {
+    reader_pb2.RAW_FLOAT32: tf.float32,
+    reader_pb2.RAW_FLOAT16: tf.float16,
+}
+
 
 def _pad_sequences(sequences, pad=PAD):
   """Pads sequences to the max-length.
@@ -34,28 +44,96 @@ def _pad_sequences(sequences, pad=PAD):
   return padded_sequences, tf.stack(lengths)
 
 
-def _update_decoded_example(decoded_example, options):
+def _requires_any(input_fields, fields):
+  """Checks if any of the fields is required, None requires all the fields."""
+  return input_fields is None or any(x in input_fields for x in fields)
+
+
+def _project_fields(decoded_example, options, input_fields):
+  """Keeps the fields consumed by the model.
+
+  Args:
+    decoded_example: A tensor dictionary keyed by name.
+    options: An instance of reader_pb2.Reader.
+    input_fields: A collection of the InputFields consumed by the model, None
+      to keep all the fields.
+
+  Returns:
+    A dictionary of the required fields and the meta fields.
+  """
+  if input_fields is None:
+    return decoded_example
+  kept_fields = set(input_fields).union(META_FIELDS)
+  if options.compact_inputs:
+    kept_fields.update(COMPACT_FIELDS)
+  if options.HasField('static_padding'):
+    kept_fields.update(STATIC_PADDING_FIELDS)
+  return dict((k, v) for k, v in decoded_example.items() if k in kept_fields)
+
+
+def _finalize_example(decoded_example, options, input_fields):
+  """Applies the static padding, then keeps the fields consumed by the model.
+
+  The static padding is applied first, as truncating the mixed sequences
+  requires the question length, whether the model consumes it or not.
+
+  Args:
+    decoded_example: A tensor dictionary keyed by name.
+    options: An instance of reader_pb2.Reader.
+    input_fields: A collection of the InputFields consumed by the model, None
+      to keep all the fields.
+
+  Returns:
+    A dictionary of the required fields and the meta fields.
+  """
+  if options.HasField('static_padding'):
+    decoded_example = static_padding.truncate_example(decoded_example,
+                                                      options.static_padding)
+  return _project_fields(decoded_example, options, input_fields)
+
+
+def _update_decoded_example(decoded_example, options, store=None, vocab=None):
   """Updates the decoded example, add size to the varlen feature.
 
   Args:
     decoded_example: A tensor dictionary keyed by name.
     options: An instance of reader_pb2.Reader.
+    store: A feature_store.FeatureStore instance. If specified, detection
+      features are looked up by annot_id.
+    vocab: A text_utils.Vocab object if the tokens are decoded as ids.
 
   Returns:
     decoded_example: The same instance with content modified.
   """
-  token_to_id_func = token_to_id.TokenToIdLayer(
-      options.vocab_file, options.out_of_vocabulary_token_id)
+  if vocab is not None:
+    token_to_id_func = lambda x: x
+    pad, sep = PAD_ID, vocab.convert_tokens_to_ids(['[SEP]'])
+  else:
+    token_to_id_func = token_to_id.TokenToIdLayer(
+        options.vocab_file, options.out_of_vocabulary_token_id)
+    pad, sep = PAD, ['[SEP]']
 
   # Number of objects.
   detection_boxes = decoded_example[InputFields.detection_boxes]
   detection_classes = decoded_example[InputFields.detection_classes]
   num_detections = tf.shape(detection_boxes)[0]
 
-  # Object Fast-RCNN features.
-  detection_features = decoded_example.pop(TFExampleFields.detection_features)
-  detection_features = tf.reshape(detection_features,
-                                  [-1, options.frcnn_feature_dims])
+  # Object Fast-RCNN features, not decoded if the model does not consume them.
+  if store is not None:
+    detection_features = store.lookup(decoded_example[InputFields.annot_id])
+    decoded_example[InputFields.detection_features] = detection_features
+  elif TFExampleFields.detection_features in decoded_example:
+    detection_features = decoded_example.pop(
+        TFExampleFields.detection_features)
+    if options.frcnn_feature_encoding != reader_pb2.FLOAT_LIST:
+      detection_features = tf.io.decode_raw(
+          detection_features,
+          _RAW_FEATURE_DTYPES[options.frcnn_feature_encoding],
+          little_endian=True)
+      detection_features = tf.cast(detection_features, tf.float32)
+    detection_features = tf.reshape(detection_features,
+                                    [-1, options.frcnn_feature_dims])
+    decoded_example[InputFields.detection_features] = detection_features
 
   # Question length.
   question = decoded_example[InputFields.question]
@@ -71,20 +149,56 @@ def _update_decoded_example(decoded_example, options):
       decoded_example.pop(TFExampleFields.answer_choice_tag + '_%i' % i)
       for i in range(1, 1 + NUM_CHOICES)
   ]
-  (answer_choices, answer_choices_len) = _pad_sequences(answer_choices_list)
+  (answer_choices,
+   answer_choices_len) = _pad_sequences(answer_choices_list, pad)
   (answer_choices_tag, _) = _pad_sequences(answer_choices_tag_list, -1)
 
-  rationale_choices_list = [
-      decoded_example.pop(TFExampleFields.rationale_choice + '_%i' % i)
-      for i in range(1, 1 + NUM_CHOICES)
-  ]
-  rationale_choices_tag_list = [
-      decoded_example.pop(TFExampleFields.rationale_choice_tag + '_%i' % i)
-      for i in range(1, 1 + NUM_CHOICES)
-  ]
-  (rationale_choices,
-   rationale_choices_len) = _pad_sequences(rationale_choices_list)
-  (rationale_choices_tag, _) = _pad_sequences(rationale_choices_tag_list, -1)
+  # The rationale choices are not decoded if the model does not consume them.
+  decode_rationale = (TFExampleFields.rationale_choice + '_1' in
+                      decoded_example)
+  if decode_rationale:
+    rationale_choices_list = [
+        decoded_example.pop(TFExampleFields.rationale_choice + '_%i' % i)
+        for i in range(1, 1 + NUM_CHOICES)
+    ]
+    rationale_choices_tag_list = [
+        decoded_example.pop(TFExampleFields.rationale_choice_tag + '_%i' % i)
+        for i in range(1, 1 + NUM_CHOICES)
+    ]
+    (rationale_choices,
+     rationale_choices_len) = _pad_sequences(rationale_choices_list, pad)
+    (rationale_choices_tag, _) = _pad_sequences(rationale_choices_tag_list, -1)
+    decoded_example.update({
+        InputFields.rationale_choices:
+            token_to_id_func(rationale_choices),
+        InputFields.rationale_choices_tag:
+            rationale_choices_tag,
+        InputFields.rationale_choices_len:
+            rationale_choices_len,
+    })
+
+  decoded_example.update({
+      InputFields.num_detections:
+          num_detections,
+      InputFields.detection_classes:
+          token_to_id_func(detection_classes),
+      InputFields.answer_choices:
+          token_to_id_func(answer_choices),
+      InputFields.answer_choices_tag:
+          answer_choices_tag,
+      InputFields.answer_choices_len:
+          answer_choices_len,
+  })
+
+  if options.compact_inputs:
+    # The question is kept once, the tiled and mixed fields are assembled on
+    # device by sequence_ops.expand_compact_inputs.
+    decoded_example.update({
+        InputFields.question: token_to_id_func(question),
+        InputFields.question_tag: question_tag,
+        InputFields.question_len: question_len,
+    })
+    return decoded_example
 
   # Mixed question -> answer, question-answer -> rationale.
   answer_len = answer_choices_len[decoded_example[InputFields.answer_label]]
@@ -94,36 +208,39 @@ def _update_decoded_example(decoded_example, options):
       InputFields.answer_label]][:answer_len]
 
   mixed_answer_choices_list = [
-      tf.concat([question, ['[SEP]'], x], 0) for x in answer_choices_list
+      tf.concat([question, sep, x], 0) for x in answer_choices_list
   ]
   mixed_answer_choices_tag_list = [
       tf.concat([question_tag, [-1], x], 0) for x in answer_choices_tag_list
   ]
   (mixed_answer_choices,
-   mixed_answer_choices_len) = _pad_sequences(mixed_answer_choices_list)
+   mixed_answer_choices_len) = _pad_sequences(mixed_answer_choices_list, pad)
   (mixed_answer_choices_tag, _) = _pad_sequences(mixed_answer_choices_tag_list,
                                                  pad=-1)
 
-  mixed_rationale_choices_list = [
-      tf.concat([question, ['[SEP]'], answer, ['[SEP]'], x], 0)
-      for x in rationale_choices_list
-  ]
-  mixed_rationale_choices_tag_list = [
-      tf.concat([question_tag, [-1], answer_tag, [-1], x], 0)
-      for x in rationale_choices_tag_list
-  ]
-  (mixed_rationale_choices,
-   mixed_rationale_choices_len) = _pad_sequences(mixed_rationale_choices_list)
-  (mixed_rationale_choices_tag,
-   _) = _pad_sequences(mixed_rationale_choices_tag_list, pad=-1)
+  if decode_rationale:
+    mixed_rationale_choices_list = [
+        tf.concat([question, sep, answer, sep, x], 0)
+        for x in rationale_choices_list
+    ]
+    mixed_rationale_choices_tag_list = [
+        tf.concat([question_tag, [-1], answer_tag, [-1], x], 0)
+        for x in rationale_choices_tag_list
+    ]
+    (mixed_rationale_choices, mixed_rationale_choices_len) = _pad_sequences(
+        mixed_rationale_choices_list, pad)
+    (mixed_rationale_choices_tag,
+     _) = _pad_sequences(mixed_rationale_choices_tag_list, pad=-1)
+    decoded_example.update({
+        InputFields.mixed_rationale_choices:
+            token_to_id_func(mixed_rationale_choices),
+        InputFields.mixed_rationale_choices_tag:
+            mixed_rationale_choices_tag,
+        InputFields.mixed_rationale_choices_len:
+            mixed_rationale_choices_len,
+    })
 
   decoded_example.update({
-      InputFields.num_detections:
-          num_detections,
-      InputFields.detection_classes:
-          token_to_id_func(detection_classes),
-      InputFields.detection_features:
-          detection_features,
       InputFields.question:
           tf.tile(tf.expand_dims(token_to_id_func(question), 0),
                   [NUM_CHOICES, 1]),
@@ -131,55 +248,61 @@ def _update_decoded_example(decoded_example, options):
           tf.tile(tf.expand_dims(question_tag, 0), [NUM_CHOICES, 1]),
       InputFields.question_len:
           tf.tile(tf.expand_dims(question_len, 0), [NUM_CHOICES]),
-      InputFields.answer_choices:
-          token_to_id_func(answer_choices),
-      InputFields.answer_choices_tag:
-          answer_choices_tag,
-      InputFields.answer_choices_len:
-          answer_choices_len,
-      InputFields.rationale_choices:
-          token_to_id_func(rationale_choices),
-      InputFields.rationale_choices_tag:
-          rationale_choices_tag,
-      InputFields.rationale_choices_len:
-          rationale_choices_len,
       InputFields.mixed_answer_choices:
           token_to_id_func(mixed_answer_choices),
       InputFields.mixed_answer_choices_tag:
           mixed_answer_choices_tag,
       InputFields.mixed_answer_choices_len:
           mixed_answer_choices_len,
-      InputFields.mixed_rationale_choices:
-          token_to_id_func(mixed_rationale_choices),
-      InputFields.mixed_rationale_choices_tag:
-          mixed_rationale_choices_tag,
-      InputFields.mixed_rationale_choices_len:
-          mixed_rationale_choices_len,
   })
 
   return decoded_example
 
 
-def _parse_single_example(example, options):
+def _parse_single_example(example,
+                          options,
+                          store=None,
+                          vocab=None,
+                          input_fields=None):
   """Parses a single tf.Example proto.
 
+  Only the tf.Example features of the `input_fields` are parsed.
+
   Args:
     example: An Example proto.
     options: An instance of reader_pb2.Reader.
+    store: A feature_store.FeatureStore instance, see _update_decoded_example.
+    vocab: A text_utils.Vocab object. If not None, decode the token ids instead
+      of the tokens.
+    input_fields: A collection of the InputFields consumed by the model, None
+      to decode all the fields.
 
   Returns:
     A dictionary indexed by tensor name.
   """
+  # Tokens are stored either as strings or as int64 ids.
+  if vocab is not None:
+    token_dtype, token_default_value, token_suffix = tf.int64, PAD_ID, '_id'
+  else:
+    token_dtype, token_default_value, token_suffix = tf.string, PAD, ''
+  detection_classes_key = TFExampleFields.detection_classes + token_suffix
+  question_key = TFExampleFields.question + token_suffix
+  answer_choice_key = TFExampleFields.answer_choice + token_suffix
+  rationale_choice_key = TFExampleFields.rationale_choice + token_suffix
+
+  decode_features = _requires_any(input_fields,
+                                  [InputFields.detection_features])
+  decode_rationale = _requires_any(input_fields, RATIONALE_FIELDS)
+
   # Initialize `keys_to_features`.
   keys_to_features = {
       TFExampleFields.img_id: tf.io.FixedLenFeature([], tf.string),
       TFExampleFields.annot_id: tf.io.FixedLenFeature([], tf.string),
       TFExampleFields.answer_label: tf.io.FixedLenFeature([], tf.int64),
       TFExampleFields.rationale_label: tf.io.FixedLenFeature([], tf.int64),
-      TFExampleFields.detection_classes: tf.io.VarLenFeature(tf.string),
+      detection_classes_key: tf.io.VarLenFeature(token_dtype),
       TFExampleFields.detection_scores: tf.io.VarLenFeature(tf.float32),
-      TFExampleFields.detection_features: tf.io.VarLenFeature(tf.float32),
-      TFExampleFields.question: tf.io.VarLenFeature(tf.string),
+      question_key: tf.io.VarLenFeature(token_dtype),
       TFExampleFields.question_tag: tf.io.VarLenFeature(tf.int64),
   }
   for bbox_key in TFExampleFields.detection_boxes_keys:
@@ -187,15 +310,18 @@ def _parse_single_example(example, options):
     keys_to_features[bbox_field] = tf.io.VarLenFeature(tf.float32)
   for i in range(1, 1 + NUM_CHOICES):
     keys_to_features.update({
-        TFExampleFields.answer_choice + '_%i' % i:
-            tf.io.VarLenFeature(tf.string),
+        answer_choice_key + '_%i' % i:
+            tf.io.VarLenFeature(token_dtype),
         TFExampleFields.answer_choice_tag + '_%i' % i:
             tf.io.VarLenFeature(tf.int64),
-        TFExampleFields.rationale_choice + '_%i' % i:
-            tf.io.VarLenFeature(tf.string),
-        TFExampleFields.rationale_choice_tag + '_%i' % i:
-            tf.io.VarLenFeature(tf.int64),
     })
+    if decode_rationale:
+      keys_to_features.update({
+          rationale_choice_key + '_%i' % i:
+              tf.io.VarLenFeature(token_dtype),
+          TFExampleFields.rationale_choice_tag + '_%i' % i:
+              tf.io.VarLenFeature(tf.int64),
+      })
 
   # Initialize `items_to_handlers`.
   items_to_handlers = {
@@ -216,38 +342,60 @@ def _parse_single_example(example, options):
               keys=TFExampleFields.detection_boxes_keys,
               prefix=TFExampleFields.detection_boxes_scope),
       InputFields.detection_classes:
-          tfexample_decoder.Tensor(tensor_key=TFExampleFields.detection_classes,
-                                   default_value=''),
+          tfexample_decoder.Tensor(tensor_key=detection_classes_key,
+                                   default_value=token_default_value),
       InputFields.detection_scores:
           tfexample_decoder.Tensor(tensor_key=TFExampleFields.detection_scores,
                                    default_value=0),
       InputFields.question:
-          tfexample_decoder.Tensor(tensor_key=TFExampleFields.question,
-                                   default_value=PAD),
+          tfexample_decoder.Tensor(tensor_key=question_key,
+                                   default_value=token_default_value),
       InputFields.question_tag:
           tfexample_decoder.Tensor(tensor_key=TFExampleFields.question_tag,
                                    default_value=-1),
-      TFExampleFields.detection_features:
-          tfexample_decoder.Tensor(
-              tensor_key=TFExampleFields.detection_features, default_value=0),
   }
-
+  if store is not None or not decode_features:
+    pass  # Looked up from the feature store, or not consumed by the model.
+  elif options.frcnn_feature_encoding == reader_pb2.FLOAT_LIST:
+    keys_to_features[TFExampleFields.detection_features] = (
+        tf.io.VarLenFeature(tf.float32))
+    items_to_handlers[TFExampleFields.detection_features] = (
+        tfexample_decoder.Tensor(tensor_key=TFExampleFields.detection_features,
+                                 default_value=0))
+  else:
+    keys_to_features[TFExampleFields.detection_features] = (
+        tf.io.FixedLenFeature([], tf.string))
+    items_to_handlers[TFExampleFields.detection_features] = (
+        tfexample_decoder.Tensor(tensor_key=TFExampleFields.detection_features,
+                                 default_value=''))
+
+  if vocab is not None:
+    keys_to_features[TFExampleFields.vocab_hash] = tf.io.FixedLenFeature(
+        [], tf.string, default_value='')
+    items_to_handlers[TFExampleFields.vocab_hash] = tfexample_decoder.Tensor(
+        tensor_key=TFExampleFields.vocab_hash)
+
+  # The items are named after the token fields, whether the tokens or the token
+  # ids are decoded.
   for i in range(1, 1 + NUM_CHOICES):
-    tensor_key = TFExampleFields.answer_choice + '_%i' % i
-    items_to_handlers[tensor_key] = tfexample_decoder.Tensor(
-        tensor_key=tensor_key, default_value=PAD)
+    items_to_handlers[TFExampleFields.answer_choice +
+                      '_%i' % i] = tfexample_decoder.Tensor(
+                          tensor_key=answer_choice_key + '_%i' % i,
+                          default_value=token_default_value)
 
     tensor_key = TFExampleFields.answer_choice_tag + '_%i' % i
     items_to_handlers[tensor_key] = tfexample_decoder.Tensor(
         tensor_key=tensor_key, default_value=-1)
 
-    tensor_key = TFExampleFields.rationale_choice + '_%i' % i
-    items_to_handlers[tensor_key] = tfexample_decoder.Tensor(
-        tensor_key=tensor_key, default_value=PAD)
+    if decode_rationale:
+      items_to_handlers[TFExampleFields.rationale_choice +
+                        '_%i' % i] = tfexample_decoder.Tensor(
+                            tensor_key=rationale_choice_key + '_%i' % i,
+                            default_value=token_default_value)
 
-    tensor_key = TFExampleFields.rationale_choice_tag + '_%i' % i
-    items_to_handlers[tensor_key] = tfexample_decoder.Tensor(
-        tensor_key=tensor_key, default_value=-1)
+      tensor_key = TFExampleFields.rationale_choice_tag + '_%i' % i
+      items_to_handlers[tensor_key] = tfexample_decoder.Tensor(
+          tensor_key=tensor_key, default_value=-1)
 
   # Decode example.
   example_decoder = tfexample_decoder.TFExampleDecoder(keys_to_features,
@@ -259,43 +407,104 @@ def _parse_single_example(example, options):
       x if x.dtype != tf.int64 else tf.cast(x, tf.int32) for x in output_tensors
   ]
   decoded_example = dict(zip(output_keys, output_tensors))
-  return _update_decoded_example(decoded_example, options)
+
+  # Check that the token ids are encoded using the vocabulary.
+  if vocab is not None:
+    vocab_hash = decoded_example.pop(TFExampleFields.vocab_hash)
+    assert_op = tf.debugging.assert_equal(
+        vocab_hash,
+        vocab.hash,
+        message='The token ids are encoded using a different vocabulary.')
+    with tf.control_dependencies([assert_op]):
+      decoded_example[InputFields.annot_id] = tf.identity(
+          decoded_example[InputFields.annot_id])
+  return _finalize_example(
+      _update_decoded_example(decoded_example, options, store, vocab), options,
+      input_fields)
+
+
+def _get_sequence_length(example):
+  """Returns the length of the longest choice sequence, used for bucketing.
+
+  Args:
+    example: A dictionary of the tensors of an example.
+
+  Returns:
+    A scalar int tensor.
+  """
+  mixed_names = [
+      x for x in (InputFields.mixed_answer_choices_len,
+                  InputFields.mixed_rationale_choices_len) if x in example
+  ]
+  if mixed_names:
+    return tf.reduce_max([tf.reduce_max(example[x]) for x in mixed_names])
+
+  # Compact inputs, the question is prepended on device.
+  return example[InputFields.question_len] + tf.add_n([
+      tf.reduce_max(example[x])
+      for x in (InputFields.answer_choices_len,
+                InputFields.rationale_choices_len) if x in example
+  ])
 
 
-def _create_dataset(options, is_training, input_pipeline_context=None):
+def _create_dataset(options,
+                    is_training,
+                    input_pipeline_context=None,
+                    input_fields=None):
   """Creates dataset object based on options.
 
   Args:
     options: An instance of reader_pb2.Reader.
     is_training: If true, shuffle the dataset.
     input_pipeline_context: A tf.distribute.InputContext instance.
+    input_fields: A collection of the InputFields consumed by the model, None
+      to decode all the fields.
 
   Returns:
     A tf.data.Dataset object.
   """
-  dataset = tf.data.Dataset.list_files(options.input_pattern[:],
-                                       shuffle=is_training)
+  if options.compact_inputs and options.HasField('static_padding'):
+    raise ValueError('The static padding does not support compact inputs.')
+
+  shard = sharding.get_shard(options, input_pipeline_context)
+  dataset = sharding.read_records(options, is_training, shard)
 
   batch_size = options.batch_size
   if input_pipeline_context:
-    if input_pipeline_context.num_input_pipelines > 1:
-      dataset = dataset.shard(input_pipeline_context.num_input_pipelines,
-                              input_pipeline_context.input_pipeline_id)
     batch_size = input_pipeline_context.get_per_replica_batch_size(
         options.batch_size)
 
-  if is_training:
-    if options.cache_dataset:
-      dataset = dataset.cache()
-    dataset = dataset.repeat()
-    dataset = dataset.shuffle(options.shuffle_buffer_size)
-  dataset = dataset.interleave(tf.data.TFRecordDataset,
-                               cycle_length=options.interleave_cycle_length)
-
-  parse_fn = lambda x: _parse_single_example(x, options)
+  store = None
+  if (options.HasField('feature_store_dir') and
+      _requires_any(input_fields, [InputFields.detection_features])):
+    store = feature_store.FeatureStore(options.feature_store_dir)
+    if store.feature_dims != options.frcnn_feature_dims:
+      raise ValueError('The feature store has %i dims, expected %i.' %
+                       (store.feature_dims, options.frcnn_feature_dims))
+
+  # The token ids are looked up when the records are created.
+  vocab = None
+  if options.use_token_ids:
+    vocab = text_utils.Vocab(options.vocab_file,
+                             options.out_of_vocabulary_token_id)
+
+  parse_fn = lambda x: _parse_single_example(x, options, store, vocab,
+                                             input_fields)
   dataset = dataset.map(map_func=parse_fn,
                         num_parallel_calls=options.num_parallel_calls)
 
+  # The parsed evaluation examples are cached on disk, the warm runs skip the
+  # decoding.
+  if options.HasField('cache_dir') and not is_training:
+    if vocab is not None:
+      vocab_hash = vocab.hash
+    else:
+      vocab_hash = text_utils.Vocab(options.vocab_file,
+                                    options.out_of_vocabulary_token_id).hash
+    dataset = dataset.cache(
+        dataset_cache.get_cache_filename(options, vocab_hash, input_fields,
+                                         shard if shard[0] > 1 else None))
+
   padded_shapes = {
       InputFields.img_id: [],
       InputFields.annot_id: [],
@@ -348,20 +557,66 @@ def _create_dataset(options, is_training, input_pipeline_context=None):
       InputFields.mixed_rationale_choices_tag: -1,
       InputFields.mixed_rationale_choices_len: 0,
   }
-  dataset = dataset.padded_batch(batch_size,
-                                 padded_shapes=padded_shapes,
-                                 padding_values=padding_values,
-                                 drop_remainder=True)
+  # The tiled and mixed fields are assembled on device in the compact mode.
+  if options.compact_inputs:
+    padded_shapes.update({
+        InputFields.question: [None],
+        InputFields.question_tag: [None],
+        InputFields.question_len: [],
+    })
+    for name in [
+        InputFields.answer_len,
+        InputFields.mixed_answer_choices,
+        InputFields.mixed_answer_choices_tag,
+        InputFields.mixed_answer_choices_len,
+        InputFields.mixed_rationale_choices,
+        InputFields.mixed_rationale_choices_tag,
+        InputFields.mixed_rationale_choices_len,
+    ]:
+      padded_shapes.pop(name, None)
+      padding_values.pop(name, None)
+
+  if options.HasField('static_padding'):
+    static_padding.update_padded_shapes(padded_shapes, padding_values,
+                                        options.static_padding)
+
+  # Only the projected fields are batched.
+  output_names = tf.compat.v1.data.get_output_shapes(dataset).keys()
+  padded_shapes = dict((k, padded_shapes[k]) for k in output_names)
+  padding_values = dict((k, padding_values[k]) for k in output_names)
+
+  if is_training and options.bucket_boundaries:
+    bucket_boundaries = options.bucket_boundaries[:]
+    dataset = dataset.apply(
+        tf.data.experimental.bucket_by_sequence_length(
+            _get_sequence_length,
+            bucket_boundaries=bucket_boundaries,
+            bucket_batch_sizes=[batch_size] * (1 + len(bucket_boundaries)),
+            padded_shapes=padded_shapes,
+            padding_values=padding_values,
+            drop_remainder=True))
+  else:
+    # The evaluation can keep the last partial batch, padded to batch_size.
+    pad_last_batch = not is_training and options.pad_last_batch
+    dataset = dataset.padded_batch(batch_size,
+                                   padded_shapes=padded_shapes,
+                                   padding_values=padding_values,
+                                   drop_remainder=not pad_last_batch)
+    if pad_last_batch:
+      dataset = sharding.pad_last_batch(dataset, batch_size)
   dataset = dataset.prefetch(options.prefetch_buffer_size)
   return dataset
 
 
-def get_input_fn(options, is_training):
+def get_input_fn(options, is_training, input_fields=None):
   """Returns a function that generate input examples.
 
   Args:
     options: An instance of reader_pb2.Reader.
     is_training: If true, shuffle the dataset.
+    input_fields: A collection of the InputFields consumed by the model, see
+      `get_required_input_fields` in models/builder.py. None to decode all the
+      fields.
 
   Returns:
     input_fn: a callable that returns a dataset.
@@ -375,6 +630,9 @@ def get_input_fn(options, is_training):
     Returns:
       A dataset that can be fed to estimator.
     """
-    return _create_dataset(options, is_training, input_pipeline_context)
+    return _create_dataset(options,
+                           is_training,
+                           input_pipeline_context,
+                           input_fields=input_fields)
 
   return _input_fn
@@ -17,6 +17,7 @@ import PIL.Image
 import tensorflow as tf
 
 from bert import tokenization
+from readers import annotation_reader
 
 flags.DEFINE_string('annotations_jsonl_file', 'data/vcr1annots/val.jsonl',
                     'Path to the annotations file in jsonl format.')
@@ -24,19 +25,6 @@ flags.DEFINE_string('annotations_jsonl_file', 'data/vcr1annots/val.jsonl',
 FLAGS = flags.FLAGS
 
 
-def _load_annotations(filename):
-  """Loads annotations from file.
-
-  Args:
-    filename: Path to the jsonl annotations file.
-
-  Returns:
-    A list of python dictionary, each is parsed from a json object.
-  """
-  with tf.io.gfile.GFile(filename, 'r') as f:
-    return [json.loads(x.strip('\n')) for x in f]
-
-
 def uniq_tags(mixed_caption):
   tags = []
   for ch in mixed_caption:
@@ -48,9 +36,8 @@ def uniq_tags(mixed_caption):
 def main(_):
   logging.set_verbosity(logging.INFO)
 
-  # Load annotations.
-  annots = _load_annotations(FLAGS.annotations_jsonl_file)
-  logging.info('Loaded %i annotations.', len(annots))
+  # Stream annotations.
+  annots = annotation_reader.read_annotations(FLAGS.annotations_jsonl_file)
 
   bingo_answer = 0
   bingo_rationale = 0
@@ -83,11 +70,13 @@ def main(_):
     if rationale_scores[rationale_label] == rationale_scores.max():
       bingo_max_rationale += 1
 
-  print('Accuracy (answer): %.3lf' % (bingo_answer * 1.0 / len(annots)))
-  print('Accuracy (rationale): %.3lf' % (bingo_rationale * 1.0 / len(annots)))
-  print('Ratio (answer_max): %.3lf' % (bingo_max_answer * 1.0 / len(annots)))
+  num_annots = idx + 1
+  logging.info('Loaded %i annotations.', num_annots)
+  print('Accuracy (answer): %.3lf' % (bingo_answer * 1.0 / num_annots))
+  print('Accuracy (rationale): %.3lf' % (bingo_rationale * 1.0 / num_annots))
+  print('Ratio (answer_max): %.3lf' % (bingo_max_answer * 1.0 / num_annots))
   print('Ratio (rationale_max): %.3lf' %
-        (bingo_max_rationale * 1.0 / len(annots)))
+        (bingo_max_rationale * 1.0 / num_annots))
 
   logging.info('Done')
 
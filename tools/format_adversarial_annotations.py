@@ -1,20 +1,14 @@
 import json
 
+from readers import annotation_reader
+
 output_fn = 'data/adversarial_annotations/adversarial_annotations.jsonl'
 answer_fn = 'data/modified_annots/val_answer_shortcut/val_answer_shortcut.jsonl.new'
 rationale_fn = 'data/modified_annots_rationale/val_answer_shortcut/val_answer_shortcut_rationale.jsonl.new'
 
 
-def _read_jsonl_file(input_fn):
-  annots = []
-  with open(input_fn, 'r') as f:
-    for line in f:
-      annots.append(json.loads(line))
-  return annots
-
-
-answer_annots = _read_jsonl_file(answer_fn)
-rationale_annots = _read_jsonl_file(rationale_fn)
+answer_annots = annotation_reader.read_annotations(answer_fn)
+rationale_annots = annotation_reader.read_annotations(rationale_fn)
 
 with open(output_fn, 'w') as f:
   for answer_annot, rationale_annot in zip(answer_annots, rationale_annots):
@@ -1,18 +1,12 @@
 import json
 
+from readers import annotation_reader
+
 output_fn = 'data/adversarial_annotations/adversarial_annotations_for_training.jsonl'
 answer_fn = 'data/modified_annots/train_answer_shortcut/train_answer_shortcut_v2.jsonl'
 
 
-def _read_jsonl_file(input_fn):
-  annots = []
-  with open(input_fn, 'r') as f:
-    for line in f:
-      annots.append(json.loads(line))
-  return annots
-
-
-answer_annots = _read_jsonl_file(answer_fn)
+answer_annots = annotation_reader.read_annotations(answer_fn)
 
 with open(output_fn, 'w') as f:
   for answer_annot in answer_annots:
@@ -17,6 +17,7 @@ import PIL.Image
 import tensorflow as tf
 
 from bert import tokenization
+from readers import annotation_reader
 
 flags.DEFINE_string('annotations_jsonl_file', 'data/vcr1annots/val.jsonl',
                     'Path to the annotations file in jsonl format.')
@@ -41,19 +42,6 @@ FLAGS = flags.FLAGS
 MASKING_OFFSET = 10000
 
 
-def _load_annotations(filename):
-  """Loads annotations from file.
-
-  Args:
-    filename: Path to the jsonl annotations file.
-
-  Returns:
-    A list of python dictionary, each is parsed from a json object.
-  """
-  with tf.io.gfile.GFile(filename, 'r') as f:
-    return [json.loads(x.strip('\n')) for x in f]
-
-
 def _modify_annotation(choice_to_match, tokens, losses):
   """Modify annotations."""
 
@@ -100,11 +88,12 @@ def _modify_annotation(choice_to_match, tokens, losses):
 def main(_):
   logging.set_verbosity(logging.INFO)
 
-  annots = _load_annotations(FLAGS.annotations_jsonl_file)
-  adv_annots = _load_annotations(FLAGS.adversarial_annotations_jsonl_file)
+  # Only the adversarial annotations are kept in memory, for lookup.
+  annots = annotation_reader.read_annotations(FLAGS.annotations_jsonl_file)
+  adv_annots = annotation_reader.read_annotations(
+      FLAGS.adversarial_annotations_jsonl_file)
   adv_annots = dict([(x['annot_id'], x) for x in adv_annots])
 
-  logging.info('Loaded %i annotations.', len(annots))
   logging.info('Loaded %i adversarial annotations.', len(adv_annots))
 
   with tf.io.gfile.GFile(FLAGS.output_jsonl_file, 'w') as f:
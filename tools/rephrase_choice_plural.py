@@ -17,6 +17,7 @@ import PIL.Image
 import tensorflow as tf
 
 from bert import tokenization
+from readers import annotation_reader
 
 flags.DEFINE_string('annotations_jsonl_file', 'data/vcr1annots/val.jsonl',
                     'Path to the annotations file in jsonl format.')
@@ -33,19 +34,6 @@ flags.DEFINE_bool('modify_negatives', False,
 FLAGS = flags.FLAGS
 
 
-def _load_annotations(filename):
-  """Loads annotations from file.
-
-  Args:
-    filename: Path to the jsonl annotations file.
-
-  Returns:
-    A list of python dictionary, each is parsed from a json object.
-  """
-  with tf.io.gfile.GFile(filename, 'r') as f:
-    return [json.loads(x.strip('\n')) for x in f]
-
-
 def get_the_only_person_group(mixed_caption, classes):
   """Gets the person group mentioned in the sentence.
 
@@ -134,14 +122,15 @@ def modify_choices(detection_classes, question, choices, label):
 def main(_):
   logging.set_verbosity(logging.INFO)
 
-  annots = _load_annotations(FLAGS.annotations_jsonl_file)
-  logging.info('Loaded %i annotations.', len(annots))
+  annots = annotation_reader.read_annotations(FLAGS.annotations_jsonl_file)
 
+  num_annots = 0
   count = 0
   count_replaced_answer_choices = 0
   count_replaced_rationale_choices = 0
   with tf.io.gfile.GFile(FLAGS.output_jsonl_file, 'w') as f:
     for idx, annot in enumerate(annots):
+      num_annots = idx + 1
       (question, answer_choices, answer_label, rationale_choices,
        rationale_label,
        detection_classes) = (annot['question'], annot['answer_choices'],
@@ -178,7 +167,7 @@ def main(_):
       annot['rationale_choices'] = new_rationale_choices
       f.write(json.dumps(annot) + '\n')
 
-  logging.info('Found %s / %s.', count, len(annots))
+  logging.info('Found %s / %s.', count, num_annots)
   logging.info('Replaced %s / %s answer choices.',
                count_replaced_answer_choices, 4 * count)
   logging.info('Replaced %s / %s rationale choices.',